@@ -18,6 +18,10 @@ class Analyzer:
     -------
     analyze_replay_results(replay_results, data)
         Function that analyze the results of ReplayBG replay simulation.
+    analyze_paired_differences(replay_results, reference_replay_results)
+        Function that analyzes the differences between two replays of the same twin, realization by realization.
+    realization_metrics(replay_results)
+        Function that computes the metrics of each realization of a replay.
     """
 
     def __init__(self):
@@ -294,3 +298,137 @@ class Analyzer:
         replay_results['rbg_data'].t_data = np.concatenate(t_data, axis=0)
 
         return Analyzer.analyze_replay_results(replay_results=replay_results, data=data)
+
+    @staticmethod
+    def analyze_paired_differences(
+            replay_results: Dict,
+            reference_replay_results: Dict,
+    ) -> Dict:
+        """
+        Function that analyzes the differences between the results of two replays of the same twin (e.g., two DSS
+        configurations replayed by `ReplayBG.compare_scenarios`), realization by realization. Each metric is computed
+        for each realization of both replays, and the differences between paired realizations (i.e., the ones with the
+        same index, which share the model parameters and the random streams) are summarized.
+
+        Parameters
+        ----------
+        replay_results: dict
+            The replayed scenario results (see `analyze_replay_results`).
+        reference_replay_results: dict
+            The replayed scenario results to compare against, with the same number of realizations.
+
+        Returns
+        -------
+        paired_differences: Dict
+            A dictionary containing, for each metric (i.e., 'mean_glucose', 'time_in_target', 'time_in_hypoglycemia',
+            'time_in_l2_hypoglycemia', 'time_in_hyperglycemia', 'time_in_l2_hyperglycemia' of the glucose traces, and
+            the event metrics of `analyze_replay_results`), a dictionary with fields:
+            realizations: np.ndarray
+                The difference of each realization from the paired reference realization.
+            mean: float
+                The mean difference.
+            median: float
+                The median difference.
+            sd: float
+                The standard deviation of the differences.
+            se: float
+                The standard error of the mean difference.
+            mean_ci95: np.ndarray
+                The 95% confidence interval of the mean difference.
+            variance_reduction: float
+                The ratio between the variance of the difference of two independent replays and the variance of the
+                paired differences, i.e., how many times more realizations independent replays would need to
+                estimate the mean difference as precisely.
+
+        Raises
+        ------
+        Exception
+            If the two replays have a different number of realizations.
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        metrics = Analyzer.realization_metrics(replay_results)
+        reference_metrics = Analyzer.realization_metrics(reference_replay_results)
+        n = replay_results['glucose']['realizations'].shape[0]
+        if reference_replay_results['glucose']['realizations'].shape[0] != n:
+            raise Exception("The replays to compare must have the same number of realizations.")
+
+        paired_differences = dict()
+        for m in metrics:
+            d = metrics[m] - reference_metrics[m]
+            sd = np.std(d, ddof=1) if n > 1 else np.nan
+            se = sd / np.sqrt(n)
+
+            # The variance of the difference of two independent replays is the sum of their variances
+            unpaired_var = np.var(metrics[m], ddof=1) + np.var(reference_metrics[m], ddof=1) if n > 1 else np.nan
+            with np.errstate(divide='ignore', invalid='ignore'):
+                variance_reduction = unpaired_var / sd ** 2
+
+            paired_differences[m] = dict()
+            paired_differences[m]['realizations'] = d
+            paired_differences[m]['mean'] = np.mean(d)
+            paired_differences[m]['median'] = np.median(d)
+            paired_differences[m]['sd'] = sd
+            paired_differences[m]['se'] = se
+            paired_differences[m]['mean_ci95'] = np.array([np.mean(d) - 1.96 * se, np.mean(d) + 1.96 * se])
+            paired_differences[m]['variance_reduction'] = variance_reduction
+
+        return paired_differences
+
+    @staticmethod
+    def realization_metrics(replay_results: Dict) -> Dict:
+        """
+        Computes the metrics compared by `analyze_paired_differences` for each realization of a replay, at once. The
+        time in ranges (%) follow the glycemic targets used by Agata for diabetes.
+
+        Parameters
+        ----------
+        replay_results: dict
+            A dictionary containing the results of the replay (at least the realizations of glucose, insulin_bolus,
+            insulin_basal, correction_bolus, cho, and hypotreatments).
+
+        Returns
+        -------
+        metrics: dict
+            A dictionary containing, for each metric, the array of its values in each realization.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        glucose = replay_results['glucose']['realizations']
+
+        metrics = dict()
+        metrics['mean_glucose'] = np.mean(glucose, axis=1)
+        metrics['time_in_target'] = 100 * np.mean((glucose > 70) & (glucose < 180), axis=1)
+        metrics['time_in_hypoglycemia'] = 100 * np.mean(glucose <= 70, axis=1)
+        metrics['time_in_l2_hypoglycemia'] = 100 * np.mean(glucose <= 54, axis=1)
+        metrics['time_in_hyperglycemia'] = 100 * np.mean(glucose >= 180, axis=1)
+        metrics['time_in_l2_hyperglycemia'] = 100 * np.mean(glucose >= 250, axis=1)
+
+        metrics['total_insulin'] = (np.sum(replay_results['insulin_bolus']['realizations'], axis=1)
+                                    + np.sum(replay_results['insulin_basal']['realizations'], axis=1))
+        metrics['total_bolus_insulin'] = np.sum(replay_results['insulin_bolus']['realizations'], axis=1)
+        metrics['total_basal_insulin'] = np.sum(replay_results['insulin_basal']['realizations'], axis=1)
+        metrics['total_correction_bolus_insulin'] = np.sum(replay_results['correction_bolus']['realizations'], axis=1)
+        metrics['total_cho'] = np.sum(replay_results['cho']['realizations'], axis=1)
+        metrics['total_hypotreatments'] = np.sum(replay_results['hypotreatments']['realizations'], axis=1)
+        metrics['correction_bolus_insulin_number'] = np.count_nonzero(
+            replay_results['correction_bolus']['realizations'], axis=1)
+        metrics['hypotreatment_number'] = np.count_nonzero(replay_results['hypotreatments']['realizations'], axis=1)
+
+        return metrics
@@ -1,7 +1,11 @@
 from typing import Callable, Dict
 
+import numpy as np
+
 from py_replay_bg.dss.default_dss_handlers import default_meal_generator_handler, standard_bolus_calculator_handler, \
     default_basal_handler, ada_hypotreatments_handler, corrects_above_250_handler, no_ip_handler, no_ra_handler
+from py_replay_bg.dss.batch_dss import batched_handler, batch_random
+from py_replay_bg.dss.handler_context import HandlerContext, context_handler
 
 
 class DSS:
@@ -19,26 +23,26 @@ class DSS:
         A mutable dictionary that contains the parameters to pass to the meal_generator_handler function.
     bolus_calculator_handler: Callable
         A callback function that implements a bolus calculator to be used during the replay of a given scenario.
-    bolus_calculator_handler_params: dict
+    bolus_calculator_handler_params: dict | np.ndarray
         A mutable dictionary that contains the parameters to pass to the bolusCalculatorHandler function. It also
         serves as memory area for the bolusCalculatorHandler function.
     basal_handler: Callable
         A callback function that implements a basal controller to be used during the replay of a given scenario.
-    basal_handler_params: dict
+    basal_handler_params: dict | np.ndarray
         A mutable dictionary that contains the parameters to pass to the basalHandler function. It also serves as
         memory area for the basalHandler function.
     enable_hypotreatments: boolean
         A flag that specifies whether to enable hypotreatments during the replay of a given scenario.
     hypotreatments_handler: Callable
         A callback function that implements a hypotreatment strategy during the replay of a given scenario.
-    hypotreatments_handler_params: dict
+    hypotreatments_handler_params: dict | np.ndarray
         A mutable dictionary that contains the parameters to pass to the hypoTreatmentsHandler function. It also
         serves as memory area for the hypoTreatmentsHandler function.
     enable_correction_boluses: boolean
         A flag that specifies whether to enable correction boluses during the replay of a given scenario.
     correction_boluses_handler: Callable
         A callback function that implements a corrective bolusing strategy during the replay of a given scenario.
-    correction_boluses_handler_params: dict
+    correction_boluses_handler_params: dict | np.ndarray
         A mutable dictionary that contains the parameters to pass to the correctionBolusesHandler function. It also
         serves as memory area for the correctionBolusesHandler function.
     enable_forcing_ip: boolean, optional, default : False
@@ -55,6 +59,10 @@ class DSS:
     forcing_ra_handler_params: dict, optional, default : None
         A dictionary that contains the parameters to pass to the forcing_ra_handler function. It also serves
         as memory area for the forcing_ra_handler function.
+    handler_cadence: dict
+        The cadence of each handler, keyed by handler name (e.g., 'basal_handler'): either an integer N (every N
+        minutes), 'cgm' (at each new CGM sample), or 'meal_announcement' (only when a meal is announced). Handlers not
+        in the dictionary are called every minute.
 
     Methods
     -------
@@ -66,21 +74,22 @@ class DSS:
                  meal_generator_handler: Callable = default_meal_generator_handler,
                  meal_generator_handler_params: Dict | None = None,
                  bolus_calculator_handler: Callable = standard_bolus_calculator_handler,
-                 bolus_calculator_handler_params: Dict | None = None,
+                 bolus_calculator_handler_params: Dict | np.ndarray | None = None,
                  basal_handler: Callable = default_basal_handler,
-                 basal_handler_params: Dict | None = None,
+                 basal_handler_params: Dict | np.ndarray | None = None,
                  enable_hypotreatments: bool = False,
                  hypotreatments_handler: Callable = ada_hypotreatments_handler,
-                 hypotreatments_handler_params: Dict | None = None,
+                 hypotreatments_handler_params: Dict | np.ndarray | None = None,
                  enable_correction_boluses: bool = False,
                  correction_boluses_handler: Callable = corrects_above_250_handler,
-                 correction_boluses_handler_params: Dict | None = None,
+                 correction_boluses_handler_params: Dict | np.ndarray | None = None,
                  enable_forcing_ip: bool = False,
                  forcing_ip_handler: Callable = no_ip_handler,
                  forcing_ip_handler_params: Dict | None = None,
                  enable_forcing_ra: bool = False,
                  forcing_ra_handler: Callable = no_ra_handler,
                  forcing_ra_handler_params: Dict | None = None,
+                 handler_cadence: Dict | None = None,
                  ):
         """
         Constructs all the necessary attributes for the DSS object.
@@ -95,26 +104,26 @@ class DSS:
             A mutable dictionary that contains the parameters to pass to the meal_generator_handler function.
         bolus_calculator_handler: Callable, optional, default : standard_bolus_calculator_handler
             A callback function that implements a bolus calculator to be used during the replay of a given scenario.
-        bolus_calculator_handler_params: dict, optional, default : None
+        bolus_calculator_handler_params: dict | np.ndarray, optional, default : None
             A mutable dictionary that contains the parameters to pass to the bolusCalculatorHandler function. It also
             serves as memory area for the bolusCalculatorHandler function.
         basal_handler: function, Callable, default : default_basal_handler
             A callback function that implements a basal controller to be used during the replay of a given scenario.
-        basal_handler_params: dict, optional, default : None
+        basal_handler_params: dict | np.ndarray, optional, default : None
             A mutable dictionary that contains the parameters to pass to the basalHandler function. It also serves as
             memory area for the basalHandler function.
         enable_hypotreatments: boolean, optional, default : False
             A flag that specifies whether to enable hypotreatments during the replay of a given scenario.
         hypotreatments_handler: Callable, optional, default : ada_hypotreatments_handler
             A callback function that implements a hypotreatment strategy during the replay of a given scenario.
-        hypotreatments_handler_params: dict, optional, default : None
+        hypotreatments_handler_params: dict | np.ndarray, optional, default : None
             A mutable dictionary that contains the parameters to pass to the hypoTreatmentsHandler function. It also
             serves as memory area for the hypoTreatmentsHandler function.
         enable_correction_boluses: boolean, optional, default : False
             A flag that specifies whether to enable correction boluses during the replay of a given scenario.
         correction_boluses_handler: Callable, optional, default : corrects_above_250_handler
             A callback function that implements a corrective bolusing strategy during the replay of a given scenario.
-        correction_boluses_handler_params: dict, optional, default : None
+        correction_boluses_handler_params: dict | np.ndarray, optional, default : None
             A mutable dictionary that contains the parameters to pass to the correctionBolusesHandler function.
             It also serves as memory area for the correctionBolusesHandler function.
         enable_forcing_ip: boolean, optional, default : False
@@ -131,6 +140,11 @@ class DSS:
         forcing_ra_handler_params: dict, optional, default : None
             A dictionary that contains the parameters to pass to the forcing_ra_handler function. It also serves
             as memory area for the forcing_ra_handler function.
+        handler_cadence: dict, optional, default : None
+            The cadence of each handler, keyed by handler name (e.g., 'basal_handler'): either an integer N (every N
+            minutes), 'cgm' (at each new CGM sample), or 'meal_announcement' (only when a meal is announced). Between
+            two calls, the basal and forcing handlers keep their last output, while the others output nothing. If
+            None, all the handlers are called every minute.
         """
 
         # Patient's body weight
@@ -167,3 +181,6 @@ class DSS:
         self.enable_forcing_ra = enable_forcing_ra
         self.forcing_ra_handler = forcing_ra_handler
         self.forcing_ra_handler_params = forcing_ra_handler_params if forcing_ra_handler_params is not None else {}
+
+        # Cadence of the handlers
+        self.handler_cadence = handler_cadence if handler_cadence is not None else {}
@@ -0,0 +1,338 @@
+import copy
+from typing import Callable
+
+import numpy as np
+
+from py_replay_bg.dss.handler_context import HandlerContext
+from py_replay_bg.dss.handler_scheduler import HandlerScheduler
+
+
+def batched_handler(handler: Callable) -> Callable:
+    """
+    Marks a DSS handler as batched, i.e., as a handler that processes all the realizations of a lockstep batched
+    replay at once (see `BatchDSS`).
+
+    A batched handler has the same signature of the corresponding scalar handler, but each per-realization history
+    (e.g., `glucose`, `meal_announcement`, `meal_type`, `hypotreatments`, `bolus`, `basal`) is a (n, time_index + 1)
+    matrix whose r-th row is the history of the r-th realization, while `time`, `time_index`, and `dss` are shared.
+    It must return an array of n values (one per realization) in place of each scalar output, followed by `dss`. A
+    batched handler can also be a context handler (see `context_handler`), whose context histories are then such
+    matrices.
+
+    Parameters
+    ----------
+    handler: Callable
+        The handler to mark as batched.
+
+    Returns
+    -------
+    handler: Callable
+        The same handler, marked as batched.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    None
+
+    Examples
+    --------
+    >>> @batched_handler
+    ... def batched_basal_handler(glucose, meal_announcement, meal_type, hypotreatments, bolus, basal, time,
+    ...                           time_index, dss):
+    ...     return np.where(glucose[:, time_index] < 70, 0, 0.01), dss
+    """
+    handler.batched = True
+    return handler
+
+
+def is_batched(handler: Callable) -> bool:
+    """
+    Returns whether the given DSS handler is batched (see `batched_handler`).
+    """
+    return getattr(handler, 'batched', False)
+
+
+class BatchRandom:
+    """
+    A class whose only instance, `batch_random`, is the random generator of the batched handlers (see
+    `batched_handler`).
+
+    Each method of the legacy numpy random API (e.g., `batch_random.uniform(0.005, 0.015)`) draws once per realization
+    of the lockstep batch being replayed, from the global numpy random state of that realization (see `BatchDSS`), and
+    returns the n draws stacked along the first axis. A batched handler drawing from `batch_random` thus gets, for each
+    realization, the same draws the corresponding scalar handler gets from `np.random` in the serial replay, whatever
+    the size of the batch.
+
+    ...
+    Attributes
+    ----------
+    n: int | None
+        The number of realizations of the batched handler being called, or None outside the batched handlers.
+    random_states: list | None
+        The states of the global numpy random generator of each realization, or None if the realizations draw from the
+        global numpy random state as it is.
+    due: np.ndarray
+        The realizations for which the handler being called is due, whose random states are advanced.
+
+    Methods
+    -------
+    start(n, random_states, due)
+        Starts drawing for the given realizations.
+    stop()
+        Stops drawing, advancing the random states of the realizations for which the handler was due.
+    """
+
+    def __init__(self):
+        """
+        Constructs all the necessary attributes for the BatchRandom object.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        self.n = None
+        self.random_states = None
+        self.due = None
+
+        # The random generators of the realizations (created at the first draw of each call)
+        self.__generators = None
+
+    def start(self, n: int, random_states: list | None, due: np.ndarray) -> None:
+        """
+        Starts drawing for the given realizations.
+        """
+        self.n, self.random_states, self.due = n, random_states, due
+        self.__generators = None
+
+    def stop(self) -> None:
+        """
+        Stops drawing, advancing the random states of the realizations for which the handler was due.
+        """
+        if self.__generators is not None:
+            for r in np.flatnonzero(self.due):
+                self.random_states[r] = self.__generators[r].get_state()
+        self.n, self.random_states, self.due = None, None, None
+        self.__generators = None
+
+    def __getattr__(self, name: str) -> Callable:
+        method = getattr(np.random.RandomState, name)
+
+        def draw(*args, **kwargs) -> np.ndarray:
+            if self.n is None:
+                raise Exception("'batch_random' can be used only by the batched handlers of a lockstep replay.")
+            if self.random_states is None:
+                return np.array([getattr(np.random, name)(*args, **kwargs) for _ in range(self.n)])
+            if self.__generators is None:
+                self.__generators = [np.random.RandomState() for _ in range(self.n)]
+                for generator, random_state in zip(self.__generators, self.random_states):
+                    generator.set_state(random_state)
+            return np.array([method(generator, *args, **kwargs) for generator in self.__generators])
+
+        return draw
+
+
+# The random generator of the batched handlers
+batch_random = BatchRandom()
+
+
+class BatchDSS:
+    """
+    A class that calls the DSS handlers once per step for all the realizations of a lockstep batched replay.
+
+    Batched handlers (see `batched_handler`) are called once with the histories of all the realizations and share the
+    given dss. Scalar handlers are called once per realization through a compatibility shim: each realization gets
+    its own copy of the dss (i.e., its own memory area) and, if given, its own state of the global numpy random
+    generator, as in the serial and parallel replays, so that the scalar handlers give the same results as there.
+    Batched handlers draw from the state of each realization through `batch_random`, so that they get the same draws
+    too. If they draw from `np.random` instead, they draw from a stream shared by the whole batch, so that their draws
+    differ from those of the serial replays and depend on the size of the batch. The handlers are called according to
+    their cadence (see `HandlerScheduler`): if it depends on the meal announcements, a scalar handler is called only for
+    the realizations for which it is due, while a batched handler is called for all of them whenever it is due for any,
+    and its outputs for the others are discarded (and so are its draws from `batch_random`).
+
+    ...
+    Attributes
+    ----------
+    dss: DSS
+        An object that represents the hyperparameters of the integrated decision support system (shared by the batched
+        handlers).
+    n: int
+        The number of realizations.
+    random_states: list | None
+        The states of the global numpy random generator the handlers of each realization draw from.
+    scheduler: HandlerScheduler
+        The object that decides at which steps each handler is called.
+
+    Methods
+    -------
+    meal_generator_handler(context):
+        Calls the meal generator handler.
+    bolus_calculator_handler(context):
+        Calls the bolus calculator handler.
+    basal_handler(context):
+        Calls the basal handler.
+    hypotreatments_handler(context):
+        Calls the hypotreatments handler.
+    correction_boluses_handler(context):
+        Calls the correction boluses handler.
+    forcing_ip_handler(context):
+        Calls the forcing ip handler.
+    forcing_ra_handler(context):
+        Calls the forcing ra handler.
+    """
+
+    def __init__(self, dss, n: int, yts: int, random_states: list | None = None):
+        """
+        Constructs all the necessary attributes for the BatchDSS object.
+
+        Parameters
+        ----------
+        dss: DSS
+            An object that represents the hyperparameters of the integrated decision support system.
+        n: int
+            The number of realizations.
+        yts: int
+            The CGM sample time (min).
+        random_states: list, optional, default : None
+            The states of the global numpy random generator (see `np.random.get_state`) the handlers of each
+            realization draw from (the batched ones through `batch_random`). If None, the handlers draw from the
+            global numpy random state as it is.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        self.dss = dss
+        self.n = n
+        self.random_states = random_states
+        self.scheduler = HandlerScheduler(dss.handler_cadence, yts)
+
+        # The copies of the dss used by the scalar handlers, one per realization (created at the first call)
+        self.__dss_copies = None
+
+    def meal_generator_handler(self, context: HandlerContext) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Calls the meal generator handler and returns the CHO (g/min), the announced CHO (g), and the type of the meal
+        of each realization.
+        """
+        ch, ma, t = self.__call('meal_generator_handler', context)
+        return ch, ma, t.astype(str)
+
+    def bolus_calculator_handler(self, context: HandlerContext) -> np.ndarray:
+        """
+        Calls the bolus calculator handler and returns the insulin bolus (U/min) of each realization.
+        """
+        return self.__call('bolus_calculator_handler', context)[0]
+
+    def basal_handler(self, context: HandlerContext) -> np.ndarray:
+        """
+        Calls the basal handler and returns the basal insulin (U/min) of each realization.
+        """
+        return self.__call('basal_handler', context)[0]
+
+    def hypotreatments_handler(self, context: HandlerContext) -> np.ndarray:
+        """
+        Calls the hypotreatments handler and returns the hypotreatment (g/min) of each realization.
+        """
+        return self.__call('hypotreatments_handler', context)[0]
+
+    def correction_boluses_handler(self, context: HandlerContext) -> np.ndarray:
+        """
+        Calls the correction boluses handler and returns the correction bolus (U/min) of each realization.
+        """
+        return self.__call('correction_boluses_handler', context)[0]
+
+    def forcing_ip_handler(self, context: HandlerContext) -> np.ndarray:
+        """
+        Calls the forcing ip handler and returns the forcing ip of each realization.
+        """
+        return self.__call('forcing_ip_handler', context, ('forcing_ip',))[0]
+
+    def forcing_ra_handler(self, context: HandlerContext) -> np.ndarray:
+        """
+        Calls the forcing ra handler and returns the forcing ra of each realization.
+        """
+        return self.__call('forcing_ra_handler', context, ('forcing_ra',))[0]
+
+    def __call(self, name: str, context: HandlerContext, histories: tuple = ()) -> list[np.ndarray]:
+        """
+        Internal function that calls the handler `name` with the given context (see `HandlerContext.call`, where
+        `histories` are the additional histories of the handler) and returns its outputs (but the dss) as arrays of n
+        values. Scalar handlers get the context of each realization in turn.
+        """
+        handler = getattr(self.dss, name)
+
+        # Skip the call if the handler is not due for any realization
+        due = np.broadcast_to(self.scheduler.is_due(name, context), (self.n,))
+        skipped = [np.broadcast_to(np.asarray(output), (self.n,)) for output in self.scheduler.skipped_outputs(name)]
+        if not np.any(due):
+            return skipped
+
+        if name == 'meal_generator_handler':
+            def call(c, dss):
+                return c.call_meal_generator(handler, dss)
+        else:
+            def call(c, dss):
+                return c.call(handler, dss, *histories, state=getattr(dss, name + '_params'))
+
+        if is_batched(handler):
+            # The batched handler draws from the random state of each realization through batch_random
+            batch_random.start(self.n, self.random_states, due)
+            try:
+                *outputs, self.dss = call(context, self.dss)
+            finally:
+                batch_random.stop()
+            outputs = [np.where(due, output, skip) for output, skip in zip(outputs, skipped)]
+        else:
+            # Compatibility shim for scalar handlers: call the handler for each realization, with its own dss and its
+            # own random state (the shared one is restored afterwards)
+            if self.__dss_copies is None:
+                self.__dss_copies = [copy.deepcopy(self.dss) for _ in range(self.n)]
+            if self.random_states is not None:
+                random_state = np.random.get_state()
+            outputs = [list(skip) for skip in skipped]
+            for r in np.flatnonzero(due):
+                if self.random_states is not None:
+                    np.random.set_state(self.random_states[r])
+                *realization_outputs, self.__dss_copies[r] = call(context.realization(r), self.__dss_copies[r])
+                if self.random_states is not None:
+                    self.random_states[r] = np.random.get_state()
+                for o, output in enumerate(realization_outputs):
+                    outputs[o][r] = output
+            if self.random_states is not None:
+                np.random.set_state(random_state)
+            outputs = [np.array(output) for output in outputs]
+
+        self.scheduler.hold(name, outputs)
+        return outputs
@@ -0,0 +1,158 @@
+from typing import Callable
+
+import numpy as np
+
+from numba import njit
+from numba.core.dispatcher import Dispatcher
+
+
+# The handlers that can be compiled, in the order used by the compiled closed loop
+COMPILED_HANDLERS = ('bolus_calculator_handler', 'basal_handler', 'hypotreatments_handler',
+                     'correction_boluses_handler')
+
+
+def is_compiled_handler(handler: Callable) -> bool:
+    """
+    Returns whether the given DSS handler is a compiled handler, i.e., a numba `@njit` function with signature
+    `handler(glucose, meal_announcement, hypotreatments, bolus, basal, time, time_index, state)` that returns the
+    output of the handler (a float) and keeps its memory in the NumPy array `state` (see `handler_state`).
+    """
+    return isinstance(handler, Dispatcher)
+
+
+def handler_state(params) -> np.ndarray:
+    """
+    Returns the state of a compiled handler given its params: the params themselves if they are a 1-D NumPy array
+    (e.g., a float array, or a one-element structured array used as a typed record), otherwise an empty state (i.e., a
+    single float that is not kept between calls).
+    """
+    return params if isinstance(params, np.ndarray) else np.zeros(1)
+
+
+@njit(cache=True, nogil=True)
+def no_handler(glucose, meal_announcement, hypotreatments, bolus, basal, time, time_index, state):
+    """
+    Compiled handler that does nothing, used in place of the disabled handlers in the compiled closed loop.
+    """
+    return 0.0
+
+
+@njit(cache=True)
+def _seed(seed):
+    np.random.seed(seed)
+
+
+def seed_compiled_handlers(seed_sequence: np.random.SeedSequence) -> None:
+    """
+    Seeds the random generator the compiled handlers draw from (i.e., the one of numba, which is separate from the
+    global numpy random state) from the given seed sequence.
+    """
+    _seed(seed_sequence.generate_state(1)[0])
+
+
+def can_compile(dss, rbg_data, custom_forcing_Ra) -> bool:
+    """
+    Returns whether the closed loop of a replay can run in a single compiled call, i.e., whether all the enabled
+    handlers are compiled and no meal generator, forcing input, or custom Ra is used.
+    """
+    enabled = [rbg_data.bolus_source == 'dss', rbg_data.basal_source == 'dss', dss.enable_hypotreatments,
+               dss.enable_correction_boluses]
+    return (rbg_data.cho_source != 'generated' and not dss.enable_forcing_ip and not dss.enable_forcing_ra
+            and custom_forcing_Ra is None and any(enabled)
+            and all(is_compiled_handler(getattr(dss, name)) for name, on in zip(COMPILED_HANDLERS, enabled) if on))
+
+
+def compiled_controls(dss, rbg_data, n: int, tsteps: int, yts: int) -> tuple:
+    """
+    Returns the arguments of the compiled closed loop that describe the handlers, i.e., the four handlers (see
+    `COMPILED_HANDLERS`, with `no_handler` in place of the disabled ones), the four (n, ...) matrices of their states
+    (a copy of the 1-D state of the dss for each realization, as each realization starts from its own copy of the dss
+    in the other replay modes), and the (4, tsteps) boolean matrix that tells at which time
+    indices each handler is called (according to the cadence of the dss, see `HandlerScheduler`).
+    """
+    enabled = [rbg_data.bolus_source == 'dss', rbg_data.basal_source == 'dss', dss.enable_hypotreatments,
+               dss.enable_correction_boluses]
+
+    # The meal announcements come from data, so that the steps at which each handler is called are known in advance
+    time_index = np.arange(tsteps)
+    due = np.zeros((len(COMPILED_HANDLERS), tsteps), dtype=bool)
+
+    handlers = []
+    states = []
+    for h, name in enumerate(COMPILED_HANDLERS):
+        cadence = dss.handler_cadence.get(name, 1)
+        if enabled[h]:
+            if cadence == 'meal_announcement':
+                due[h] = rbg_data.meal_announcement > 0
+            else:
+                due[h] = time_index % (yts if cadence == 'cgm' else cadence) == 0
+        handlers.append(getattr(dss, name) if enabled[h] else no_handler)
+        state = handler_state(getattr(dss, name + '_params'))
+        if state.ndim != 1:
+            raise Exception("The params of the compiled handler '" + name + "' must be a 1-D NumPy array.")
+        states.append(np.tile(state, (n, 1)))
+
+    return *handlers, *states, due, np.array(enabled)
+
+
+@njit(nogil=True)
+def closed_loop_controls(k, tau, IG, meal_announcement, hypotreatments, bolus, basal, bolus_g, basal_g,
+                         correction_bolus, bolus_delayed, basal_delayed, hypotreatments_input, t_hour, to_g, to_mgkg,
+                         held_basal,
+                         bolus_calculator_handler, basal_handler, hypotreatments_handler, correction_boluses_handler,
+                         bolus_calculator_state, basal_state, hypotreatments_state, correction_boluses_state,
+                         due, enabled):
+    """
+    Internal function that calls the compiled handlers of each realization of a compiled closed loop at step k and
+    adds their outputs to the inputs, as the replay loop does. `hypotreatments_input` is the (delayed) input that
+    receives the hypotreatments. Not fastmath, so that the results are the same of the replay loop.
+    """
+    tsteps = IG.shape[1]
+    for r in range(IG.shape[0]):
+
+        # Convert the last sample of the insulin histories
+        bolus_g[r, k - 1] = bolus[r, k - 1] * to_g
+        basal_g[r, k - 1] = basal[r, k - 1] * to_g
+
+        glucose = IG[r, :k]
+        announcements = meal_announcement[r, :k]
+        hypos = hypotreatments[r, :k]
+        boluses = bolus_g[r, :k]
+        basals = basal_g[r, :k]
+        time = t_hour[:k]
+        d = k + tau[r]
+
+        # Bolus generation module
+        if due[0, k - 1]:
+            bo_mgkg = bolus_calculator_handler(glucose, announcements, hypos, boluses, basals, time, k - 1,
+                                               bolus_calculator_state[r]) * to_mgkg
+            if d < tsteps:
+                bolus_delayed[r, d] = bolus_delayed[r, d] + bo_mgkg
+            bolus[r, k] = bolus[r, k] + bo_mgkg
+
+        # Basal rate generation module (the basal rate is held between two calls)
+        if enabled[1]:
+            if due[1, k - 1]:
+                held_basal[r] = basal_handler(glucose, announcements, hypos, boluses, basals, time, k - 1,
+                                              basal_state[r])
+            ba_mgkg = held_basal[r] * to_mgkg
+            if d < tsteps:
+                basal_delayed[r, d] = basal_delayed[r, d] + ba_mgkg
+            basal[r, k] = basal[r, k] + ba_mgkg
+
+        # Hypotreatment generation module
+        if due[2, k - 1]:
+            ht = hypotreatments_handler(glucose, announcements, hypos, boluses, basals, time, k - 1,
+                                        hypotreatments_state[r])
+            hypotreatments_input[r, k] = hypotreatments_input[r, k] + ht * to_mgkg
+            hypotreatments[r, k] = hypotreatments[r, k] + ht
+
+        # Correction bolus delivery module
+        if due[3, k - 1]:
+            cb = correction_boluses_handler(glucose, announcements, hypos, boluses, basals, time, k - 1,
+                                            correction_boluses_state[r])
+            cb_mgkg = cb * to_mgkg
+            if d < tsteps:
+                bolus_delayed[r, d] = bolus_delayed[r, d] + cb_mgkg
+            bolus[r, k] = bolus[r, k] + cb_mgkg
+            correction_bolus[r, k] = correction_bolus[r, k] + cb
@@ -0,0 +1,278 @@
+import copy
+from typing import Callable
+
+import numpy as np
+
+from py_replay_bg.dss.compiled_handlers import is_compiled_handler, handler_state
+
+
+def context_handler(handler: Callable) -> Callable:
+    """
+    Marks a DSS handler as a context handler, i.e., as a handler that gets the histories of the replay through a
+    `HandlerContext` instead of as positional arguments.
+
+    A context handler has signature `handler(context, dss)` and returns the same outputs of the corresponding
+    positional handler (e.g., `bolus, dss` for a bolus calculator). The meal generator gets the blueprint as
+    `context.blueprint`.
+
+    Parameters
+    ----------
+    handler: Callable
+        The handler to mark as a context handler.
+
+    Returns
+    -------
+    handler: Callable
+        The same handler, marked as a context handler.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    None
+
+    Examples
+    --------
+    >>> @context_handler
+    ... def basal_handler(context, dss):
+    ...     return (0 if context.glucose[context.time_index] < 70 else 0.01), dss
+    """
+    handler.uses_context = True
+    return handler
+
+
+def is_context_handler(handler: Callable) -> bool:
+    """
+    Returns whether the given DSS handler is a context handler (see `context_handler`).
+    """
+    return getattr(handler, 'uses_context', False)
+
+
+class HandlerContext:
+    """
+    A class that exposes the histories of a replay to the DSS handlers without copying them.
+
+    Each history is a read-only view, up to the current time index, of an array that grows as the simulation goes on.
+    The insulin and meal histories are converted to the units the handlers expect (i.e., U/min and g/min)
+    incrementally, one sample per step, instead of being converted as a whole at each call. The histories can be
+    either vectors (one replay) or (n, tsteps) matrices (n realizations replayed in lockstep), while `time` is always a
+    vector.
+
+    ...
+    Attributes
+    ----------
+    glucose: np.ndarray
+        The glucose history (mg/dl).
+    meal: np.ndarray
+        The meal history (g/min).
+    meal_type: np.ndarray
+        The history of the meal types.
+    meal_announcement: np.ndarray
+        The history of the meal announcements (g).
+    hypotreatments: np.ndarray
+        The hypotreatments history (g/min).
+    bolus: np.ndarray
+        The insulin bolus history (U/min).
+    basal: np.ndarray
+        The basal insulin history (U/min).
+    time: np.ndarray
+        The time history (hours).
+    forcing_ip: np.ndarray
+        The forcing ip history.
+    forcing_ra: np.ndarray
+        The forcing ra history.
+    time_index: int
+        The current time index, i.e., the index of the last sample of each history.
+    blueprint: str
+        The blueprint of the model.
+
+    Methods
+    -------
+    advance(time_index)
+        Moves the context to the given time index.
+    realization(r)
+        Returns the context of the r-th realization.
+    arguments(*histories)
+        Returns the positional arguments of a handler.
+    meal_generator_arguments()
+        Returns the positional arguments of a meal generator handler.
+    call(handler, dss, *histories, state=None)
+        Calls a handler.
+    call_meal_generator(handler, dss)
+        Calls a meal generator handler.
+    """
+
+    def __init__(self, glucose: np.ndarray, meal: np.ndarray, meal_type: np.ndarray, meal_announcement: np.ndarray,
+                 hypotreatments: np.ndarray, bolus: np.ndarray, basal: np.ndarray, time: np.ndarray,
+                 forcing_ip: np.ndarray, forcing_ra: np.ndarray, to_g: float, blueprint: str):
+        """
+        Constructs all the necessary attributes for the HandlerContext object.
+
+        Parameters
+        ----------
+        glucose: np.ndarray
+            The glucose array of the simulation (mg/dl).
+        meal: np.ndarray
+            The meal array of the simulation (mg/kg/min).
+        meal_type: np.ndarray
+            The meal type array of the simulation.
+        meal_announcement: np.ndarray
+            The meal announcement array of the simulation (g).
+        hypotreatments: np.ndarray
+            The hypotreatments array of the simulation (g/min).
+        bolus: np.ndarray
+            The insulin bolus array of the simulation (mU/kg/min).
+        basal: np.ndarray
+            The basal insulin array of the simulation (mU/kg/min).
+        time: np.ndarray
+            The time array of the simulation (hours).
+        forcing_ip: np.ndarray
+            The forcing ip array of the simulation.
+        forcing_ra: np.ndarray
+            The forcing ra array of the simulation.
+        to_g: float
+            The factor that converts mg/kg and mU/kg to g and U, respectively.
+        blueprint: str
+            The blueprint of the model.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        self.blueprint = blueprint
+        self.time_index = -1
+
+        # The positional arguments of the handlers at the current time index (built at the first call of each step)
+        self.__arguments = None
+
+        # The arrays to convert at each step, and their converted copies (filled up to the current time index)
+        self.__to_convert = [(meal, np.zeros(meal.shape)), (bolus, np.zeros(bolus.shape)),
+                             (basal, np.zeros(basal.shape))]
+        self.__to_g = to_g
+
+        self.__histories = dict(glucose=glucose, meal=self.__to_convert[0][1], meal_type=meal_type,
+                                meal_announcement=meal_announcement, hypotreatments=hypotreatments,
+                                bolus=self.__to_convert[1][1], basal=self.__to_convert[2][1], time=time,
+                                forcing_ip=forcing_ip, forcing_ra=forcing_ra)
+        for name, history in self.__histories.items():
+            history = history.view()
+            history.flags.writeable = False
+            self.__histories[name] = history
+
+    @property
+    def glucose(self) -> np.ndarray:
+        return self.__histories['glucose'][..., :self.time_index + 1]
+
+    @property
+    def meal(self) -> np.ndarray:
+        return self.__histories['meal'][..., :self.time_index + 1]
+
+    @property
+    def meal_type(self) -> np.ndarray:
+        return self.__histories['meal_type'][..., :self.time_index + 1]
+
+    @property
+    def meal_announcement(self) -> np.ndarray:
+        return self.__histories['meal_announcement'][..., :self.time_index + 1]
+
+    @property
+    def hypotreatments(self) -> np.ndarray:
+        return self.__histories['hypotreatments'][..., :self.time_index + 1]
+
+    @property
+    def bolus(self) -> np.ndarray:
+        return self.__histories['bolus'][..., :self.time_index + 1]
+
+    @property
+    def basal(self) -> np.ndarray:
+        return self.__histories['basal'][..., :self.time_index + 1]
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.__histories['time'][:self.time_index + 1]
+
+    @property
+    def forcing_ip(self) -> np.ndarray:
+        return self.__histories['forcing_ip'][..., :self.time_index + 1]
+
+    @property
+    def forcing_ra(self) -> np.ndarray:
+        return self.__histories['forcing_ra'][..., :self.time_index + 1]
+
+    def advance(self, time_index: int) -> None:
+        """
+        Moves the context to the given time index, converting the new samples of the insulin and meal arrays. The
+        samples up to `time_index` must not change afterwards.
+        """
+        for source, converted in self.__to_convert:
+            converted[..., self.time_index + 1:time_index + 1] = source[..., self.time_index + 1:time_index + 1] \
+                                                                  * self.__to_g
+        self.time_index = time_index
+        self.__arguments = None
+
+    def realization(self, r: int) -> 'HandlerContext':
+        """
+        Returns the context of the r-th realization of a lockstep replay, i.e., a context whose histories are the r-th
+        rows of the histories of this one. It is valid until this context is advanced.
+        """
+        context = copy.copy(self)
+        context.__histories = {name: history[r] if name != 'time' else history
+                               for name, history in self.__histories.items()}
+        context.__to_convert = []
+        context.__arguments = None
+        return context
+
+    def arguments(self, *histories: str) -> tuple:
+        """
+        Returns the positional arguments of a handler, i.e., glucose, meal_announcement, meal_type, hypotreatments,
+        bolus, basal, time, the given additional histories (e.g., 'forcing_ip'), and time_index.
+        """
+        if self.__arguments is None:
+            self.__arguments = (self.glucose, self.meal_announcement, self.meal_type, self.hypotreatments, self.bolus,
+                                self.basal, self.time)
+        return *self.__arguments, *[getattr(self, history) for history in histories], self.time_index
+
+    def meal_generator_arguments(self) -> tuple:
+        """
+        Returns the positional arguments of a meal generator handler, i.e., glucose, meal, meal_type,
+        meal_announcement, hypotreatments, bolus, basal, time, and time_index.
+        """
+        return (self.glucose, self.meal, self.meal_type, self.meal_announcement, self.hypotreatments, self.bolus,
+                self.basal, self.time, self.time_index)
+
+    def call(self, handler: Callable, dss, *histories: str, state=None) -> tuple:
+        """
+        Calls a handler (but the meal generator) with this context, if it is a context handler, or with the positional
+        arguments given by `arguments(*histories)` otherwise. A compiled handler (see `compiled_handlers`) gets the
+        histories it supports and the given state, i.e., its params. Returns the outputs of the handler.
+        """
+        if is_context_handler(handler):
+            return handler(self, dss)
+        if is_compiled_handler(handler):
+            return handler(self.glucose, self.meal_announcement, self.hypotreatments, self.bolus, self.basal,
+                           self.time, self.time_index, handler_state(state)), dss
+        return handler(*self.arguments(*histories), dss)
+
+    def call_meal_generator(self, handler: Callable, dss) -> tuple:
+        """
+        Calls a meal generator handler with this context, if it is a context handler, or with the positional
+        arguments given by `meal_generator_arguments()` and the blueprint otherwise. Returns the outputs of the
+        handler.
+        """
+        if is_context_handler(handler):
+            return handler(self, dss)
+        return handler(*self.meal_generator_arguments(), dss, self.blueprint)
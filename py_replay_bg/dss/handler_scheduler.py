@@ -0,0 +1,127 @@
+from typing import Dict
+
+import numpy as np
+
+from py_replay_bg.dss.handler_context import HandlerContext
+
+
+# The handlers of the DSS
+HANDLERS = ('meal_generator_handler', 'bolus_calculator_handler', 'basal_handler', 'hypotreatments_handler',
+            'correction_boluses_handler', 'forcing_ip_handler', 'forcing_ra_handler')
+
+# The handlers that set a rate, which is held until their next call (the others generate events, i.e., nothing
+# happens between two calls)
+RATE_HANDLERS = ('basal_handler', 'forcing_ip_handler', 'forcing_ra_handler')
+
+# The triggers that can be used in place of a period
+TRIGGERS = ('cgm', 'meal_announcement')
+
+
+class HandlerScheduler:
+    """
+    A class that decides at which steps of a replay each DSS handler is called, according to its cadence.
+
+    The cadence of a handler is either an integer N (the handler is called every N minutes, starting from t = 0),
+    'cgm' (the handler is called at each new CGM sample), or 'meal_announcement' (the handler is called only when a
+    meal is announced). Handlers without a cadence are called every minute. Between two calls, the handlers that set a
+    rate (i.e., the basal and forcing handlers) keep their last output, while the others output nothing.
+
+    ...
+    Attributes
+    ----------
+    handler_cadence: dict
+        The cadence of each handler, keyed by handler name (e.g., 'basal_handler').
+    yts: int
+        The CGM sample time (min).
+
+    Methods
+    -------
+    is_due(name, context)
+        Returns whether the handler is due at the current time index of the context.
+    skipped_outputs(name)
+        Returns the outputs of the handler at the steps at which it is not called.
+    hold(name, outputs)
+        Stores the last outputs of the handler.
+    call(name, context, dss, *histories)
+        Calls the handler, if it is due.
+    """
+
+    def __init__(self, handler_cadence: Dict | None, yts: int):
+        """
+        Constructs all the necessary attributes for the HandlerScheduler object.
+
+        Parameters
+        ----------
+        handler_cadence: dict
+            The cadence of each handler, keyed by handler name (e.g., 'basal_handler'). If None, all the handlers are
+            called every minute.
+        yts: int
+            The CGM sample time (min).
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        self.handler_cadence = handler_cadence if handler_cadence is not None else {}
+        self.yts = yts
+
+        # The last outputs of the rate handlers
+        self.__held = dict()
+
+    def is_due(self, name: str, context: HandlerContext) -> bool | np.ndarray:
+        """
+        Returns whether the handler `name` is due at the current time index of the context. For a
+        'meal_announcement' cadence and a lockstep replay, returns whether it is due for each realization.
+        """
+        cadence = self.handler_cadence.get(name, 1)
+        if cadence == 'meal_announcement':
+            return context.meal_announcement[..., context.time_index] > 0
+        if cadence == 'cgm':
+            cadence = self.yts
+        return context.time_index % cadence == 0
+
+    def skipped_outputs(self, name: str) -> tuple:
+        """
+        Returns the outputs (but the dss) of the handler `name` at the steps at which it is not called.
+        """
+        if name in self.__held:
+            return self.__held[name]
+        if name == 'meal_generator_handler':
+            return 0, 0, ''
+        return 0,
+
+    def hold(self, name: str, outputs: tuple) -> None:
+        """
+        Stores the last outputs (but the dss) of the handler `name`, if it sets a rate.
+        """
+        if name in RATE_HANDLERS:
+            self.__held[name] = tuple(outputs)
+
+    def call(self, name: str, context: HandlerContext, dss, *histories: str) -> tuple:
+        """
+        Calls the handler `name` of the dss with the given context (see `HandlerContext.call`, where `histories` are
+        the additional histories of the handler) if it is due, and returns its outputs. Otherwise, returns the
+        skipped outputs followed by the dss.
+        """
+        if not self.is_due(name, context):
+            return *self.skipped_outputs(name), dss
+
+        handler = getattr(dss, name)
+        if name == 'meal_generator_handler':
+            *outputs, dss = context.call_meal_generator(handler, dss)
+        else:
+            *outputs, dss = context.call(handler, dss, *histories, state=getattr(dss, name + '_params'))
+        self.hold(name, outputs)
+        return *outputs, dss
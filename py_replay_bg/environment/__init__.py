@@ -1,5 +1,13 @@
 import os
 
+import numpy as np
+
+# The children of the random number generator tree rooted at the seed of the environment, one per source of
+# randomness (see Environment.random_stream). The replay realizations and the sensors have a child stream each, keyed
+# by the index of the realization, while the batched handlers of a lockstep replay have a child stream per batch, keyed
+# by the index of its first realization.
+WALKER_INIT, MCMC_MOVES, POSTERIOR_EXTRACTION, REPLAY_REALIZATIONS, SENSOR_PARAMETERS, SENSORS, LOCKSTEP = range(7)
+
 
 class Environment:
     """
@@ -19,7 +27,8 @@ class Environment:
         An integer that specifies the data sampling time (in minutes).
 
     seed : int
-        An integer that specifies the random seed. For reproducibility.
+        An integer that specifies the random seed. For reproducibility. It is the root of the tree of independent
+        random streams used by ReplayBG (see `random_stream`).
 
     plot_mode : bool
         A boolean that specifies whether to show the plot of the results or not.
@@ -28,7 +37,10 @@ class Environment:
 
     Methods
     -------
-    None
+    seed_sequence(*key):
+        Returns the node of the random number generator tree identified by key.
+    random_stream(*key):
+        Returns a random number generator drawing from the node of the random number generator tree identified by key.
     """
 
     def __init__(self,
@@ -97,3 +109,62 @@ class Environment:
         # Set plot mode and verbosity
         self.plot_mode = plot_mode
         self.verbose = verbose
+
+    def seed_sequence(self, *key: int) -> np.random.SeedSequence:
+        """
+        Returns the node of the random number generator tree rooted at `seed` identified by key, i.e., the path of
+        spawn indices from the root (e.g., `(REPLAY_REALIZATIONS, r)` for the r-th replay realization). The same key
+        always gives the same node, whichever process asks for it, and different keys give independent streams.
+
+        Parameters
+        ----------
+        key: int
+            The path of spawn indices of the node from the root.
+
+        Returns
+        -------
+        seed_sequence: np.random.SeedSequence
+            The node of the tree.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        return np.random.SeedSequence(self.seed, spawn_key=key)
+
+    def random_stream(self, *key: int) -> np.random.Generator:
+        """
+        Returns a random number generator drawing from the node of the random number generator tree rooted at `seed`
+        identified by key (see `seed_sequence`).
+
+        Parameters
+        ----------
+        key: int
+            The path of spawn indices of the node from the root.
+
+        Returns
+        -------
+        rng: np.random.Generator
+            The random number generator.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        return np.random.default_rng(self.seed_sequence(*key))
@@ -0,0 +1,82 @@
+import time
+
+import numpy as np
+
+from py_replay_bg.model.model_step_equations_t1d import twin_single_meal, twin_multi_meal, twin_multi_meal_extended
+
+# Micro-benchmark of the integration step kernels used during twinning: it reports the number of integration steps per
+# second of the single-meal, multi-meal, and multi-meal extended models.
+
+# Set the benchmark parameters
+tsteps = 7 * 1440  # One week at 1-min resolution
+n_repeat = 50
+
+# Set typical model parameters
+Gb, SG, p2, ka2, kd, kempt, ke = 120, 0.02, 0.012, 0.014, 0.026, 0.18, 0.127
+SI, VI, VG, f, kabs, alpha, r1, r2 = 1e-3, 0.126, 1.45, 0.9, 0.012, 0.125, 1.44, 0.8
+u2ss = 0.5
+ki1 = u2ss / kd
+ki2 = kd / ka2 * ki1
+Ipb = ka2 / ke * ki2
+
+# Set constant model coefficients
+logGb_r2 = np.log(Gb) ** r2
+log60_r2 = np.log(60.0) ** r2
+risk_coeff = 10.0 * r1
+k1 = 1.0 / (1.0 + kempt)
+k2 = 1.0 / (1.0 + kempt)
+kd_fac = 1.0 / (1.0 + kd)
+
+# Set synthetic inputs: a 60 g meal and a 6 U bolus every 6 hours on top of the basal
+rng = np.random.default_rng(seed=1)
+t_hour = (np.arange(tsteps) / 60.0) % 24
+meal = np.zeros(tsteps)
+meal[::360] = 60000 / 70
+bolus = np.zeros(tsteps)
+bolus[::360] = 6000 / 70
+basal = u2ss * np.ones(tsteps)
+zeros = np.zeros(tsteps)
+
+
+def initial_state(nx):
+    x = np.zeros((nx, tsteps))
+    x[0, 0] = Gb
+    x[nx - 4:nx - 1, 0] = [ki1, ki2, Ipb]
+    x[nx - 1, 0] = Gb
+    return x
+
+
+def run_single_meal():
+    return twin_single_meal(tsteps, initial_state(9), bolus, basal, meal, t_hour,
+                            logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
+                            r2, kempt, kd, ka2, ke, p2, SI, VI, VG, Ipb, SG, Gb, f, kabs, alpha, zeros)
+
+
+def run_multi_meal():
+    return twin_multi_meal(tsteps, initial_state(21), bolus, basal, meal, zeros, meal, zeros, zeros, t_hour,
+                           logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
+                           r2, kempt, kd, ka2, ke, p2, SI, SI, SI, VI, VG, Ipb, SG, Gb,
+                           f, kabs, kabs, kabs, kabs, kabs, alpha, zeros)
+
+
+def run_multi_meal_extended():
+    return twin_multi_meal_extended(tsteps, initial_state(30), bolus, basal, meal, zeros, meal, zeros, zeros,
+                                    meal, zeros, zeros, t_hour, tsteps // 2,
+                                    logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
+                                    r2, kempt, kd, ka2, ke, p2, SI, SI, SI, SI, VI, VG, Ipb, SG, Gb,
+                                    f, kabs, kabs, kabs, kabs, kabs, kabs, kabs, kabs, alpha, zeros)
+
+
+for name, run in [('single-meal', run_single_meal),
+                  ('multi-meal', run_multi_meal),
+                  ('multi-meal extended', run_multi_meal_extended)]:
+
+    # Compile (and warm up)
+    run()
+
+    start = time.perf_counter()
+    for _ in range(n_repeat):
+        run()
+    elapsed = time.perf_counter() - start
+
+    print('%s: %.2f M steps/s' % (name, n_repeat * (tsteps - 1) / elapsed / 1e6))
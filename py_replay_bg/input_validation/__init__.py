@@ -1,5 +1,7 @@
+import numpy as np
 import pandas as pd
 
+from py_replay_bg.dss.handler_scheduler import HANDLERS, TRIGGERS
 from py_replay_bg.replay import CustomRaBase
 from py_replay_bg.sensors import CGM
 
@@ -27,8 +29,8 @@ class BasalHandlerParamsValidator:
 
     def validate(self):
         if self.basal_handler_params is not None:
-            if not isinstance(self.basal_handler_params, dict):
-                raise Exception("'basal_handler_params' input must be a dict.'")
+            if not isinstance(self.basal_handler_params, (dict, np.ndarray)):
+                raise Exception("'basal_handler_params' input must be a dict or a numpy array.'")
 
 class BasalHandlerStartValidator:
     """
@@ -55,6 +57,22 @@ class BasalSourceValidator:
             raise Exception("'basal_source' input must be 'data', 'u2ss', or 'dss'.")
 
 
+class BatchedValidator:
+    """
+    Class for validating the 'batched' input parameter of ReplayBG.
+    """
+
+    def __init__(self, batched, parallelize):
+        self.batched = batched
+        self.parallelize = parallelize
+
+    def validate(self):
+        if not isinstance(self.batched, bool):
+            raise Exception("'batched' input must be a boolean.'")
+        if self.batched and self.parallelize is True:
+            raise Exception("'batched' and 'parallelize' inputs cannot be both True.'")
+
+
 class BolusCalculatorHandlerValidator:
     """
     Class for validating the 'bolus_calculator_handler' input parameter of ReplayBG.
@@ -78,8 +96,8 @@ class BolusCalculatorHandlerParamsValidator:
 
     def validate(self):
         if self.bolus_calculator_handler_params is not None:
-            if not isinstance(self.bolus_calculator_handler_params, dict):
-                raise Exception("'bolus_calculator_handler_params' input must be a dict.'")
+            if not isinstance(self.bolus_calculator_handler_params, (dict, np.ndarray)):
+                raise Exception("'bolus_calculator_handler_params' input must be a dict or a numpy array.'")
 
 
 class BolusSourceValidator:
@@ -144,8 +162,8 @@ class CorrectionBolusesHandlerParamsValidator:
 
     def validate(self):
         if self.correction_boluses_handler_params is not None:
-            if not isinstance(self.correction_boluses_handler_params, dict):
-                raise Exception("'correction_boluses_handler_params' input must be a dict.'")
+            if not isinstance(self.correction_boluses_handler_params, (dict, np.ndarray)):
+                raise Exception("'correction_boluses_handler_params' input must be a dict or a numpy array.'")
 
 
 class DataValidator:
@@ -222,6 +240,32 @@ class DataValidator:
                 raise Exception("'data.basal' must not contain nan values.'")
 
 
+class EarlyRejectionValidator:
+    """
+    Class for validating the 'early_rejection' input parameter of ReplayBG.
+    """
+
+    def __init__(self, early_rejection):
+        self.early_rejection = early_rejection
+
+    def validate(self):
+        if not isinstance(self.early_rejection, bool):
+            raise Exception("'early_rejection' input must be a boolean.'")
+
+
+class EarlyStoppingValidator:
+    """
+    Class for validating the 'early_stopping' input parameter of ReplayBG.
+    """
+
+    def __init__(self, early_stopping):
+        self.early_stopping = early_stopping
+
+    def validate(self):
+        if not isinstance(self.early_stopping, bool):
+            raise Exception("'early_stopping' input must be a boolean.'")
+
+
 class EnableCorrectionBolusesValidator:
     """
     Class for validating the 'enable_correction_boluses' input parameter of ReplayBG.
@@ -367,6 +411,27 @@ class ForcingRaHandlerParamsValidator:
                 raise Exception("'forcing_ra_handler_params' input must be a dict.'")
 
 
+class HandlerCadenceValidator:
+    """
+    Class for validating the 'handler_cadence' input parameter of ReplayBG.
+    """
+
+    def __init__(self, handler_cadence):
+        self.handler_cadence = handler_cadence
+
+    def validate(self):
+        if self.handler_cadence is not None:
+            if not isinstance(self.handler_cadence, dict):
+                raise Exception("'handler_cadence' input must be a dict.'")
+            for name, cadence in self.handler_cadence.items():
+                if name not in HANDLERS:
+                    raise Exception("'handler_cadence' keys must be handler names (e.g., 'basal_handler').'")
+                if not ((isinstance(cadence, int) and not isinstance(cadence, bool) and cadence > 0)
+                        or cadence in TRIGGERS):
+                    raise Exception("'handler_cadence' values must be positive integers, 'cgm', or "
+                                    "'meal_announcement'.'")
+
+
 class HypotreatmentsHandlerValidator:
     """
     Class for validating the 'hypotreatments_handler' input parameter of ReplayBG.
@@ -390,8 +455,55 @@ class HypotreatmentsHandlerParamsValidator:
 
     def validate(self):
         if self.hypotreatments_handler_params is not None:
-            if not isinstance(self.hypotreatments_handler_params, dict):
-                raise Exception("'hypotreatments_handler_params' input must be a dict.'")
+            if not isinstance(self.hypotreatments_handler_params, (dict, np.ndarray)):
+                raise Exception("'hypotreatments_handler_params' input must be a dict or a numpy array.'")
+
+
+class IntegrationStepValidator:
+    """
+    Class for validating the 'integration_step' input parameter of ReplayBG.
+    """
+
+    def __init__(self, integration_step, yts):
+        self.integration_step = integration_step
+        self.yts = yts
+
+    def validate(self):
+        if not isinstance(self.integration_step, int):
+            raise Exception("'integration_step' input must be an integer.'")
+        if self.integration_step < 1 or self.yts % self.integration_step != 0:
+            raise Exception("'integration_step' input must be a positive divisor of 'yts'.'")
+
+
+class TauFactorValidator:
+    """
+    Class for validating the 'tau_factor' input parameter of ReplayBG.
+    """
+
+    def __init__(self, tau_factor):
+        self.tau_factor = tau_factor
+
+    def validate(self):
+        if isinstance(self.tau_factor, bool) or not isinstance(self.tau_factor, (int, float)):
+            raise Exception("'tau_factor' input must be a number.'")
+        if self.tau_factor <= 0:
+            raise Exception("'tau_factor' input must be greater than 0.'")
+
+
+class TimeBudgetValidator:
+    """
+    Class for validating the 'time_budget' input parameter of ReplayBG.
+    """
+
+    def __init__(self, time_budget):
+        self.time_budget = time_budget
+
+    def validate(self):
+        if self.time_budget is not None:
+            if isinstance(self.time_budget, bool) or not isinstance(self.time_budget, (int, float)):
+                raise Exception("'time_budget' input must be a number or None.'")
+            if self.time_budget <= 0:
+                raise Exception("'time_budget' input must be greater than 0.'")
 
 
 class TwinningMethodValidator:
@@ -434,6 +546,21 @@ class MealGeneratorHandlerParamsValidator:
                 raise Exception("'meal_generator_handler_params' input must be a dict.'")
 
 
+class MetricToleranceValidator:
+    """
+    Class for validating the 'metric_tolerance' input parameter of ReplayBG.
+    """
+
+    def __init__(self, metric_tolerance):
+        self.metric_tolerance = metric_tolerance
+
+    def validate(self):
+        if not isinstance(self.metric_tolerance, (int, float)) or isinstance(self.metric_tolerance, bool):
+            raise Exception("'metric_tolerance' input must be a number.'")
+        if not self.metric_tolerance > 0:
+            raise Exception("'metric_tolerance' input must be greater than 0.'")
+
+
 class ModalityValidator:
     """
     Class for validating the 'modality' input parameter of ReplayBG.
@@ -469,10 +596,12 @@ class NReplayValidator:
         self.n_replay = n_replay
 
     def validate(self):
+        if self.n_replay == 'adaptive':
+            return
         if not isinstance(self.n_replay, int):
-            raise Exception("'n_replay' input must be an integer.'")
+            raise Exception("'n_replay' input must be an integer or 'adaptive'.'")
         if not (self.n_replay == 1 or self.n_replay == 10 or self.n_replay == 100 or self.n_replay == 1000):
-            raise Exception("'n_replay' input must be 1, 10, 100, or 1000.'")
+            raise Exception("'n_replay' input must be 1, 10, 100, 1000, or 'adaptive'.'")
 
 
 class NStepsValidator:
@@ -501,6 +630,19 @@ class NWalkersValidator:
             raise Exception("'n_walkers' input must be an integer.'")
 
 
+class ParallelBackendValidator:
+    """
+    Class for validating the 'parallel_backend' input parameter of ReplayBG.
+    """
+
+    def __init__(self, parallel_backend):
+        self.parallel_backend = parallel_backend
+
+    def validate(self):
+        if not (self.parallel_backend == 'process' or self.parallel_backend == 'thread'):
+            raise Exception("'parallel_backend' input must be 'process' or 'thread'.'")
+
+
 class ParallelizeValidator:
     """
     Class for validating the 'parallelize' input parameter of ReplayBG.
@@ -528,6 +670,21 @@ class PathologyValidator:
             raise Exception("'pathology' input must be 't1d', 't2d', 'pbh', or 'healthy'.")
 
 
+class PercentileToleranceValidator:
+    """
+    Class for validating the 'percentile_tolerance' input parameter of ReplayBG.
+    """
+
+    def __init__(self, percentile_tolerance):
+        self.percentile_tolerance = percentile_tolerance
+
+    def validate(self):
+        if not isinstance(self.percentile_tolerance, (int, float)) or isinstance(self.percentile_tolerance, bool):
+            raise Exception("'percentile_tolerance' input must be a number.'")
+        if not self.percentile_tolerance > 0:
+            raise Exception("'percentile_tolerance' input must be greater than 0.'")
+
+
 class PlotModeValidator:
     """
     Class for validating the 'plot_mode' input parameter of ReplayBG.
@@ -635,6 +792,25 @@ class BlueprintValidator:
             raise Exception("'blueprint' input must be 'single-meal' or 'multi-meal'.")
 
 
+class ScenariosValidator:
+    """
+    Class for validating the 'scenarios' and 'reference' input parameters of ReplayBG.
+    """
+
+    def __init__(self, scenarios, reference):
+        self.scenarios = scenarios
+        self.reference = reference
+
+    def validate(self):
+        if not isinstance(self.scenarios, dict) or len(self.scenarios) < 2:
+            raise Exception("'scenarios' input must be a dictionary of at least two scenarios.'")
+        for name in self.scenarios:
+            if not isinstance(self.scenarios[name], dict):
+                raise Exception("Each scenario of the 'scenarios' input must be a dictionary of replay parameters.'")
+        if self.reference is not None and self.reference not in self.scenarios:
+            raise Exception("'reference' input must be None or the name of one of the scenarios.'")
+
+
 class SeedValidator:
     """
     Class for validating the 'seed' input parameter of ReplayBG.
@@ -662,6 +838,32 @@ class SensorsValidator:
                 raise Exception("'sensors' input must be None or a list.'")
 
 
+class SharedMemoryValidator:
+    """
+    Class for validating the 'shared_memory' input parameter of ReplayBG.
+    """
+
+    def __init__(self, shared_memory):
+        self.shared_memory = shared_memory
+
+    def validate(self):
+        if not isinstance(self.shared_memory, bool):
+            raise Exception("'shared_memory' input must be a boolean.'")
+
+
+class SurrogateValidator:
+    """
+    Class for validating the 'surrogate' input parameter of ReplayBG.
+    """
+
+    def __init__(self, surrogate):
+        self.surrogate = surrogate
+
+    def validate(self):
+        if not isinstance(self.surrogate, bool):
+            raise Exception("'surrogate' input must be a boolean.'")
+
+
 class U2SSValidator:
     """
     Class for validating the 'u2ss' input parameter of ReplayBG.
@@ -676,6 +878,19 @@ class U2SSValidator:
                 raise Exception("'bw' input must be a number.'")
 
 
+class VectorizeValidator:
+    """
+    Class for validating the 'vectorize' input parameter of ReplayBG.
+    """
+
+    def __init__(self, vectorize):
+        self.vectorize = vectorize
+
+    def validate(self):
+        if not isinstance(self.vectorize, bool):
+            raise Exception("'vectorize' input must be a boolean.'")
+
+
 class VerboseValidator:
     """
     Class for validating the 'verbose' input parameter of ReplayBG.
@@ -91,10 +91,22 @@ class InputValidatorReplay:
     save_workspace: bool
         A flag that specifies whether to save the resulting workspace.
 
-    n_replay: int
-        The number of Monte Carlo replays to be performed. Ignored if twinning_method is 'map'.
+    n_replay: int | str
+        The number of Monte Carlo replays to be performed, or 'adaptive'. Ignored if twinning_method is 'map'.
+    percentile_tolerance: float
+        The tolerance on the change of the glucose percentiles used to stop an adaptive replay (mg/dl).
+    metric_tolerance: float
+        The tolerance on the change of the percentiles of the time in ranges used to stop an adaptive replay (%).
     sensors: list[Sensors]
         The sensors to be used in each of the replay simulations.
+    batched: bool
+        Whether to replay closed-loop scenarios advancing all the realizations in lockstep.
+    parallelize : bool
+        A boolean that specifies whether to parallelize the replay across worker processes.
+    n_processes : int
+        The number of processes to be spawn if `parallelize` is `True`. If None, the number of CPU cores is used.
+    handler_cadence: dict
+        The cadence of each handler (every N minutes, 'cgm', or 'meal_announcement'), keyed by handler name.
 
     blueprint: str
             A string that specifies the blueprint to be used to create the digital twin.
@@ -138,14 +150,20 @@ class InputValidatorReplay:
                  forcing_ra_handler_params: Dict,
                  save_suffix: str,
                  save_workspace: bool,
-                 n_replay: int,
+                 n_replay: int | str,
                  sensors: list,
                  blueprint: str,
                  exercise: bool,
                  snack_absorption: float,
                  snack_absorption_delay: int,
                  hypotreatment_absorption: float,
-                 custom_ra: CustomRaBase
+                 custom_ra: CustomRaBase,
+                 batched: bool = False,
+                 parallelize: bool = False,
+                 n_processes: int | None = None,
+                 handler_cadence: Dict | None = None,
+                 percentile_tolerance: float = 2.0,
+                 metric_tolerance: float = 1.0
                  ):
         self.data = data
         self.bw = bw
@@ -185,6 +203,12 @@ class InputValidatorReplay:
         self.snack_absorption_delay = snack_absorption_delay
         self.hypotreatment_absorption = hypotreatment_absorption
         self.custom_ra = custom_ra
+        self.batched = batched
+        self.parallelize = parallelize
+        self.n_processes = n_processes
+        self.handler_cadence = handler_cadence
+        self.percentile_tolerance = percentile_tolerance
+        self.metric_tolerance = metric_tolerance
 
     def validate(self):
         """
@@ -291,6 +315,12 @@ class InputValidatorReplay:
         # Validate the 'n_replay' input
         NReplayValidator(n_replay=self.n_replay).validate()
 
+        # Validate the 'percentile_tolerance' input
+        PercentileToleranceValidator(percentile_tolerance=self.percentile_tolerance).validate()
+
+        # Validate the 'metric_tolerance' input
+        MetricToleranceValidator(metric_tolerance=self.metric_tolerance).validate()
+
         # Validate the 'sensors' input
         SensorsValidator(sensors=self.sensors).validate()
 
@@ -304,4 +334,16 @@ class InputValidatorReplay:
         HypotreatmentAbsorptionValidator(hypotreatment_absorption=self.hypotreatment_absorption).validate()
 
         # Validate the 'custom_ra' input
-        CustomRaValidator(custom_ra=self.custom_ra).validate()
\ No newline at end of file
+        CustomRaValidator(custom_ra=self.custom_ra).validate()
+
+        # Validate the 'batched' input
+        BatchedValidator(batched=self.batched, parallelize=self.parallelize).validate()
+
+        # Validate the 'parallelize' input
+        ParallelizeValidator(parallelize=self.parallelize).validate()
+
+        # Validate the 'n_processes' input
+        NProcessesValidator(n_processes=self.n_processes).validate()
+
+        # Validate the 'handler_cadence' input
+        HandlerCadenceValidator(handler_cadence=self.handler_cadence).validate()
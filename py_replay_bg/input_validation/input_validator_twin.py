@@ -46,11 +46,32 @@ class InputValidatorTwin:
         A boolean that specifies whether to parallelize the twinning process.
     n_processes : int, optional, default : None
         The number of processes to be spawn if `parallelize` is `True`. If None, the number of CPU cores is used.
+    shared_memory : boolean
+        A boolean that specifies whether to place the data arrays sent to the worker processes in shared memory.
+    parallel_backend : str
+        Whether to parallelize the twinning process across processes ('process') or threads ('thread').
+    vectorize : boolean
+        A boolean that specifies whether to evaluate the log posterior of all the walkers at once.
+    early_rejection : boolean
+        A boolean that specifies whether to stop early the simulation of the mcmc proposals that are going to be
+        rejected.
+    surrogate : boolean
+        A boolean that specifies whether to screen the mcmc proposals with a surrogate of the log posterior.
+    integration_step : int
+        The integration step (min) used to simulate the model during twinning.
+    time_budget : float
+        The wall-clock time budget of the twinning procedure [s].
+    early_stopping : boolean
+        A boolean that specifies whether to stop the mcmc production chain as soon as it is converged.
+    tau_factor : float
+        The multiple of the autocorrelation time the mcmc production chain must be longer than to be converged.
 
     blueprint: str
             A string that specifies the blueprint to be used to create the digital twin.
     exercise: bool
         A boolean that specifies whether to use exercise model or not.
+    yts: int
+        The measurement (cgm) sample time.
 
     Methods
     -------
@@ -73,8 +94,18 @@ class InputValidatorTwin:
                  previous_data_name: str | None,
                  parallelize: bool,
                  n_processes: int | None,
+                 shared_memory: bool,
+                 parallel_backend: str,
+                 vectorize: bool,
+                 early_rejection: bool,
+                 surrogate: bool,
+                 integration_step: int,
+                 time_budget: float | None,
+                 early_stopping: bool,
+                 tau_factor: float,
                  blueprint: str,
-                 exercise: bool
+                 exercise: bool,
+                 yts: int
                  ):
         self.data = data
         self.bw = bw
@@ -90,8 +121,18 @@ class InputValidatorTwin:
         self.previous_data_name = previous_data_name
         self.parallelize = parallelize
         self.n_processes = n_processes
+        self.shared_memory = shared_memory
+        self.parallel_backend = parallel_backend
+        self.vectorize = vectorize
+        self.early_rejection = early_rejection
+        self.surrogate = surrogate
+        self.integration_step = integration_step
+        self.time_budget = time_budget
+        self.early_stopping = early_stopping
+        self.tau_factor = tau_factor
         self.blueprint = blueprint
         self.exercise = exercise
+        self.yts = yts
 
     def validate(self):
         """
@@ -137,3 +178,30 @@ class InputValidatorTwin:
 
         # Validate the 'n_processes' input
         NProcessesValidator(n_processes=self.n_processes).validate()
+
+        # Validate the 'shared_memory' input
+        SharedMemoryValidator(shared_memory=self.shared_memory).validate()
+
+        # Validate the 'parallel_backend' input
+        ParallelBackendValidator(parallel_backend=self.parallel_backend).validate()
+
+        # Validate the 'vectorize' input
+        VectorizeValidator(vectorize=self.vectorize).validate()
+
+        # Validate the 'early_rejection' input
+        EarlyRejectionValidator(early_rejection=self.early_rejection).validate()
+
+        # Validate the 'surrogate' input
+        SurrogateValidator(surrogate=self.surrogate).validate()
+
+        # Validate the 'integration_step' input
+        IntegrationStepValidator(integration_step=self.integration_step, yts=self.yts).validate()
+
+        # Validate the 'time_budget' input
+        TimeBudgetValidator(time_budget=self.time_budget).validate()
+
+        # Validate the 'early_stopping' input
+        EarlyStoppingValidator(early_stopping=self.early_stopping).validate()
+
+        # Validate the 'tau_factor' input
+        TauFactorValidator(tau_factor=self.tau_factor).validate()
@@ -0,0 +1,1052 @@
+import numpy as np
+
+from numba import njit, prange
+
+from py_replay_bg.model.model_step_equations_t1d import model_step_equations_single_meal, \
+    model_step_equations_multi_meal, model_step_equations_multi_meal_extended
+from py_replay_bg.model.logpriors_t1d import log_prior_single_meal, log_prior_multi_meal, \
+    log_prior_multi_meal_extended, log_prior_gradient
+from py_replay_bg.model.exponential_integrator_t1d import integrate_exponential, SI_CONSTANT, SI_BY_HOUR, \
+    SI_BY_HOUR_EXTENDED
+from py_replay_bg.model.sensitivity_t1d import integrate_sensitivity
+from py_replay_bg.dss.compiled_handlers import closed_loop_controls
+
+# Layout of the packed parameter vectors used by the compiled ensemble kernels. Unknown parameters come first (in the
+# same order used to build theta), model constants follow.
+SINGLE_MEAL_PARAMETERS = ('Gb', 'SG', 'p2', 'ka2', 'kd', 'kempt', 'SI', 'kabs', 'beta',
+                          'r1', 'r2', 'ke', 'VI', 'VG', 'f', 'alpha', 'tau', 'u2ss')
+
+MULTI_MEAL_PARAMETERS = ('Gb', 'SG', 'p2', 'ka2', 'kd', 'kempt',
+                         'SI_B', 'SI_L', 'SI_D',
+                         'kabs_B', 'kabs_L', 'kabs_D', 'kabs_S', 'kabs_H',
+                         'beta_B', 'beta_L', 'beta_D', 'beta_S',
+                         'r1', 'r2', 'ke', 'VI', 'VG', 'f', 'alpha', 'tau', 'u2ss')
+
+MULTI_MEAL_EXTENDED_PARAMETERS = MULTI_MEAL_PARAMETERS + ('SI_B2', 'kabs_B2', 'kabs_L2', 'kabs_S2',
+                                                          'beta_B2', 'beta_L2', 'beta_S2')
+
+# Bound on the sum of squared residuals that never stops the integration
+_NO_BOUND = np.finfo(np.float64).max
+
+# Positions of the parameters in the packed vectors (compile-time constants for numba)
+_GB, _SG, _P2, _KA2, _KD, _KEMPT = 0, 1, 2, 3, 4, 5
+
+_SM_SI, _SM_KABS, _SM_BETA = 6, 7, 8
+_SM_R1, _SM_R2, _SM_KE, _SM_VI, _SM_VG, _SM_F, _SM_ALPHA, _SM_TAU, _SM_U2SS = 9, 10, 11, 12, 13, 14, 15, 16, 17
+
+_MM_SI_B, _MM_SI_L, _MM_SI_D = 6, 7, 8
+_MM_KABS_B, _MM_KABS_L, _MM_KABS_D, _MM_KABS_S, _MM_KABS_H = 9, 10, 11, 12, 13
+_MM_BETA_B, _MM_BETA_L, _MM_BETA_D, _MM_BETA_S = 14, 15, 16, 17
+_MM_R1, _MM_R2, _MM_KE, _MM_VI, _MM_VG, _MM_F, _MM_ALPHA, _MM_TAU, _MM_U2SS = 18, 19, 20, 21, 22, 23, 24, 25, 26
+_MM_SI_B2, _MM_KABS_B2, _MM_KABS_L2, _MM_KABS_S2, _MM_BETA_B2, _MM_BETA_L2, _MM_BETA_S2 = 27, 28, 29, 30, 31, 32, 33
+
+# Positions of the insulin sensitivities and of the kabs parameters in the packed vectors, in the order used by the
+# sensitivity engine (see `sensitivity_t1d`)
+_SM_SI_POS = np.array([_SM_SI])
+_SM_KABS_POS = np.array([_SM_KABS])
+_MM_SI_POS = np.array([_MM_SI_B, _MM_SI_L, _MM_SI_D])
+_MM_KABS_POS = np.array([_MM_KABS_B, _MM_KABS_L, _MM_KABS_D, _MM_KABS_S, _MM_KABS_H])
+_MME_SI_POS = np.array([_MM_SI_B, _MM_SI_L, _MM_SI_D, _MM_SI_B2])
+_MME_KABS_POS = np.array([_MM_KABS_B, _MM_KABS_L, _MM_KABS_D, _MM_KABS_S, _MM_KABS_H,
+                          _MM_KABS_B2, _MM_KABS_L2, _MM_KABS_S2])
+
+
+def pack_parameters(model_parameters, layout: tuple) -> np.ndarray:
+    """
+    Packs the given model parameters into a vector following the given layout.
+
+    Parameters
+    ----------
+    model_parameters: ModelParametersT1DSingleMeal | ModelParametersT1DMultiMeal
+        An object containing the model parameters.
+    layout: tuple
+        The names of the parameters to pack, in order.
+
+    Returns
+    -------
+    p: np.ndarray
+        The packed parameter vector.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    None
+
+    Examples
+    --------
+    None
+    """
+    return np.array([getattr(model_parameters, name) for name in layout], dtype=float)
+
+
+def pack_ensemble(model_parameters, layout: tuple, unknown_parameters, thetas: np.ndarray) -> np.ndarray:
+    """
+    Builds the packed parameter matrix of an ensemble of realizations of the unknown parameters. Parameters that are
+    not in `unknown_parameters` are set to the current values in `model_parameters`.
+
+    Parameters
+    ----------
+    model_parameters: ModelParametersT1DSingleMeal | ModelParametersT1DMultiMeal
+        An object containing the model parameters.
+    layout: tuple
+        The names of the parameters to pack, in order.
+    unknown_parameters: np.ndarray
+        An array that contains the names of the columns of `thetas`.
+    thetas: np.ndarray
+        A (n, n_dim) matrix containing the realizations of the unknown parameters.
+
+    Returns
+    -------
+    P: np.ndarray
+        A (n, len(layout)) matrix containing the packed parameter vectors.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    None
+
+    Examples
+    --------
+    None
+    """
+    thetas = np.atleast_2d(np.asarray(thetas, dtype=float))
+    P = np.tile(pack_parameters(model_parameters, layout), (thetas.shape[0], 1))
+    P[:, [layout.index(p) for p in unknown_parameters]] = thetas
+    return P
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _initial_state(p, kd_pos, ka2_pos, ke_pos, u2ss_pos, x0, ins_scale, nx):
+    """
+    Internal function that computes the initial model state of a packed parameter vector.
+    """
+    ki1 = p[u2ss_pos] / p[kd_pos]
+    ki2 = p[kd_pos] / p[ka2_pos] * ki1
+    Ipb = p[ka2_pos] / p[ke_pos] * ki2
+
+    x = x0.copy()
+    x[nx - 4] = ki1 * ins_scale[0]
+    x[nx - 3] = ki2 * ins_scale[1]
+    x[nx - 2] = Ipb * ins_scale[2]
+    return x, Ipb
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _delayed(u, k, delay, before):
+    """
+    Internal function that returns the value at time k of the input u delayed by `delay` steps.
+    """
+    return u[k - delay] if k >= delay else before
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _integrate_single_meal(p, x0, ins_scale,
+                           bolus, basal, meal, t_hour, previous_Ra,
+                           tsteps, ts, yts, glucose, glucose_idxs, sse_max, G):
+    """
+    Internal function that simulates the single-meal model for a packed parameter vector, keeping only the current
+    state. The simulated interstitial glucose is stored in G (unless G is empty) and the sum of squared residuals
+    against the glucose data at the observation times (i.e., glucose_idxs * yts) is accumulated while integrating and
+    returned. The integration stops as soon as the sum of squared residuals exceeds sse_max (the partial sum is
+    returned). If ts > 1, the exponential integrator is used. Optimized for twinning only.
+    """
+    nx = x0.shape[0]
+    store = G.shape[0] > 0
+    n_obs = glucose_idxs.shape[0]
+
+    # Enforce constraints (kgri = kempt) and set constant model coefficients
+    logGb_r2 = np.log(p[_GB]) ** p[_SM_R2]
+    log60_r2 = np.log(60.0) ** p[_SM_R2]
+    risk_coeff = 10.0 * p[_SM_R1]
+    k1 = 1.0 / (1.0 + p[_KEMPT])
+    k2 = 1.0 / (1.0 + p[_KEMPT])
+    kd_fac = 1.0 / (1.0 + p[_KD])
+
+    tau = max(int(p[_SM_TAU]), 0)
+    beta = max(int(p[_SM_BETA]), 0)
+    u2ss = p[_SM_U2SS]
+
+    x, Ipb = _initial_state(p, _KD, _KA2, _SM_KE, _SM_U2SS, x0, ins_scale, nx)
+
+    if ts > 1:
+        return integrate_exponential(x, ts, (meal,), np.array([beta]), np.array([p[_SM_KABS]]),
+                                     bolus, basal, tau, u2ss, t_hour, 0, SI_CONSTANT, np.array([p[_SM_SI]]),
+                                     previous_Ra,
+                                     p[_GB], p[_SG], p[_P2], p[_KD], p[_KA2], p[_SM_KE], p[_KEMPT], p[_SM_VI],
+                                     p[_SM_VG], p[_SM_F], p[_SM_ALPHA], p[_SM_R1], p[_SM_R2], Ipb,
+                                     tsteps, yts, glucose, glucose_idxs, sse_max, G)
+
+    sse = 0.0
+    j = 0
+    if store:
+        G[0] = x[nx - 1]
+    if j < n_obs and glucose_idxs[j] == 0:
+        e = x[nx - 1] - glucose[glucose_idxs[j]]
+        sse += e * e
+        j += 1
+
+    for k in range(1, tsteps):
+        model_step_equations_single_meal(_delayed(bolus, k, tau, 0.0) + _delayed(basal, k, tau, u2ss),
+                                         _delayed(meal, k, beta, 0.0), t_hour[k],
+                                         x, x,
+                                         logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
+                                         p[_SM_R2], p[_KEMPT], p[_KD], p[_KA2], p[_SM_KE], p[_P2], p[_SM_SI],
+                                         p[_SM_VI], p[_SM_VG], Ipb, p[_SG], p[_GB], p[_SM_F], p[_SM_KABS],
+                                         p[_SM_ALPHA], previous_Ra[k], 0, 0, 0)
+        if store:
+            G[k] = x[nx - 1]
+        if j < n_obs and k == glucose_idxs[j] * yts:
+            e = x[nx - 1] - glucose[glucose_idxs[j]]
+            sse += e * e
+            j += 1
+            if sse > sse_max:
+                return sse
+
+    return sse
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _integrate_multi_meal(p, x0, ins_scale,
+                          bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour, previous_Ra,
+                          tsteps, ts, yts, glucose, glucose_idxs, sse_max, G):
+    """
+    Internal function that simulates the multi-meal model for a packed parameter vector, keeping only the current
+    state. The simulated interstitial glucose is stored in G (unless G is empty) and the sum of squared residuals
+    against the glucose data at the observation times (i.e., glucose_idxs * yts) is accumulated while integrating and
+    returned. The integration stops as soon as the sum of squared residuals exceeds sse_max (the partial sum is
+    returned). If ts > 1, the exponential integrator is used. Optimized for twinning only.
+    """
+    nx = x0.shape[0]
+    store = G.shape[0] > 0
+    n_obs = glucose_idxs.shape[0]
+
+    # Enforce constraints (kgri = kempt) and set constant model coefficients
+    logGb_r2 = np.log(p[_GB]) ** p[_MM_R2]
+    log60_r2 = np.log(60.0) ** p[_MM_R2]
+    risk_coeff = 10.0 * p[_MM_R1]
+    k1 = 1.0 / (1.0 + p[_KEMPT])
+    k2 = 1.0 / (1.0 + p[_KEMPT])
+    kd_fac = 1.0 / (1.0 + p[_KD])
+
+    tau = max(int(p[_MM_TAU]), 0)
+    beta_B = max(int(p[_MM_BETA_B]), 0)
+    beta_L = max(int(p[_MM_BETA_L]), 0)
+    beta_D = max(int(p[_MM_BETA_D]), 0)
+    beta_S = max(int(p[_MM_BETA_S]), 0)
+    u2ss = p[_MM_U2SS]
+
+    x, Ipb = _initial_state(p, _KD, _KA2, _MM_KE, _MM_U2SS, x0, ins_scale, nx)
+
+    if ts > 1:
+        return integrate_exponential(x, ts, (meal_B, meal_L, meal_D, meal_S, meal_H),
+                                     np.array([beta_B, beta_L, beta_D, beta_S, 0]),
+                                     np.array([p[_MM_KABS_B], p[_MM_KABS_L], p[_MM_KABS_D], p[_MM_KABS_S],
+                                               p[_MM_KABS_H]]),
+                                     bolus, basal, tau, u2ss, t_hour, 0, SI_BY_HOUR,
+                                     np.array([p[_MM_SI_B], p[_MM_SI_L], p[_MM_SI_D]]),
+                                     previous_Ra,
+                                     p[_GB], p[_SG], p[_P2], p[_KD], p[_KA2], p[_MM_KE], p[_KEMPT], p[_MM_VI],
+                                     p[_MM_VG], p[_MM_F], p[_MM_ALPHA], p[_MM_R1], p[_MM_R2], Ipb,
+                                     tsteps, yts, glucose, glucose_idxs, sse_max, G)
+
+    sse = 0.0
+    j = 0
+    if store:
+        G[0] = x[nx - 1]
+    if j < n_obs and glucose_idxs[j] == 0:
+        e = x[nx - 1] - glucose[glucose_idxs[j]]
+        sse += e * e
+        j += 1
+
+    for k in range(1, tsteps):
+        model_step_equations_multi_meal(_delayed(bolus, k, tau, 0.0) + _delayed(basal, k, tau, u2ss),
+                                        _delayed(meal_B, k, beta_B, 0.0), _delayed(meal_L, k, beta_L, 0.0),
+                                        _delayed(meal_D, k, beta_D, 0.0), _delayed(meal_S, k, beta_S, 0.0),
+                                        meal_H[k], t_hour[k], x, x,
+                                        logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
+                                        p[_MM_R2], p[_KEMPT], p[_KD], p[_KA2], p[_MM_KE], p[_P2],
+                                        p[_MM_SI_B], p[_MM_SI_L], p[_MM_SI_D], p[_MM_VI], p[_MM_VG], Ipb,
+                                        p[_SG], p[_GB], p[_MM_F],
+                                        p[_MM_KABS_B], p[_MM_KABS_L], p[_MM_KABS_D], p[_MM_KABS_S],
+                                        p[_MM_KABS_H], p[_MM_ALPHA], previous_Ra[k], 0, 0, 0)
+        if store:
+            G[k] = x[nx - 1]
+        if j < n_obs and k == glucose_idxs[j] * yts:
+            e = x[nx - 1] - glucose[glucose_idxs[j]]
+            sse += e * e
+            j += 1
+            if sse > sse_max:
+                return sse
+
+    return sse
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _integrate_multi_meal_extended(p, x0, ins_scale,
+                                   bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                   meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                   tsteps, ts, yts, glucose, glucose_idxs, sse_max, G):
+    """
+    Internal function that simulates the multi-meal extended model for a packed parameter vector, keeping only the
+    current state. The simulated interstitial glucose is stored in G (unless G is empty) and the sum of squared
+    residuals against the glucose data at the observation times (i.e., glucose_idxs * yts) is accumulated while
+    integrating and returned. The integration stops as soon as the sum of squared residuals exceeds sse_max (the
+    partial sum is returned). If ts > 1, the exponential integrator is used. Optimized for twinning only.
+    """
+    nx = x0.shape[0]
+    store = G.shape[0] > 0
+    n_obs = glucose_idxs.shape[0]
+
+    # Enforce constraints (kgri = kempt) and set constant model coefficients
+    logGb_r2 = np.log(p[_GB]) ** p[_MM_R2]
+    log60_r2 = np.log(60.0) ** p[_MM_R2]
+    risk_coeff = 10.0 * p[_MM_R1]
+    k1 = 1.0 / (1.0 + p[_KEMPT])
+    k2 = 1.0 / (1.0 + p[_KEMPT])
+    kd_fac = 1.0 / (1.0 + p[_KD])
+
+    tau = max(int(p[_MM_TAU]), 0)
+    beta_B = max(int(p[_MM_BETA_B]), 0)
+    beta_L = max(int(p[_MM_BETA_L]), 0)
+    beta_D = max(int(p[_MM_BETA_D]), 0)
+    beta_S = max(int(p[_MM_BETA_S]), 0)
+    beta_B2 = max(int(p[_MM_BETA_B2]), 0)
+    beta_L2 = max(int(p[_MM_BETA_L2]), 0)
+    beta_S2 = max(int(p[_MM_BETA_S2]), 0)
+    u2ss = p[_MM_U2SS]
+
+    x, Ipb = _initial_state(p, _KD, _KA2, _MM_KE, _MM_U2SS, x0, ins_scale, nx)
+
+    if ts > 1:
+        return integrate_exponential(x, ts, (meal_B, meal_L, meal_D, meal_S, meal_H, meal_B2, meal_L2, meal_S2),
+                                     np.array([beta_B, beta_L, beta_D, beta_S, 0, beta_B2, beta_L2, beta_S2]),
+                                     np.array([p[_MM_KABS_B], p[_MM_KABS_L], p[_MM_KABS_D], p[_MM_KABS_S],
+                                               p[_MM_KABS_H], p[_MM_KABS_B2], p[_MM_KABS_L2], p[_MM_KABS_S2]]),
+                                     bolus, basal, tau, u2ss, t_hour, split_point, SI_BY_HOUR_EXTENDED,
+                                     np.array([p[_MM_SI_B], p[_MM_SI_L], p[_MM_SI_D], p[_MM_SI_B2]]),
+                                     previous_Ra,
+                                     p[_GB], p[_SG], p[_P2], p[_KD], p[_KA2], p[_MM_KE], p[_KEMPT], p[_MM_VI],
+                                     p[_MM_VG], p[_MM_F], p[_MM_ALPHA], p[_MM_R1], p[_MM_R2], Ipb,
+                                     tsteps, yts, glucose, glucose_idxs, sse_max, G)
+
+    sse = 0.0
+    j = 0
+    if store:
+        G[0] = x[nx - 1]
+    if j < n_obs and glucose_idxs[j] == 0:
+        e = x[nx - 1] - glucose[glucose_idxs[j]]
+        sse += e * e
+        j += 1
+
+    for k in range(1, tsteps):
+        model_step_equations_multi_meal_extended(_delayed(bolus, k, tau, 0.0) + _delayed(basal, k, tau, u2ss),
+                                                 _delayed(meal_B, k, beta_B, 0.0),
+                                                 _delayed(meal_L, k, beta_L, 0.0),
+                                                 _delayed(meal_D, k, beta_D, 0.0),
+                                                 _delayed(meal_S, k, beta_S, 0.0),
+                                                 meal_H[k],
+                                                 _delayed(meal_B2, k, beta_B2, 0.0),
+                                                 _delayed(meal_L2, k, beta_L2, 0.0),
+                                                 _delayed(meal_S2, k, beta_S2, 0.0),
+                                                 t_hour[k], k > split_point, x, x,
+                                                 logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
+                                                 p[_MM_R2], p[_KEMPT], p[_KD], p[_KA2], p[_MM_KE], p[_P2],
+                                                 p[_MM_SI_B], p[_MM_SI_L], p[_MM_SI_D], p[_MM_SI_B2],
+                                                 p[_MM_VI], p[_MM_VG], Ipb, p[_SG], p[_GB], p[_MM_F],
+                                                 p[_MM_KABS_B], p[_MM_KABS_L], p[_MM_KABS_D], p[_MM_KABS_S],
+                                                 p[_MM_KABS_H], p[_MM_KABS_B2], p[_MM_KABS_L2],
+                                                 p[_MM_KABS_S2], p[_MM_ALPHA], previous_Ra[k], 0, 0, 0)
+        if store:
+            G[k] = x[nx - 1]
+        if j < n_obs and k == glucose_idxs[j] * yts:
+            e = x[nx - 1] - glucose[glucose_idxs[j]]
+            sse += e * e
+            j += 1
+            if sse > sse_max:
+                return sse
+
+    return sse
+
+
+@njit(parallel=True, cache=True)
+def simulate_ensemble_single_meal(P, x0, ins_scale,
+                                  bolus, basal, meal, t_hour, previous_Ra,
+                                  tsteps, ts):
+    """
+    Internal function that simulates the single-meal model for each row of the packed parameter matrix P, in
+    parallel. Optimized for twinning only.
+    """
+    G = np.empty((P.shape[0], tsteps))
+    no_glucose, no_idxs = np.empty(0), np.empty(0, dtype=np.int64)
+    for r in prange(P.shape[0]):
+        _integrate_single_meal(P[r], x0, ins_scale, bolus, basal, meal, t_hour, previous_Ra,
+                               tsteps, ts, 1, no_glucose, no_idxs, _NO_BOUND, G[r])
+    return G
+
+
+@njit(parallel=True, cache=True)
+def simulate_ensemble_multi_meal(P, x0, ins_scale,
+                                 bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour, previous_Ra,
+                                 tsteps, ts):
+    """
+    Internal function that simulates the multi-meal model for each row of the packed parameter matrix P, in
+    parallel. Optimized for twinning only.
+    """
+    G = np.empty((P.shape[0], tsteps))
+    no_glucose, no_idxs = np.empty(0), np.empty(0, dtype=np.int64)
+    for r in prange(P.shape[0]):
+        _integrate_multi_meal(P[r], x0, ins_scale, bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour,
+                              previous_Ra, tsteps, ts, 1, no_glucose, no_idxs, _NO_BOUND, G[r])
+    return G
+
+
+@njit(parallel=True, cache=True)
+def simulate_ensemble_multi_meal_extended(P, x0, ins_scale,
+                                          bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                          meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                          tsteps, ts):
+    """
+    Internal function that simulates the multi-meal extended model for each row of the packed parameter matrix P, in
+    parallel. Optimized for twinning only.
+    """
+    G = np.empty((P.shape[0], tsteps))
+    no_glucose, no_idxs = np.empty(0), np.empty(0, dtype=np.int64)
+    for r in prange(P.shape[0]):
+        _integrate_multi_meal_extended(P[r], x0, ins_scale, bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                       meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                       tsteps, ts, 1, no_glucose, no_idxs, _NO_BOUND, G[r])
+    return G
+
+
+@njit(cache=True, nogil=True)
+def _log_prior_multi_meal(p):
+    """
+    Internal function that computes the log prior of a packed multi-meal parameter vector.
+    """
+    return log_prior_multi_meal(p[_MM_VG],
+                                0, p[_MM_SI_B], 0, p[_MM_SI_L], 0, p[_MM_SI_D],
+                                0, p[_MM_KABS_B], 0, p[_MM_KABS_L], 0, p[_MM_KABS_D], 0, p[_MM_KABS_S],
+                                0, p[_MM_KABS_H],
+                                0, p[_MM_BETA_B], 0, p[_MM_BETA_L], 0, p[_MM_BETA_D], 0, p[_MM_BETA_S],
+                                p)
+
+
+@njit(cache=True, nogil=True)
+def _log_prior_multi_meal_extended(p):
+    """
+    Internal function that computes the log prior of a packed multi-meal extended parameter vector.
+    """
+    return log_prior_multi_meal_extended(p[_MM_VG],
+                                         0, p[_MM_SI_B], 0, p[_MM_SI_L], 0, p[_MM_SI_D],
+                                         0, p[_MM_KABS_B], 0, p[_MM_KABS_L], 0, p[_MM_KABS_D], 0, p[_MM_KABS_S],
+                                         0, p[_MM_KABS_H],
+                                         0, p[_MM_BETA_B], 0, p[_MM_BETA_L], 0, p[_MM_BETA_D], 0, p[_MM_BETA_S],
+                                         0, p[_MM_SI_B2], 0, p[_MM_KABS_B2], 0, p[_MM_KABS_L2], 0, p[_MM_KABS_S2],
+                                         0, p[_MM_BETA_B2], 0, p[_MM_BETA_L2], 0, p[_MM_BETA_S2],
+                                         p)
+
+
+@njit(cache=True, nogil=True)
+def _unpack_theta(theta, p0, theta_pos):
+    """
+    Internal function that builds the packed parameter vector of theta, given the packed default vector p0 and the
+    positions theta_pos of the unknown parameters in the layout.
+    """
+    p = p0.copy()
+    for j in range(theta_pos.shape[0]):
+        p[theta_pos[j]] = theta[j]
+    return p
+
+
+@njit(cache=True, nogil=True)
+def _log_posterior_single_meal(p, x0, ins_scale,
+                               bolus, basal, meal, t_hour, previous_Ra,
+                               tsteps, ts, yts, glucose, glucose_idxs, SDn, lp_min):
+    """
+    Internal function that computes the log posterior of a packed single-meal parameter vector. The model is
+    simulated only if the log prior is finite, and it is stopped as soon as the log posterior is known to be lower than
+    lp_min (in which case -inf is returned). Use lp_min = -inf to always compute it.
+    """
+    lp = log_prior_single_meal(p[_SM_VG], p[:_SM_R1])
+    if lp == -np.inf:
+        return lp
+    sse_max = _NO_BOUND if lp_min == -np.inf else 2.0 * SDn * SDn * (lp - lp_min)
+    if sse_max < 0:
+        return -np.inf
+    sse = _integrate_single_meal(p, x0, ins_scale, bolus, basal, meal, t_hour, previous_Ra,
+                                 tsteps, ts, yts, glucose, glucose_idxs, sse_max, np.empty(0))
+    if sse > sse_max:
+        return -np.inf
+    return lp - 0.5 * sse / (SDn * SDn)
+
+
+@njit(cache=True, nogil=True)
+def _log_posterior_multi_meal(p, x0, ins_scale,
+                              bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour, previous_Ra,
+                              tsteps, ts, yts, glucose, glucose_idxs, SDn, lp_min):
+    """
+    Internal function that computes the log posterior of a packed multi-meal parameter vector. The model is
+    simulated only if the log prior is finite, and it is stopped as soon as the log posterior is known to be lower than
+    lp_min (in which case -inf is returned). Use lp_min = -inf to always compute it.
+    """
+    lp = _log_prior_multi_meal(p)
+    if lp == -np.inf:
+        return lp
+    sse_max = _NO_BOUND if lp_min == -np.inf else 2.0 * SDn * SDn * (lp - lp_min)
+    if sse_max < 0:
+        return -np.inf
+    sse = _integrate_multi_meal(p, x0, ins_scale, bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour,
+                                previous_Ra, tsteps, ts, yts, glucose, glucose_idxs, sse_max, np.empty(0))
+    if sse > sse_max:
+        return -np.inf
+    return lp - 0.5 * sse / (SDn * SDn)
+
+
+@njit(cache=True, nogil=True)
+def _log_posterior_multi_meal_extended(p, x0, ins_scale,
+                                       bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                       meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                       tsteps, ts, yts, glucose, glucose_idxs, SDn, lp_min):
+    """
+    Internal function that computes the log posterior of a packed multi-meal extended parameter vector. The model is
+    simulated only if the log prior is finite, and it is stopped as soon as the log posterior is known to be lower than
+    lp_min (in which case -inf is returned). Use lp_min = -inf to always compute it.
+    """
+    lp = _log_prior_multi_meal_extended(p)
+    if lp == -np.inf:
+        return lp
+    sse_max = _NO_BOUND if lp_min == -np.inf else 2.0 * SDn * SDn * (lp - lp_min)
+    if sse_max < 0:
+        return -np.inf
+    sse = _integrate_multi_meal_extended(p, x0, ins_scale, bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                         meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                         tsteps, ts, yts, glucose, glucose_idxs, sse_max, np.empty(0))
+    if sse > sse_max:
+        return -np.inf
+    return lp - 0.5 * sse / (SDn * SDn)
+
+
+@njit(cache=True, nogil=True)
+def log_posterior_single_meal(theta, p0, theta_pos, x0, ins_scale,
+                              bolus, basal, meal, t_hour, previous_Ra,
+                              tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the log posterior of the unknown parameters theta of the single-meal model.
+
+    Parameters
+    ----------
+    theta: np.ndarray
+        The current guess of unknown model parameters.
+    p0: np.ndarray
+        The packed vector (see `SINGLE_MEAL_PARAMETERS`) containing the values of the known model parameters.
+    theta_pos: np.ndarray
+        The positions, in the packed vector, of the unknown model parameters.
+    x0: np.ndarray
+        The initial model state.
+    ins_scale: np.ndarray
+        The scaling factors to apply to the steady state of the insulin compartments.
+    bolus, basal, meal, t_hour: np.ndarray
+        The model inputs, as unpacked by `ReplayBGData`.
+    previous_Ra: np.ndarray
+        The residual rate of appearance coming from the previous portion of data.
+    tsteps: int
+        The total simulation length [integration steps].
+    ts: int
+        The integration step [min]. If 1, the model is integrated with the backward-euler method, otherwise with the
+        exponential integrator (see `exponential_integrator_t1d`).
+    yts: int
+        The measurement (cgm) sample time.
+    glucose: np.ndarray
+        The glucose data.
+    glucose_idxs: np.ndarray
+        The indexes of the non-missing glucose data.
+    SDn: float
+        The standard deviation of the measurement noise.
+
+    Returns
+    -------
+    log_posterior: float
+        The value of the log posterior of the current guess.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    T1DModelSingleMeal.compiled_log_posterior
+
+    Examples
+    --------
+    None
+    """
+    return _log_posterior_single_meal(_unpack_theta(theta, p0, theta_pos), x0, ins_scale,
+                                      bolus, basal, meal, t_hour, previous_Ra,
+                                      tsteps, ts, yts, glucose, glucose_idxs, SDn, -np.inf)
+
+
+@njit(cache=True, nogil=True)
+def neg_log_posterior_single_meal(theta, p0, theta_pos, x0, ins_scale,
+                                  bolus, basal, meal, t_hour, previous_Ra,
+                                  tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the negative log posterior of the unknown parameters theta of the single-meal model. See
+    `log_posterior_single_meal`.
+    """
+    return - log_posterior_single_meal(theta, p0, theta_pos, x0, ins_scale,
+                                       bolus, basal, meal, t_hour, previous_Ra,
+                                       tsteps, ts, yts, glucose, glucose_idxs, SDn)
+
+
+@njit(cache=True, nogil=True)
+def log_posterior_multi_meal(theta, p0, theta_pos, x0, ins_scale,
+                             bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour, previous_Ra,
+                             tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the log posterior of the unknown parameters theta of the multi-meal model. Arguments are the same of
+    `log_posterior_single_meal`, with `meal` split into `meal_B`, `meal_L`, `meal_D`, `meal_S`, and `meal_H`, and p0
+    following `MULTI_MEAL_PARAMETERS`.
+    """
+    return _log_posterior_multi_meal(_unpack_theta(theta, p0, theta_pos), x0, ins_scale,
+                                     bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour, previous_Ra,
+                                     tsteps, ts, yts, glucose, glucose_idxs, SDn, -np.inf)
+
+
+@njit(cache=True, nogil=True)
+def neg_log_posterior_multi_meal(theta, p0, theta_pos, x0, ins_scale,
+                                 bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour, previous_Ra,
+                                 tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the negative log posterior of the unknown parameters theta of the multi-meal model. See
+    `log_posterior_multi_meal`.
+    """
+    return - log_posterior_multi_meal(theta, p0, theta_pos, x0, ins_scale,
+                                      bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour, previous_Ra,
+                                      tsteps, ts, yts, glucose, glucose_idxs, SDn)
+
+
+@njit(cache=True, nogil=True)
+def log_posterior_multi_meal_extended(theta, p0, theta_pos, x0, ins_scale,
+                                      bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                      meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                      tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the log posterior of the unknown parameters theta of the multi-meal extended model. Arguments are the
+    same of `log_posterior_multi_meal`, plus the second-day meals `meal_B2`, `meal_L2`, `meal_S2` and the
+    `split_point`, with p0 following `MULTI_MEAL_EXTENDED_PARAMETERS`.
+    """
+    return _log_posterior_multi_meal_extended(_unpack_theta(theta, p0, theta_pos), x0, ins_scale,
+                                              bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                              meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                              tsteps, ts, yts, glucose, glucose_idxs, SDn, -np.inf)
+
+
+@njit(cache=True, nogil=True)
+def neg_log_posterior_multi_meal_extended(theta, p0, theta_pos, x0, ins_scale,
+                                          bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                          meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                          tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the negative log posterior of the unknown parameters theta of the multi-meal extended model. See
+    `log_posterior_multi_meal_extended`.
+    """
+    return - log_posterior_multi_meal_extended(theta, p0, theta_pos, x0, ins_scale,
+                                               bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                               meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                               tsteps, ts, yts, glucose, glucose_idxs, SDn)
+
+
+@njit(cache=True, nogil=True)
+def _posterior_gradient(p, theta_pos, VG, lp, si_pos, kabs_pos, sse, dsse, SDn):
+    """
+    Internal function that combines the log prior lp and the sum of squared residuals sse (with its gradient dsse with
+    respect to the sensitivity columns) into the log posterior and its gradient with respect to the unknown parameters
+    at positions theta_pos of the packed vector p.
+    """
+    grad = log_prior_gradient(VG, p, si_pos, kabs_pos)
+    for q in range(6):
+        grad[q] -= 0.5 * dsse[q] / (SDn * SDn)
+    for s in range(si_pos.shape[0]):
+        grad[si_pos[s]] -= 0.5 * dsse[6 + s] / (SDn * SDn)
+    for c in range(kabs_pos.shape[0]):
+        grad[kabs_pos[c]] -= 0.5 * dsse[6 + si_pos.shape[0] + c] / (SDn * SDn)
+    return lp - 0.5 * sse / (SDn * SDn), grad[theta_pos]
+
+
+@njit(cache=True, nogil=True)
+def log_posterior_gradient_single_meal(theta, p0, theta_pos, x0, ins_scale,
+                                       bolus, basal, meal, t_hour, previous_Ra,
+                                       tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the log posterior of the unknown parameters theta of the single-meal model and its gradient, using the
+    forward-sensitivity engine (see `sensitivity_t1d`). Arguments are the same of `log_posterior_single_meal`. The
+    model is always integrated with the 1-minute backward-euler method (i.e., ts is ignored), so that the gradient is
+    exact. The gradient with respect to beta is zero.
+
+    Returns
+    -------
+    log_posterior: float
+        The value of the log posterior of the current guess.
+    gradient: np.ndarray
+        The gradient of the log posterior with respect to theta (meaningful only if the log posterior is finite).
+    """
+    p = _unpack_theta(theta, p0, theta_pos)
+    lp = log_prior_single_meal(p[_SM_VG], p[:_SM_R1])
+    if lp == -np.inf:
+        return lp, np.zeros(theta_pos.shape[0])
+
+    nx = x0.shape[0]
+    x, Ipb = _initial_state(p, _KD, _KA2, _SM_KE, _SM_U2SS, x0, ins_scale, nx)
+    sse, dsse = integrate_sensitivity(x, (meal,), np.array([max(int(p[_SM_BETA]), 0)]), np.array([p[_SM_KABS]]),
+                                      bolus, basal, max(int(p[_SM_TAU]), 0), p[_SM_U2SS],
+                                      t_hour, 0, SI_CONSTANT, np.array([p[_SM_SI]]),
+                                      previous_Ra,
+                                      p[_GB], p[_SG], p[_P2], p[_KD], p[_KA2], p[_SM_KE], p[_KEMPT], p[_SM_VI],
+                                      p[_SM_VG], p[_SM_F], p[_SM_ALPHA], p[_SM_R1], p[_SM_R2], Ipb,
+                                      tsteps, yts, glucose, glucose_idxs)
+    return _posterior_gradient(p, theta_pos, p[_SM_VG], lp, _SM_SI_POS, _SM_KABS_POS, sse, dsse, SDn)
+
+
+@njit(cache=True, nogil=True)
+def neg_log_posterior_gradient_single_meal(theta, p0, theta_pos, x0, ins_scale,
+                                           bolus, basal, meal, t_hour, previous_Ra,
+                                           tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the negative log posterior of the unknown parameters theta of the single-meal model and its gradient. See
+    `log_posterior_gradient_single_meal`.
+    """
+    lp, grad = log_posterior_gradient_single_meal(theta, p0, theta_pos, x0, ins_scale,
+                                                  bolus, basal, meal, t_hour, previous_Ra,
+                                                  tsteps, ts, yts, glucose, glucose_idxs, SDn)
+    return - lp, - grad
+
+
+@njit(cache=True, nogil=True)
+def log_posterior_gradient_multi_meal(theta, p0, theta_pos, x0, ins_scale,
+                                      bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour, previous_Ra,
+                                      tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the log posterior of the unknown parameters theta of the multi-meal model and its gradient. Arguments are
+    the same of `log_posterior_multi_meal`. See `log_posterior_gradient_single_meal`.
+    """
+    p = _unpack_theta(theta, p0, theta_pos)
+    lp = _log_prior_multi_meal(p)
+    if lp == -np.inf:
+        return lp, np.zeros(theta_pos.shape[0])
+
+    nx = x0.shape[0]
+    x, Ipb = _initial_state(p, _KD, _KA2, _MM_KE, _MM_U2SS, x0, ins_scale, nx)
+    delays = np.array([max(int(p[_MM_BETA_B]), 0), max(int(p[_MM_BETA_L]), 0), max(int(p[_MM_BETA_D]), 0),
+                       max(int(p[_MM_BETA_S]), 0), 0])
+    sse, dsse = integrate_sensitivity(x, (meal_B, meal_L, meal_D, meal_S, meal_H), delays, p[_MM_KABS_POS],
+                                      bolus, basal, max(int(p[_MM_TAU]), 0), p[_MM_U2SS],
+                                      t_hour, 0, SI_BY_HOUR, p[_MM_SI_POS],
+                                      previous_Ra,
+                                      p[_GB], p[_SG], p[_P2], p[_KD], p[_KA2], p[_MM_KE], p[_KEMPT], p[_MM_VI],
+                                      p[_MM_VG], p[_MM_F], p[_MM_ALPHA], p[_MM_R1], p[_MM_R2], Ipb,
+                                      tsteps, yts, glucose, glucose_idxs)
+    return _posterior_gradient(p, theta_pos, p[_MM_VG], lp, _MM_SI_POS, _MM_KABS_POS, sse, dsse, SDn)
+
+
+@njit(cache=True, nogil=True)
+def neg_log_posterior_gradient_multi_meal(theta, p0, theta_pos, x0, ins_scale,
+                                          bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour, previous_Ra,
+                                          tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the negative log posterior of the unknown parameters theta of the multi-meal model and its gradient. See
+    `log_posterior_gradient_multi_meal`.
+    """
+    lp, grad = log_posterior_gradient_multi_meal(theta, p0, theta_pos, x0, ins_scale,
+                                                 bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour,
+                                                 previous_Ra, tsteps, ts, yts, glucose, glucose_idxs, SDn)
+    return - lp, - grad
+
+
+@njit(cache=True, nogil=True)
+def log_posterior_gradient_multi_meal_extended(theta, p0, theta_pos, x0, ins_scale,
+                                               bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                               meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                               tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the log posterior of the unknown parameters theta of the multi-meal extended model and its gradient.
+    Arguments are the same of `log_posterior_multi_meal_extended`. See `log_posterior_gradient_single_meal`.
+    """
+    p = _unpack_theta(theta, p0, theta_pos)
+    lp = _log_prior_multi_meal_extended(p)
+    if lp == -np.inf:
+        return lp, np.zeros(theta_pos.shape[0])
+
+    nx = x0.shape[0]
+    x, Ipb = _initial_state(p, _KD, _KA2, _MM_KE, _MM_U2SS, x0, ins_scale, nx)
+    delays = np.array([max(int(p[_MM_BETA_B]), 0), max(int(p[_MM_BETA_L]), 0), max(int(p[_MM_BETA_D]), 0),
+                       max(int(p[_MM_BETA_S]), 0), 0,
+                       max(int(p[_MM_BETA_B2]), 0), max(int(p[_MM_BETA_L2]), 0), max(int(p[_MM_BETA_S2]), 0)])
+    sse, dsse = integrate_sensitivity(x, (meal_B, meal_L, meal_D, meal_S, meal_H, meal_B2, meal_L2, meal_S2), delays,
+                                      p[_MME_KABS_POS],
+                                      bolus, basal, max(int(p[_MM_TAU]), 0), p[_MM_U2SS],
+                                      t_hour, split_point, SI_BY_HOUR_EXTENDED, p[_MME_SI_POS],
+                                      previous_Ra,
+                                      p[_GB], p[_SG], p[_P2], p[_KD], p[_KA2], p[_MM_KE], p[_KEMPT], p[_MM_VI],
+                                      p[_MM_VG], p[_MM_F], p[_MM_ALPHA], p[_MM_R1], p[_MM_R2], Ipb,
+                                      tsteps, yts, glucose, glucose_idxs)
+    return _posterior_gradient(p, theta_pos, p[_MM_VG], lp, _MME_SI_POS, _MME_KABS_POS, sse, dsse, SDn)
+
+
+@njit(cache=True, nogil=True)
+def neg_log_posterior_gradient_multi_meal_extended(theta, p0, theta_pos, x0, ins_scale,
+                                                   bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                                   meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                                   tsteps, ts, yts, glucose, glucose_idxs, SDn):
+    """
+    Computes the negative log posterior of the unknown parameters theta of the multi-meal extended model and its
+    gradient. See `log_posterior_gradient_multi_meal_extended`.
+    """
+    lp, grad = log_posterior_gradient_multi_meal_extended(theta, p0, theta_pos, x0, ins_scale,
+                                                          bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                                          meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                                          tsteps, ts, yts, glucose, glucose_idxs, SDn)
+    return - lp, - grad
+
+
+@njit(parallel=True, cache=True)
+def log_posterior_ensemble_single_meal(P, x0, ins_scale,
+                                       bolus, basal, meal, t_hour, previous_Ra,
+                                       tsteps, ts, yts, glucose, glucose_idxs, SDn, lp_min):
+    """
+    Internal function that computes the log posterior of each row of the packed parameter matrix P of the single-meal
+    model, in parallel. The model is simulated only if the log prior is finite, and the simulation of row r is stopped
+    (returning -inf) as soon as its log posterior is known to be lower than lp_min[r].
+    """
+    lp = np.empty(P.shape[0])
+    for r in prange(P.shape[0]):
+        lp[r] = _log_posterior_single_meal(P[r], x0, ins_scale, bolus, basal, meal, t_hour, previous_Ra,
+                                           tsteps, ts, yts, glucose, glucose_idxs, SDn, lp_min[r])
+    return lp
+
+
+@njit(parallel=True, cache=True)
+def log_posterior_ensemble_multi_meal(P, x0, ins_scale,
+                                      bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H, t_hour, previous_Ra,
+                                      tsteps, ts, yts, glucose, glucose_idxs, SDn, lp_min):
+    """
+    Internal function that computes the log posterior of each row of the packed parameter matrix P of the multi-meal
+    model, in parallel. The model is simulated only if the log prior is finite, and the simulation of row r is stopped
+    (returning -inf) as soon as its log posterior is known to be lower than lp_min[r].
+    """
+    lp = np.empty(P.shape[0])
+    for r in prange(P.shape[0]):
+        lp[r] = _log_posterior_multi_meal(P[r], x0, ins_scale, bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                          t_hour, previous_Ra, tsteps, ts, yts, glucose, glucose_idxs, SDn, lp_min[r])
+    return lp
+
+
+@njit(parallel=True, cache=True)
+def log_posterior_ensemble_multi_meal_extended(P, x0, ins_scale,
+                                               bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                               meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                               tsteps, ts, yts, glucose, glucose_idxs, SDn, lp_min):
+    """
+    Internal function that computes the log posterior of each row of the packed parameter matrix P of the multi-meal
+    extended model, in parallel. The model is simulated only if the log prior is finite, and the simulation of row r is
+    stopped (returning -inf) as soon as its log posterior is known to be lower than lp_min[r].
+    """
+    lp = np.empty(P.shape[0])
+    for r in prange(P.shape[0]):
+        lp[r] = _log_posterior_multi_meal_extended(P[r], x0, ins_scale,
+                                                   bolus, basal, meal_B, meal_L, meal_D, meal_S, meal_H,
+                                                   meal_B2, meal_L2, meal_S2, t_hour, split_point, previous_Ra,
+                                                   tsteps, ts, yts, glucose, glucose_idxs, SDn, lp_min[r])
+    return lp
+
+
+def replay_coefficients(P: np.ndarray, layout: tuple) -> np.ndarray:
+    """
+    Computes the constant model coefficients used by the step equations (i.e., logGb_r2, log60_r2, risk_coeff, k1,
+    k2, kd_fac, and Ipb) for each row of the packed parameter matrix P, as done by `simulate`.
+
+    Parameters
+    ----------
+    P: np.ndarray
+        A (n, len(layout)) matrix containing the packed parameter vectors.
+    layout: tuple
+        The names of the packed parameters, in order.
+
+    Returns
+    -------
+    C: np.ndarray
+        A (n, 7) matrix containing the constant model coefficients of each row of P.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    None
+
+    Examples
+    --------
+    None
+    """
+    Gb, r1, r2 = P[:, layout.index('Gb')], P[:, layout.index('r1')], P[:, layout.index('r2')]
+    kempt, kd, ka2, ke = (P[:, layout.index('kempt')], P[:, layout.index('kd')], P[:, layout.index('ka2')],
+                          P[:, layout.index('ke')])
+    u2ss = P[:, layout.index('u2ss')]
+
+    ki1 = u2ss / kd
+    ki2 = kd / ka2 * ki1
+    return np.column_stack([np.log(Gb) ** r2, np.log(60.0) ** r2, 10.0 * r1,
+                            1.0 / (1.0 + kempt), 1.0 / (1.0 + kempt), 1.0 / (1.0 + kd),
+                            ka2 / ke * ki2])
+
+
+def delay_batch(u: np.ndarray, delays: np.ndarray, before: float | np.ndarray = 0.0) -> np.ndarray:
+    """
+    Returns the input u delayed by a different number of steps for each realization of a lockstep batched replay,
+    i.e., the batched version of the delayed input vectors built by `simulate`.
+
+    Parameters
+    ----------
+    u: np.ndarray
+        A (tsteps, ) array containing the input.
+    delays: np.ndarray
+        A (n, ) array containing the delay of each realization (steps).
+    before: float | np.ndarray, optional, default : 0.0
+        The value of the input before its start, either shared or one per realization.
+
+    Returns
+    -------
+    u_delayed: np.ndarray
+        A (n, tsteps) matrix containing the delayed input of each realization.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    None
+
+    Examples
+    --------
+    None
+    """
+    before = np.broadcast_to(before, delays.shape)
+    u_delayed = np.empty((delays.shape[0], u.shape[0]))
+    for r in range(delays.shape[0]):
+        delay = min(max(delays[r], 0), u.shape[0])
+        u_delayed[r, :delay] = before[r]
+        u_delayed[r, delay:] = u[:u.shape[0] - delay]
+    return u_delayed
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def replay_step_single_meal(k, X, P, C,
+                            bolus_delayed, basal_delayed, meal_delayed, t_hour, previous_Ra,
+                            custom_forcing_Ra, forcing_ip, forcing_ra):
+    """
+    Internal function that advances in place the state X[r] of each realization of a lockstep batched replay of the
+    single-meal model from step k - 1 to step k. C contains the constant model coefficients of each realization (see
+    `replay_coefficients`). Optimized for replay only.
+    """
+    for r in range(X.shape[0]):
+        p = P[r]
+        model_step_equations_single_meal(bolus_delayed[r, k] + basal_delayed[r, k], meal_delayed[r, k], t_hour[k],
+                                         X[r], X[r],
+                                         C[r, 0], C[r, 1], C[r, 2], C[r, 3], C[r, 4], C[r, 5],
+                                         p[_SM_R2], p[_KEMPT], p[_KD], p[_KA2], p[_SM_KE], p[_P2], p[_SM_SI],
+                                         p[_SM_VI], p[_SM_VG], C[r, 6], p[_SG], p[_GB], p[_SM_F], p[_SM_KABS],
+                                         p[_SM_ALPHA], previous_Ra[k], custom_forcing_Ra, forcing_ip[r, k],
+                                         forcing_ra[r, k])
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def replay_step_multi_meal(k, X, P, C,
+                           bolus_delayed, basal_delayed, meal_B_delayed, meal_L_delayed, meal_D_delayed,
+                           meal_S_delayed, meal_H, t_hour, previous_Ra,
+                           custom_forcing_Ra, forcing_ip, forcing_ra):
+    """
+    Internal function that advances in place the state X[r] of each realization of a lockstep batched replay of the
+    multi-meal model from step k - 1 to step k. C contains the constant model coefficients of each realization (see
+    `replay_coefficients`). Optimized for replay only.
+    """
+    for r in range(X.shape[0]):
+        p = P[r]
+        model_step_equations_multi_meal(bolus_delayed[r, k] + basal_delayed[r, k],
+                                        meal_B_delayed[r, k], meal_L_delayed[r, k], meal_D_delayed[r, k],
+                                        meal_S_delayed[r, k], meal_H[r, k], t_hour[k], X[r], X[r],
+                                        C[r, 0], C[r, 1], C[r, 2], C[r, 3], C[r, 4], C[r, 5],
+                                        p[_MM_R2], p[_KEMPT], p[_KD], p[_KA2], p[_MM_KE], p[_P2],
+                                        p[_MM_SI_B], p[_MM_SI_L], p[_MM_SI_D], p[_MM_VI], p[_MM_VG], C[r, 6],
+                                        p[_SG], p[_GB], p[_MM_F],
+                                        p[_MM_KABS_B], p[_MM_KABS_L], p[_MM_KABS_D], p[_MM_KABS_S],
+                                        p[_MM_KABS_H], p[_MM_ALPHA], previous_Ra[k], custom_forcing_Ra,
+                                        forcing_ip[r, k], forcing_ra[r, k])
+
+
+@njit(nogil=True)
+def replay_closed_loop_single_meal(X, P, C, G, IG,
+                                   bolus, basal, bolus_g, basal_g, correction_bolus, hypotreatments, meal_announcement,
+                                   bolus_delayed, basal_delayed, meal_delayed, t_hour, previous_Ra,
+                                   forcing_ip, forcing_ra, tau, to_g, to_mgkg, nx,
+                                   bolus_calculator_handler, basal_handler, hypotreatments_handler,
+                                   correction_boluses_handler,
+                                   bolus_calculator_state, basal_state, hypotreatments_state, correction_boluses_state,
+                                   due, enabled):
+    """
+    Internal function that replays in place, in a single compiled call, the closed loop of all the realizations of a
+    lockstep batched replay of the single-meal model whose enabled DSS handlers are all compiled (see
+    `py_replay_bg.dss.compiled_handlers`). Optimized for replay only.
+    """
+    held_basal = np.zeros(X.shape[0])
+    for k in range(1, G.shape[1]):
+        closed_loop_controls(k, tau, IG, meal_announcement, hypotreatments, bolus, basal, bolus_g, basal_g,
+                             correction_bolus, bolus_delayed, basal_delayed, meal_delayed, t_hour, to_g, to_mgkg,
+                             held_basal,
+                             bolus_calculator_handler, basal_handler, hypotreatments_handler,
+                             correction_boluses_handler,
+                             bolus_calculator_state, basal_state, hypotreatments_state, correction_boluses_state,
+                             due, enabled)
+        replay_step_single_meal(k, X, P, C,
+                                bolus_delayed, basal_delayed, meal_delayed, t_hour, previous_Ra,
+                                0.0, forcing_ip, forcing_ra)
+        G[:, k] = X[:, 0]
+        IG[:, k] = X[:, nx - 1]
+
+
+@njit(nogil=True)
+def replay_closed_loop_multi_meal(X, P, C, G, IG,
+                                  bolus, basal, bolus_g, basal_g, correction_bolus, hypotreatments, meal_announcement,
+                                  bolus_delayed, basal_delayed, meal_B_delayed, meal_L_delayed, meal_D_delayed,
+                                  meal_S_delayed, meal_H, t_hour, previous_Ra,
+                                  forcing_ip, forcing_ra, tau, to_g, to_mgkg, nx,
+                                  bolus_calculator_handler, basal_handler, hypotreatments_handler,
+                                  correction_boluses_handler,
+                                  bolus_calculator_state, basal_state, hypotreatments_state, correction_boluses_state,
+                                  due, enabled):
+    """
+    Internal function that replays in place, in a single compiled call, the closed loop of all the realizations of a
+    lockstep batched replay of the multi-meal model whose enabled DSS handlers are all compiled (see
+    `py_replay_bg.dss.compiled_handlers`). Optimized for replay only.
+    """
+    held_basal = np.zeros(X.shape[0])
+    for k in range(1, G.shape[1]):
+        closed_loop_controls(k, tau, IG, meal_announcement, hypotreatments, bolus, basal, bolus_g, basal_g,
+                             correction_bolus, bolus_delayed, basal_delayed, meal_H, t_hour, to_g, to_mgkg,
+                             held_basal,
+                             bolus_calculator_handler, basal_handler, hypotreatments_handler,
+                             correction_boluses_handler,
+                             bolus_calculator_state, basal_state, hypotreatments_state, correction_boluses_state,
+                             due, enabled)
+        replay_step_multi_meal(k, X, P, C,
+                               bolus_delayed, basal_delayed, meal_B_delayed, meal_L_delayed, meal_D_delayed,
+                               meal_S_delayed, meal_H, t_hour, previous_Ra,
+                               0.0, forcing_ip, forcing_ra)
+        G[:, k] = X[:, 0]
+        IG[:, k] = X[:, nx - 1]
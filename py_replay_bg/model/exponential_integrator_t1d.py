@@ -0,0 +1,331 @@
+import numpy as np
+
+from numba import njit
+
+# Exponential integrator of the T1D models, used by the compiled twinning functions when the integration step (ts) is
+# greater than 1 minute.
+#
+# The gut (one chain per meal type) and the insulin subsystems, together with the insulin action X, are linear. Their
+# 1-minute backward-euler maps are propagated exactly over ts minutes (i.e., they match the 1-minute reference at the
+# integration grid). The nonlinear glucose equation G_k = (G_km1 + b_k) / (1 + SG + risk(G_km1) * X_k) is linear
+# above Gb (risk = 1): there, it is propagated over ts minutes in closed form by freezing X to its average over the
+# step and linearly interpolating its forcing b_k between the grid points, and the same interpolation is used to
+# propagate the interstitial glucose. Below Gb, where the risk makes it stiff, the glucose and the interstitial glucose
+# are substepped with the 1-minute map, interpolating X, b_k, and the risk within the step.
+
+# Insulin sensitivity selection modes
+SI_CONSTANT, SI_BY_HOUR, SI_BY_HOUR_EXTENDED = 0, 1, 2
+
+# Relative error on the predicted risk at the end of a step above which the step is recomputed
+RISK_TOLERANCE = 0.01
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _chain_step_matrices(kempt, kabs):
+    """
+    Internal function that returns the 1-minute backward-euler map x_k = M x_km1 + N u_k of a gut chain (Qsto1, Qsto2,
+    Qgut), with kgri = kempt.
+    """
+    k1 = 1.0 / (1.0 + kempt)
+    k3 = 1.0 / (1.0 + kabs)
+    M = np.zeros((3, 3))
+    M[0, 0] = k1
+    M[1, 0] = kempt * k1 * k1
+    M[1, 1] = k1
+    M[2, 0] = kempt * M[1, 0] * k3
+    M[2, 1] = kempt * k1 * k3
+    M[2, 2] = k3
+    N = M[:, 0].copy()
+    return M, N
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _insulin_step_matrices(kd, ka2, ke, p2, SI, VI, Ipb):
+    """
+    Internal function that returns the 1-minute backward-euler map x_k = M x_km1 + N u_k + c of the insulin subsystem
+    and the insulin action (Isc1, Isc2, Ip, X).
+    """
+    a1 = 1.0 / (1.0 + kd)
+    a2 = 1.0 / (1.0 + ka2)
+    a3 = 1.0 / (1.0 + ke)
+    a4 = 1.0 / (1.0 + p2)
+    g = p2 * SI / VI
+    M = np.zeros((4, 4))
+    M[0, 0] = a1
+    M[1, 0] = kd * a1 * a2
+    M[1, 1] = a2
+    M[2, 0] = ka2 * M[1, 0] * a3
+    M[2, 1] = ka2 * a2 * a3
+    M[2, 2] = a3
+    for j in range(3):
+        M[3, j] = g * M[2, j] * a4
+    M[3, 3] = a4
+    N = M[:, 0].copy()
+    c = np.zeros(4)
+    c[3] = - g * Ipb * a4
+    return M, N, c
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _window_propagator(M, N, c, ts):
+    """
+    Internal function that returns the exact propagation x_k+ts = P x_k + sum_i W[i - 1] u_k+i + C of the 1-minute map
+    x_k = M x_km1 + N u_k + c over ts minutes.
+    """
+    n = M.shape[0]
+    P = np.eye(n)
+    W = np.empty((ts, n))
+    C = np.zeros(n)
+    for i in range(ts, 0, -1):
+        # Here P = M^(ts - i)
+        for r in range(n):
+            w = 0.0
+            cc = 0.0
+            for s in range(n):
+                w += P[r, s] * N[s]
+                cc += P[r, s] * c[s]
+            W[i - 1, r] = w
+            C[r] += cc
+        P = _small_matmul(P, M)
+    return P, W, C
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _small_matmul(A, B):
+    """
+    Internal function that multiplies two small square matrices.
+    """
+    n = A.shape[0]
+    out = np.zeros((n, n))
+    for r in range(n):
+        for s in range(n):
+            acc = 0.0
+            for t in range(n):
+                acc += A[r, t] * B[t, s]
+            out[r, s] = acc
+    return out
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _risk(g, Gb, r2, logGb_r2, log60_r2, risk_coeff):
+    """
+    Internal function that computes the glucose risk (same definition of the model step equations).
+    """
+    if (g < Gb) and (g >= 60.0):
+        diff = np.log(g) ** r2 - logGb_r2
+        return 1.0 + risk_coeff * diff * diff
+    elif g < 60.0:
+        diff = log60_r2 - logGb_r2
+        return 1.0 + risk_coeff * diff * diff
+    return 1.0
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _glucose_window(g, a, b0, b1, ts):
+    """
+    Internal function that propagates G_k = (G_km1 + b_k) / (1 + a) over ts minutes, with b linearly interpolated
+    between b0 (at the beginning) and b1 (at the end of the step).
+    """
+    q = 1.0 / (1.0 + a)
+    qi = 1.0
+    s0 = 0.0
+    s1 = 0.0
+    for i in range(ts, 0, -1):
+        qi *= q
+        s0 += qi
+        s1 += qi * i / ts
+    return g * qi + b0 * s0 + (b1 - b0) * s1
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _glucose_substeps(g, ig, risk0, risk1, x0, x1, b0, b1, SG, alpha, ts, G, k, store):
+    """
+    Internal function that propagates the glucose and the interstitial glucose over ts minutes with the 1-minute
+    backward-euler map, with X, the forcing b, and the risk linearly interpolated within the step (i.e., from x0, b0,
+    risk0 at the beginning to x1, b1, risk1 at the end). If store, the interstitial glucose is stored in G[k + 1],
+    ..., G[k + ts].
+    """
+    for i in range(1, ts + 1):
+        w = i / ts
+        risk = risk0 + (risk1 - risk0) * (i - 1) / ts
+        g = (g + b0 + (b1 - b0) * w) / (1.0 + SG + risk * (x0 + (x1 - x0) * w))
+        ig = (alpha * ig + g) / (1.0 + alpha)
+        if store:
+            G[k + i] = ig
+    return g, ig
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def si_index(t_hour, k, split_point, si_mode):
+    """
+    Returns the index of the insulin sensitivity (in the order B, L, D, B2) to use at minute k.
+    """
+    if si_mode == SI_CONSTANT:
+        return 0
+    hour = t_hour[k]
+    if hour < 4.0 or hour >= 17.0:
+        return 2
+    if hour < 11.0:
+        return 3 if (si_mode == SI_BY_HOUR_EXTENDED and k > split_point) else 0
+    return 1
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def integrate_exponential(x, ts,
+                          meals, meal_delays, meal_kabs,
+                          bolus, basal, tau, u2ss,
+                          t_hour, split_point, si_mode, si_values,
+                          previous_Ra,
+                          Gb, SG, p2, kd, ka2, ke, kempt, VI, VG, f, alpha, r1, r2, Ipb,
+                          tsteps, yts, glucose, glucose_idxs, sse_max, G):
+    """
+    Internal function that simulates a T1D model with the exponential integrator and an integration step of ts
+    minutes, keeping only the current state x (modified in place). The state layout is the one of the models, i.e.,
+    G, X, one gut chain per meal type, Isc1, Isc2, Ip, IG. The simulated interstitial glucose is stored in G (unless
+    G is empty; values within steps are linearly interpolated) and the sum of squared residuals against the glucose
+    data at the observation times (i.e., glucose_idxs * yts, which must be multiples of ts) is returned. The
+    simulation stops as soon as the sum of squared residuals exceeds sse_max (the partial sum is returned).
+    """
+    nx = x.shape[0]
+    n_chains = meal_kabs.shape[0]
+    n_si = si_values.shape[0]
+    store = G.shape[0] > 0
+    n_obs = glucose_idxs.shape[0]
+
+    logGb_r2 = np.log(Gb) ** r2
+    log60_r2 = np.log(60.0) ** r2
+    risk_coeff = 10.0 * r1
+    ig_r = alpha / (1.0 + alpha)
+
+    # Simulate until the last observation (or until the end, if the trajectory must be stored)
+    k_end = tsteps - 1 if store else (glucose_idxs[n_obs - 1] * yts if n_obs > 0 else 0)
+
+    sse = 0.0
+    j = 0
+    if store:
+        G[0] = x[nx - 1]
+    if j < n_obs and glucose_idxs[j] == 0:
+        e = x[nx - 1] - glucose[glucose_idxs[j]]
+        sse += e * e
+        j += 1
+
+    # Forcing of the glucose equation at the current grid point
+    ra = 0.0
+    for c in range(n_chains):
+        ra += meal_kabs[c] * x[2 + 3 * c + 2]
+    b0 = SG * Gb + f * (ra + previous_Ra[0]) / VG
+
+    g_prev = x[0]
+    h_prev = 1
+    h = -1
+    k = 0
+    while k < k_end:
+
+        # (Re)compute the propagators if the step changes (i.e., at the beginning and for the final partial step)
+        if min(ts, k_end - k) != h:
+            h = min(ts, k_end - k)
+            Pc = np.empty((n_chains, 3, 3))
+            Wc = np.empty((n_chains, h, 3))
+            for c in range(n_chains):
+                M, N = _chain_step_matrices(kempt, meal_kabs[c])
+                Pc[c], Wc[c], _ = _window_propagator(M, N, np.zeros(3), h)
+            Pi = np.empty((n_si, 4, 4))
+            Wi = np.empty((n_si, h, 4))
+            Ci = np.empty((n_si, 4))
+            for s in range(n_si):
+                M, N, cc = _insulin_step_matrices(kd, ka2, ke, p2, si_values[s], VI, Ipb)
+                Pi[s], Wi[s], Ci[s] = _window_propagator(M, N, cc, h)
+            x_mid_w = (h + 1) / (2.0 * h)
+            ig_rh = 1.0
+            ig_w0 = 0.0
+            ig_w1 = 0.0
+            for i in range(h, 0, -1):
+                wi = ig_rh * (1.0 - ig_r)
+                ig_w0 += wi * (1.0 - i / h)
+                ig_w1 += wi * i / h
+                ig_rh *= ig_r
+
+        # Gut chains
+        for c in range(n_chains):
+            base = 2 + 3 * c
+            q0 = x[base]
+            q1 = x[base + 1]
+            q2 = x[base + 2]
+            n0 = Pc[c, 0, 0] * q0
+            n1 = Pc[c, 1, 0] * q0 + Pc[c, 1, 1] * q1
+            n2 = Pc[c, 2, 0] * q0 + Pc[c, 2, 1] * q1 + Pc[c, 2, 2] * q2
+            meal = meals[c]
+            d = meal_delays[c]
+            for i in range(1, h + 1):
+                if k + i >= d:
+                    u = meal[k + i - d]
+                    if u != 0.0:
+                        n0 += Wc[c, i - 1, 0] * u
+                        n1 += Wc[c, i - 1, 1] * u
+                        n2 += Wc[c, i - 1, 2] * u
+            x[base] = n0
+            x[base + 1] = n1
+            x[base + 2] = n2
+
+        # Insulin subsystem and insulin action
+        s = si_index(t_hour, k + (h + 1) // 2, split_point, si_mode)
+        z0 = x[nx - 4]
+        z1 = x[nx - 3]
+        z2 = x[nx - 2]
+        z3 = x[1]
+        n0 = Pi[s, 0, 0] * z0 + Ci[s, 0]
+        n1 = Pi[s, 1, 0] * z0 + Pi[s, 1, 1] * z1 + Ci[s, 1]
+        n2 = Pi[s, 2, 0] * z0 + Pi[s, 2, 1] * z1 + Pi[s, 2, 2] * z2 + Ci[s, 2]
+        n3 = Pi[s, 3, 0] * z0 + Pi[s, 3, 1] * z1 + Pi[s, 3, 2] * z2 + Pi[s, 3, 3] * z3 + Ci[s, 3]
+        for i in range(1, h + 1):
+            u = (bolus[k + i - tau] if k + i >= tau else 0.0) + (basal[k + i - tau] if k + i >= tau else u2ss)
+            n0 += Wi[s, i - 1, 0] * u
+            n1 += Wi[s, i - 1, 1] * u
+            n2 += Wi[s, i - 1, 2] * u
+            n3 += Wi[s, i - 1, 3] * u
+        x[nx - 4] = n0
+        x[nx - 3] = n1
+        x[nx - 2] = n2
+        x_old = x[1]
+        x[1] = n3
+
+        # Glucose
+        ra = 0.0
+        for c in range(n_chains):
+            ra += meal_kabs[c] * x[2 + 3 * c + 2]
+        b1 = SG * Gb + f * (ra + previous_Ra[k + h]) / VG
+        g0 = x[0]
+        ig0 = x[nx - 1]
+        g1 = _glucose_window(g0, SG + x_old + (x[1] - x_old) * x_mid_w, b0, b1, h)
+        if g0 < Gb or g1 < Gb:
+            # The risk is active: substep the glucose and the interstitial glucose with the 1-minute backward-euler
+            # map, linearly interpolating X, the forcing, and the risk within the step. The risk at the end of the
+            # step is predicted by extrapolating the glucose trend of the previous step, and corrected if needed.
+            risk0 = _risk(g0, Gb, r2, logGb_r2, log60_r2, risk_coeff)
+            risk1 = _risk(g0 + (g0 - g_prev) * h / h_prev, Gb, r2, logGb_r2, log60_r2, risk_coeff)
+            x[0], x[nx - 1] = _glucose_substeps(g0, ig0, risk0, risk1, x_old, x[1], b0, b1, SG, alpha, h, G, k,
+                                                store)
+            risk_end = _risk(x[0], Gb, r2, logGb_r2, log60_r2, risk_coeff)
+            if abs(risk_end - risk1) > RISK_TOLERANCE * risk1:
+                x[0], x[nx - 1] = _glucose_substeps(g0, ig0, risk0, risk_end, x_old, x[1], b0, b1, SG, alpha, h, G,
+                                                    k, store)
+        else:
+            x[0] = g1
+            x[nx - 1] = ig_rh * ig0 + ig_w0 * g0 + ig_w1 * g1
+            if store:
+                for i in range(1, h + 1):
+                    G[k + i] = ig0 + (x[nx - 1] - ig0) * i / h
+        b0 = b1
+        g_prev = g0
+        h_prev = h
+
+        k += h
+
+        if j < n_obs and k == glucose_idxs[j] * yts:
+            e = x[nx - 1] - glucose[glucose_idxs[j]]
+            sse += e * e
+            j += 1
+            if sse > sse_max:
+                return sse
+
+    return sse
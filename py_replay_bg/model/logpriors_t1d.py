@@ -1,4 +1,4 @@
-from py_replay_bg.utils.stats import log_lognorm, log_gamma, log_norm
+from py_replay_bg.utils.stats import log_lognorm, log_gamma, log_norm, d_log_lognorm, d_log_gamma, d_log_norm
 from scipy.stats import gamma, truncnorm, lognorm
 from py_replay_bg.utils.stats import sigmoid
 
@@ -212,7 +212,7 @@ def theta_to_physical(theta: np.ndarray, model) -> dict:
 
     return params
 
-@njit(cache=True)
+@njit(cache=True, nogil=True)
 def log_prior_single_meal(
         VG: float,
         theta: np.ndarray
@@ -272,7 +272,7 @@ def log_prior_single_meal(
             logprior_beta)
 
 
-@njit(cache=True)
+@njit(cache=True, nogil=True)
 def log_prior_multi_meal(
         VG: float,
         pos_SI_B: int,
@@ -450,7 +450,7 @@ def log_prior_multi_meal(
             logprior_beta_S)
 
 
-@njit(cache=True)
+@njit(cache=True, nogil=True)
 def log_prior_multi_meal_extended(
         VG: float,
         pos_SI_B: int,
@@ -694,3 +694,60 @@ def log_prior_multi_meal_extended(
             logprior_beta_B2 +
             logprior_beta_L2 +
             logprior_beta_S2)
+
+
+@njit(cache=True, nogil=True)
+def log_prior_gradient(
+        VG: float,
+        p: np.ndarray,
+        si_pos: np.ndarray,
+        kabs_pos: np.ndarray
+):
+    """
+    Internal function that computes the gradient of the log prior with respect to a packed parameter vector (i.e.,
+    Gb, SG, p2, ka2, kd, kempt first, then the other parameters). It is valid only where the log prior is finite. The
+    prior of the meal delays (beta) is flat, so its gradient is zero.
+
+    Parameters
+    ----------
+    VG : float
+        The value of the VG parameter
+    p : np.ndarray
+        The packed parameter vector.
+    si_pos : np.ndarray
+        The positions of the insulin sensitivity parameters in p.
+    kabs_pos : np.ndarray
+        The positions of the kabs parameters in p.
+
+    Returns
+    -------
+    log_prior_gradient: np.ndarray
+        The gradient of the log prior with respect to p.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    log_prior_single_meal, log_prior_multi_meal, log_prior_multi_meal_extended
+
+    Examples
+    --------
+    None
+    """
+    grad = np.zeros(p.shape[0])
+
+    grad[0] = d_log_norm(p[0], mu=119.13, sigma=7.11)
+    grad[1] = d_log_lognorm(p[1], mu=-3.8, sigma=0.5)
+    grad[2] = d_log_norm(np.sqrt(p[2]), mu=0.11, sigma=0.004) * 0.5 / np.sqrt(p[2])
+    grad[3] = d_log_lognorm(p[3], mu=-4.2875, sigma=0.4274)
+    grad[4] = d_log_lognorm(p[4], mu=-3.5090, sigma=0.6187)
+    grad[5] = d_log_lognorm(p[5], mu=-1.9646, sigma=0.7069)
+
+    for i in si_pos:
+        grad[i] = d_log_gamma(p[i] * VG, 3.3, 1 / 5e-4) * VG
+    for i in kabs_pos:
+        grad[i] = d_log_lognorm(p[i], mu=-5.4591, sigma=1.4396)
+
+    return grad
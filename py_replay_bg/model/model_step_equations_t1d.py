@@ -3,7 +3,7 @@ import numpy as np
 from numba import njit
 
 
-@njit
+@njit(nogil=True)
 def twin_single_meal(tsteps, x,
                      bolus_delayed, basal_delayed,
                      meal_delayed, t_hour,
@@ -18,16 +18,16 @@ def twin_single_meal(tsteps, x,
     # Run simulation
     for k in np.arange(1, tsteps):
         # Integration step
-        x[:, k] = model_step_equations_single_meal(bolus_delayed[k] + basal_delayed[k],
-                                                   meal_delayed[k], t_hour[k],
-                                                   x[:, k - 1],
-                                                   logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
-                                                   r2, kempt, kd, ka2, ke, p2, SI, VI,
-                                                   VG, Ipb, SG, Gb, f, kabs, alpha, previous_Ra[k], 0, 0, 0)
+        model_step_equations_single_meal(bolus_delayed[k] + basal_delayed[k],
+                                         meal_delayed[k], t_hour[k],
+                                         x[:, k - 1], x[:, k],
+                                         logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
+                                         r2, kempt, kd, ka2, ke, p2, SI, VI,
+                                         VG, Ipb, SG, Gb, f, kabs, alpha, previous_Ra[k], 0, 0, 0)
     return x
 
 
-@njit(fastmath=True, cache=True)
+@njit(fastmath=True, cache=True, nogil=True)
 def twin_multi_meal(tsteps, x,
                     bolus_delayed, basal_delayed,
                     meal_B_delayed, meal_L_delayed, meal_D_delayed, meal_S_delayed, meal_H, t_hour,
@@ -37,18 +37,18 @@ def twin_multi_meal(tsteps, x,
     # Run simulation
     for k in np.arange(1, tsteps):
         # Integration step
-        x[:, k] = model_step_equations_multi_meal(bolus_delayed[k] + basal_delayed[k],
-                                                  meal_B_delayed[k], meal_L_delayed[k], meal_D_delayed[k],
-                                                  meal_S_delayed[k], meal_H[k], t_hour[k], x[:, k - 1],
-                                                  logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
-                                                  r2, kempt, kd, ka2, ke,
-                                                  p2, SI_B, SI_L, SI_D, VI, VG, Ipb, SG, Gb,
-                                                  f, kabs_B, kabs_L, kabs_D, kabs_S, kabs_H, alpha,
-                                                  previous_Ra[k], 0, 0, 0)
+        model_step_equations_multi_meal(bolus_delayed[k] + basal_delayed[k],
+                                        meal_B_delayed[k], meal_L_delayed[k], meal_D_delayed[k],
+                                        meal_S_delayed[k], meal_H[k], t_hour[k], x[:, k - 1], x[:, k],
+                                        logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
+                                        r2, kempt, kd, ka2, ke,
+                                        p2, SI_B, SI_L, SI_D, VI, VG, Ipb, SG, Gb,
+                                        f, kabs_B, kabs_L, kabs_D, kabs_S, kabs_H, alpha,
+                                        previous_Ra[k], 0, 0, 0)
 
     return x
 
-@njit(fastmath=True, cache=True)
+@njit(fastmath=True, cache=True, nogil=True)
 def twin_multi_meal_extended(tsteps, x,
                     bolus_delayed, basal_delayed,
                     meal_B_delayed, meal_L_delayed, meal_D_delayed, meal_S_delayed, meal_H,
@@ -61,9 +61,9 @@ def twin_multi_meal_extended(tsteps, x,
     # Run simulation
     for k in np.arange(1, tsteps):
         # Integration step
-        x[:, k] = model_step_equations_multi_meal_extended(bolus_delayed[k] + basal_delayed[k],
+        model_step_equations_multi_meal_extended(bolus_delayed[k] + basal_delayed[k],
                                                   meal_B_delayed[k], meal_L_delayed[k], meal_D_delayed[k],
-                                                  meal_S_delayed[k], meal_H[k], meal_B2_delayed[k], meal_L2_delayed[k], meal_S2_delayed[k], t_hour[k], k > split_point, x[:, k - 1],
+                                                  meal_S_delayed[k], meal_H[k], meal_B2_delayed[k], meal_L2_delayed[k], meal_S2_delayed[k], t_hour[k], k > split_point, x[:, k - 1], x[:, k],
                                                   logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
                                                   r2, kempt, kd, ka2, ke,
                                                   p2, SI_B, SI_L, SI_D, SI_B2, VI, VG, Ipb, SG, Gb,
@@ -72,15 +72,15 @@ def twin_multi_meal_extended(tsteps, x,
 
     return x
 
-@njit(fastmath=True, cache=True)
-def model_step_equations_single_meal(I, cho, hour_of_the_day, xkm1,
+@njit(fastmath=True, cache=True, nogil=True)
+def model_step_equations_single_meal(I, cho, hour_of_the_day, xkm1, xk,
                                      logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
                                      r2, kempt, kd, ka2, ke, p2, SI, VI, VG, Ipb, SG, Gb,
                                      f, kabs, alpha, previous_Ra, custom_forcing_Ra, forcing_ip, forcing_ra):
     """
-    Internal function that simulates a step of the single-meal model using backward-euler method.
+    Internal function that simulates a step of the single-meal model using backward-euler method. The new state is
+    written in place into xk, which can also be xkm1 itself.
     """
-    xk = xkm1.copy()
 
     # Compute glucose risk
     g_prev = xkm1[0]
@@ -108,18 +108,16 @@ def model_step_equations_single_meal(I, cho, hour_of_the_day, xkm1,
     xk[0] = (xkm1[0] + SG * Gb + f * (kabs * xk[4] + previous_Ra + custom_forcing_Ra + forcing_ra) / VG) / (1 + SG + risk * xk[1])
     xk[8] = (alpha * xkm1[8] + xk[0]) / (1 + alpha)
 
-    return xk
 
-
-@njit(fastmath=True, cache=True)
-def model_step_equations_multi_meal(I, cho_b, cho_l, cho_d, cho_s, cho_h, hour_of_the_day, xkm1,
+@njit(fastmath=True, cache=True, nogil=True)
+def model_step_equations_multi_meal(I, cho_b, cho_l, cho_d, cho_s, cho_h, hour_of_the_day, xkm1, xk,
                                     logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
                                     r2, kempt, kd, ka2, ke, p2, SI_B, SI_L, SI_D, VI, VG, Ipb, SG, Gb,
                                     f, kabs_B, kabs_L, kabs_D, kabs_S, kabs_H, alpha, previous_Ra, custom_forcing_Ra, forcing_ip, forcing_ra):
     """
-    Internal function that simulates a step of the multi-meal model using backward-euler method.
+    Internal function that simulates a step of the multi-meal model using backward-euler method. The new state is
+    written in place into xk, which can also be xkm1 itself.
     """
-    xk = xkm1.copy()
 
     # Set the insulin sensitivity based on the time of the day
     if hour_of_the_day < 4 or hour_of_the_day >= 17:
@@ -174,17 +172,15 @@ def model_step_equations_multi_meal(I, cho_b, cho_l, cho_d, cho_s, cho_h, hour_o
         16] + previous_Ra + custom_forcing_Ra + forcing_ra) / VG) / (1 + SG + risk * xk[1])
     xk[20] = (alpha * xkm1[20] + xk[0]) / (1 + alpha)
 
-    return xk
-
-@njit(fastmath=True, cache=True)
-def model_step_equations_multi_meal_extended(I, cho_b, cho_l, cho_d, cho_s, cho_h, cho_b2, cho_l2, cho_s2, hour_of_the_day, is_second_day, xkm1,
+@njit(fastmath=True, cache=True, nogil=True)
+def model_step_equations_multi_meal_extended(I, cho_b, cho_l, cho_d, cho_s, cho_h, cho_b2, cho_l2, cho_s2, hour_of_the_day, is_second_day, xkm1, xk,
                                     logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
                                     r2, kempt, kd, ka2, ke, p2, SI_B, SI_L, SI_D, SI_B2, VI, VG, Ipb, SG, Gb,
                                     f, kabs_B, kabs_L, kabs_D, kabs_S, kabs_H, kabs_B2, kabs_L2, kabs_S2, alpha, previous_Ra, custom_forcing_Ra, forcing_ip, forcing_ra):
     """
-    Internal function that simulates a step of the multi-meal model using backward-euler method.
+    Internal function that simulates a step of the multi-meal extended model using backward-euler method. The new state
+    is written in place into xk, which can also be xkm1 itself.
     """
-    xk = xkm1.copy()
 
     # SI by day-part
     if (hour_of_the_day < 4.0) or (hour_of_the_day >= 17.0):
@@ -251,5 +247,3 @@ def model_step_equations_multi_meal_extended(I, cho_b, cho_l, cho_d, cho_s, cho_
             kabs_B * xk[4] + kabs_L * xk[7] + kabs_D * xk[10] + kabs_S * xk[13] + kabs_H * xk[
         16] + kabs_B2 * xk[19] + kabs_L2 * xk[22] + kabs_S2 * xk[25] + previous_Ra + custom_forcing_Ra + forcing_ra) / VG) / (1 + SG + risk * xk[1])
     xk[29] = (alpha * xkm1[29] + xk[0]) / (1 + alpha)
-
-    return xk
\ No newline at end of file
@@ -0,0 +1,186 @@
+import numpy as np
+
+from numba import njit
+
+from py_replay_bg.model.exponential_integrator_t1d import si_index
+
+# Forward-sensitivity engine of the T1D models, used by the compiled twinning functions to compute the gradient of the
+# log posterior.
+#
+# The 1-minute backward-euler step of the models is explicit equation by equation (each state only depends on the
+# previous state and on the states already updated in the same step), so it can be differentiated exactly, equation by
+# equation, with respect to the model parameters. The sensitivities are propagated block-wise, keeping only the
+# nonzero ones: each gut chain only depends on kempt and on its own kabs, the insulin subsystem only depends on kd and
+# ka2, while X, G, and IG depend on all the parameters.
+#
+# Sensitivities are computed with respect to the following columns:
+#   Gb, SG, p2, ka2, kd, kempt, SI (one per insulin sensitivity value), kabs (one per gut chain).
+# The meal delays (beta) and the insulin delay (tau) are integer shifts, so their gradient is zero.
+
+# Positions of the sensitivity columns of the core parameters
+S_GB, S_SG, S_P2, S_KA2, S_KD, S_KEMPT = 0, 1, 2, 3, 4, 5
+N_CORE = 6
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def integrate_sensitivity(x,
+                          meals, meal_delays, meal_kabs,
+                          bolus, basal, tau, u2ss,
+                          t_hour, split_point, si_mode, si_values,
+                          previous_Ra,
+                          Gb, SG, p2, kd, ka2, ke, kempt, VI, VG, f, alpha, r1, r2, Ipb,
+                          tsteps, yts, glucose, glucose_idxs):
+    """
+    Internal function that simulates a T1D model with the 1-minute backward-euler method together with the forward
+    sensitivities of its state, keeping only the current state x (modified in place). The state layout is the one of
+    the models, i.e., G, X, one gut chain per meal type, Isc1, Isc2, Ip, IG. Returns the sum of squared residuals
+    against the glucose data at the observation times (i.e., glucose_idxs * yts) and its gradient with respect to the
+    sensitivity columns (see the module description).
+    """
+    nx = x.shape[0]
+    n_chains = meal_kabs.shape[0]
+    n_si = si_values.shape[0]
+    n_q = N_CORE + n_si + n_chains
+    n_obs = glucose_idxs.shape[0]
+
+    logGb_r2 = np.log(Gb) ** r2
+    log60_r2 = np.log(60.0) ** r2
+    risk_coeff = 10.0 * r1
+    dlogGb_r2 = r2 * np.log(Gb) ** (r2 - 1.0) / Gb
+
+    k1 = 1.0 / (1.0 + kempt)
+    dk1 = - k1 * k1
+    kd_fac = 1.0 / (1.0 + kd)
+    ka2_fac = 1.0 / (1.0 + ka2)
+    ke_fac = 1.0 / (1.0 + ke)
+    p2_fac = 1.0 / (1.0 + p2)
+    alpha_fac = 1.0 / (1.0 + alpha)
+
+    # Sensitivities of the gut chains with respect to kempt, and of Qgut with respect to its own kabs
+    dQ = np.zeros((n_chains, 3))
+    dQgut_kabs = np.zeros(n_chains)
+
+    # Sensitivities of the insulin subsystem with respect to kd and ka2 (the initial state depends on them, while Ipb
+    # does not)
+    di1_kd = - x[nx - 4] / kd
+    di2_kd = 0.0
+    di2_ka2 = - x[nx - 3] / ka2
+    dip_kd = 0.0
+    dip_ka2 = 0.0
+
+    # Sensitivities of X, G, and IG
+    dX = np.zeros(n_q)
+    dG = np.zeros(n_q)
+    dIG = np.zeros(n_q)
+    dnum = np.zeros(n_q)
+    dden = np.zeros(n_q)
+
+    sse = 0.0
+    dsse = np.zeros(n_q)
+    j = 0
+    if j < n_obs and glucose_idxs[j] == 0:
+        e = x[nx - 1] - glucose[glucose_idxs[j]]
+        sse += e * e
+        j += 1
+
+    # Simulate until the last observation
+    k_end = glucose_idxs[n_obs - 1] * yts + 1 if n_obs > 0 else 0
+
+    for k in range(1, min(tsteps, k_end)):
+
+        # Compute the glucose risk and its sensitivity with respect to G and Gb
+        g = x[0]
+        risk = 1.0
+        drisk_g = 0.0
+        drisk_gb = 0.0
+        if g < Gb:
+            if g >= 60.0:
+                lg = np.log(g)
+                diff = lg ** r2 - logGb_r2
+                drisk_g = 2.0 * risk_coeff * diff * r2 * lg ** (r2 - 1.0) / g
+            else:
+                diff = log60_r2 - logGb_r2
+            risk = 1.0 + risk_coeff * diff * diff
+            drisk_gb = - 2.0 * risk_coeff * diff * dlogGb_r2
+
+        # Gut chains
+        ra = 0.0
+        dra_kempt = 0.0
+        for c in range(n_chains):
+            base = 2 + 3 * c
+            d = meal_delays[c]
+            u = meals[c][k - d] if k >= d else 0.0
+            k3 = 1.0 / (1.0 + meal_kabs[c])
+
+            q0 = (x[base] + u) * k1
+            dQ[c, 0] = dQ[c, 0] * k1 + (x[base] + u) * dk1
+            q1 = (x[base + 1] + kempt * q0) * k1
+            dQ[c, 1] = (dQ[c, 1] + q0 + kempt * dQ[c, 0]) * k1 + (x[base + 1] + kempt * q0) * dk1
+            q2 = (x[base + 2] + kempt * q1) * k3
+            dQ[c, 2] = (dQ[c, 2] + q1 + kempt * dQ[c, 1]) * k3
+            dQgut_kabs[c] = (dQgut_kabs[c] - q2) * k3
+
+            x[base] = q0
+            x[base + 1] = q1
+            x[base + 2] = q2
+            ra += meal_kabs[c] * q2
+            dra_kempt += meal_kabs[c] * dQ[c, 2]
+
+        # Insulin subsystem
+        I = (bolus[k - tau] if k >= tau else 0.0) + (basal[k - tau] if k >= tau else u2ss)
+        i1 = (x[nx - 4] + I) * kd_fac
+        di1_kd = (di1_kd - i1) * kd_fac
+        i2 = (x[nx - 3] + kd * i1) * ka2_fac
+        di2_kd = (di2_kd + i1 + kd * di1_kd) * ka2_fac
+        di2_ka2 = (di2_ka2 - i2) * ka2_fac
+        ip = (x[nx - 2] + ka2 * i2) * ke_fac
+        dip_kd = (dip_kd + ka2 * di2_kd) * ke_fac
+        dip_ka2 = (dip_ka2 + i2 + ka2 * di2_ka2) * ke_fac
+        x[nx - 4] = i1
+        x[nx - 3] = i2
+        x[nx - 2] = ip
+
+        # Insulin action
+        s = si_index(t_hour, k, split_point, si_mode)
+        SI = si_values[s]
+        gain = p2 * SI / VI
+        X = (x[1] + gain * (ip - Ipb)) * p2_fac
+        for q in range(n_q):
+            dX[q] = dX[q] * p2_fac
+        dX[S_P2] += (SI / VI * (ip - Ipb) - X) * p2_fac
+        dX[N_CORE + s] += p2 / VI * (ip - Ipb) * p2_fac
+        dX[S_KD] += gain * dip_kd * p2_fac
+        dX[S_KA2] += gain * dip_ka2 * p2_fac
+        x[1] = X
+
+        # Glucose
+        num = g + SG * Gb + f * (ra + previous_Ra[k]) / VG
+        den = 1.0 + SG + risk * X
+        G = num / den
+        for q in range(n_q):
+            dnum[q] = dG[q]
+            dden[q] = drisk_g * dG[q] * X + risk * dX[q]
+        dnum[S_GB] += SG
+        dnum[S_SG] += Gb
+        dnum[S_KEMPT] += f * dra_kempt / VG
+        for c in range(n_chains):
+            dnum[N_CORE + n_si + c] += f * (x[2 + 3 * c + 2] + meal_kabs[c] * dQgut_kabs[c]) / VG
+        dden[S_SG] += 1.0
+        dden[S_GB] += drisk_gb * X
+        for q in range(n_q):
+            dG[q] = (dnum[q] - G * dden[q]) / den
+        x[0] = G
+
+        # Interstitial glucose
+        x[nx - 1] = (alpha * x[nx - 1] + G) * alpha_fac
+        for q in range(n_q):
+            dIG[q] = (alpha * dIG[q] + dG[q]) * alpha_fac
+
+        if j < n_obs and k == glucose_idxs[j] * yts:
+            e = x[nx - 1] - glucose[glucose_idxs[j]]
+            sse += e * e
+            for q in range(n_q):
+                dsse[q] += 2.0 * e * dIG[q]
+            j += 1
+
+    return sse, dsse
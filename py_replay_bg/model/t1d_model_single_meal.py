@@ -1,6 +1,6 @@
 # This fixes circular imports for type checking
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable, Dict
 
 if TYPE_CHECKING:
     from py_replay_bg.replay.custom_ra import CustomRaBase
@@ -22,12 +22,20 @@ from py_replay_bg.model.logpriors_t1d import log_prior_single_meal
 
 from py_replay_bg.model.model_step_equations_t1d import twin_single_meal
 from py_replay_bg.model.model_step_equations_t1d import model_step_equations_single_meal
+from py_replay_bg.model.ensemble_simulation_t1d import SINGLE_MEAL_PARAMETERS, pack_parameters, pack_ensemble, \
+    simulate_ensemble_single_meal, log_posterior_ensemble_single_meal, log_posterior_single_meal, \
+    neg_log_posterior_single_meal, log_posterior_gradient_single_meal, neg_log_posterior_gradient_single_meal, \
+    replay_coefficients, delay_batch, replay_step_single_meal, replay_closed_loop_single_meal
 
 from py_replay_bg.data import ReplayBGData
 
 from py_replay_bg.environment import Environment
 from py_replay_bg.sensors import Sensors
 from py_replay_bg.dss import DSS
+from py_replay_bg.dss.batch_dss import BatchDSS
+from py_replay_bg.dss.handler_context import HandlerContext
+from py_replay_bg.dss.handler_scheduler import HandlerScheduler
+from py_replay_bg.dss.compiled_handlers import compiled_controls
 
 
 class T1DModelSingleMeal:
@@ -39,6 +47,9 @@ class T1DModelSingleMeal:
     ----------
     ts: int
         The integration time step (min).
+    integration_step: int
+        The integration step (min) used by the compiled twinning functions (i.e., the compiled log posterior and the
+        ensemble simulation). If greater than 1, the exponential integrator is used.
     yts: int
         The measurement (cgm) sample time.
     t: int
@@ -81,10 +92,21 @@ class T1DModelSingleMeal:
     simulate(rbg_data, modality, environment, dss, sensors)
         Function that simulates the model and returns the obtained results. This is the complete version suitable for
         replay.
+    simulate_ensemble(thetas, rbg_data)
+        Function that simulates the model for many realizations of the unknown parameters at once.
+    simulate_batch(draws, rbg_data, environment, dss, custom_forcing_Ra)
+        Function that replays the scenario for many realizations of the model parameters at once, in lockstep.
     neg_log_posterior(theta, rbg_data):
         Function that computes the negative log posterior of unknown parameters.
     log_posterior(theta, rbg_data):
         Function that computes the log posterior of unknown parameters.
+    log_posterior_ensemble(thetas, rbg_data, lp_min):
+        Function that computes the log posterior of many realizations of the unknown parameters at once.
+    log_posterior_gradient(theta, rbg_data):
+        Function that computes the log posterior of unknown parameters and its gradient.
+    compiled_log_posterior(rbg_data, negative, gradient):
+        Function that returns the nopython log posterior of unknown parameters (optionally, with its gradient) and its
+        preprocessed arguments.
     check_realization(theta):
         Function that checks if a realization is valid or not depending on the prior constraints.
     check_realization_exercise(theta):
@@ -99,7 +121,8 @@ class T1DModelSingleMeal:
                  previous_data_name: str | None = None,
                  environment: Environment | None = None,
                  twinning_method: str = 'mcmc',
-                 is_twin: bool = False
+                 is_twin: bool = False,
+                 integration_step: int = 1
                  ):
         """
         Constructs all the necessary attributes for the Model object.
@@ -123,11 +146,15 @@ class T1DModelSingleMeal:
             The method to used to twin the model.
         is_twin: bool, optional, default: False
             Whether or not the model is being created during twinning.
+        integration_step: int, optional, default : 1
+            The integration step (min) used by the compiled twinning functions. If greater than 1, the exponential
+            integrator is used. It must divide the measurement sample time (yts).
         """
 
         # Time constants during simulation
         # self.ts = ts # DEPRECATED -> IT WILL BE ALWAYS = 1
         self.ts = 1
+        self.integration_step = integration_step  # Integration step of the compiled twinning functions
         self.yts = environment.yts  # Measurement sampling time
         self.t = int((data.t.iloc[-1] - data.t.iloc[0]).total_seconds() / 60 + self.yts)
         self.tsteps = self.t  # / self.ts
@@ -231,7 +258,8 @@ class T1DModelSingleMeal:
                  environment: Environment | None,
                  dss: DSS | None,
                  sensors: Sensors = None,
-                 custom_forcing_Ra: CustomRaBase | None = None
+                 custom_forcing_Ra: CustomRaBase | None = None,
+                 open_loop: bool = False
                  ) -> np.ndarray | tuple[
         np.ndarray,
         np.ndarray,
@@ -264,6 +292,10 @@ class T1DModelSingleMeal:
             An object that represents the sensors used during simulation.
         custom_forcing_Ra: ForcingRaBase
             An object that represents the forcing Ra input to be used during simulation. Default is None.
+        open_loop: bool, optional, default : False
+            Whether the replay is open-loop, i.e., all the inputs come from data and no DSS handler, forcing input or
+            custom Ra has to be computed at each step. If so, the whole scenario is simulated in a single compiled
+            call and the CGM trace is measured at once.
 
         Returns
         -------
@@ -371,27 +403,27 @@ class T1DModelSingleMeal:
         # Set the initial glucose value
         self.G[0] = self.x[self.nx - 1, 0]
 
-        # Run simulation in two ways depending on the modality to speed up the twinning process
-        if is_replay:
+        # Run simulation in two ways depending on the modality to speed up the twinning process. Open-loop replays
+        # run the compiled simulation too
+        if is_replay and not open_loop:
 
-            # Set the initial cgm value if modality is 'replay' and make copies of meal vectors
-            self.CGM[0] = sensors.cgm.measure(self.x[self.nx - 1, 0], t=0, past_ig=self.x[self.nx - 1, :0])
+            # The histories seen by the handlers, converted to their units one step at a time
+            context = HandlerContext(glucose=self.G, meal=meal, meal_type=meal_type,
+                                     meal_announcement=meal_announcement, hypotreatments=hypotreatments,
+                                     bolus=bolus, basal=basal, time=rbg_data.t_hour,
+                                     forcing_ip=forcing_ip, forcing_ra=forcing_ra,
+                                     to_g=mp.to_g, blueprint=environment.blueprint)
+
+            # The steps at which each handler is called
+            scheduler = HandlerScheduler(dss.handler_cadence, self.yts)
 
             for k in np.arange(1, self.tsteps):
+                context.advance(k - 1)
+
                 # Meal generation module
                 if rbg_data.cho_source == 'generated':
                     # Call the meal generator function handler
-                    ch, ma, t, dss = dss.meal_generator_handler(self.G[0:k],
-                                                                meal[0:k] * mp.to_g,
-                                                                meal_type[0:k],
-                                                                meal_announcement[0:k],
-                                                                hypotreatments[0:k],
-                                                                bolus[0:k] * mp.to_g,
-                                                                basal[0:k] * mp.to_g,
-                                                                rbg_data.t_hour[0:k],
-                                                                k - 1,
-                                                                dss,
-                                                                environment.blueprint)
+                    ch, ma, t, dss = scheduler.call('meal_generator_handler', context, dss)
                     ch_mgkg = ch * mp.to_mgkg
                     # Add the CHO to the input (remember to add the delay)
                     if t == 'M':
@@ -410,14 +442,7 @@ class T1DModelSingleMeal:
                 # Bolus generation module
                 if rbg_data.bolus_source == 'dss':
                     # Call the bolus calculator function handler
-                    bo, dss = dss.bolus_calculator_handler(self.G[0:k],
-                                                           meal_announcement[0:k],
-                                                           meal_type[0:k], hypotreatments[0:k],
-                                                           bolus[0:k] * mp.to_g,
-                                                           basal[0:k] * mp.to_g,
-                                                           rbg_data.t_hour[0:k],
-                                                           k - 1,
-                                                           dss)
+                    bo, dss = scheduler.call('bolus_calculator_handler', context, dss)
                     bo_mgkg = bo * mp.to_mgkg
 
                     # Add the bolus to the input bolus vector.
@@ -430,15 +455,7 @@ class T1DModelSingleMeal:
                 # Basal rate generation module
                 if rbg_data.basal_source == 'dss':
                     # Call the basal rate function handler
-                    ba, dss = dss.basal_handler(self.G[0:k],
-                                                meal_announcement[0:k],
-                                                meal_type[0:k],
-                                                hypotreatments[0:k],
-                                                bolus[0:k] * mp.to_g,
-                                                basal[0:k] * mp.to_g,
-                                                rbg_data.t_hour[0:k],
-                                                k - 1,
-                                                dss)
+                    ba, dss = scheduler.call('basal_handler', context, dss)
                     ba_mgkg = ba * mp.to_mgkg
                     # Add the basal to the input basal vector.
                     if (k + mp.tau.__trunc__()) < self.tsteps:
@@ -451,15 +468,7 @@ class T1DModelSingleMeal:
                 # Hypotreatment generation module
                 if dss.enable_hypotreatments:
                     # Call the hypotreatment handler
-                    ht, dss = dss.hypotreatments_handler(self.G[0:k],
-                                                         meal_announcement[0:k],
-                                                         meal_type[0:k],
-                                                         hypotreatments[0:k],
-                                                         bolus[0:k] * mp.to_g,
-                                                         basal[0:k] * mp.to_g,
-                                                         rbg_data.t_hour[0:k],
-                                                         k - 1,
-                                                         dss)
+                    ht, dss = scheduler.call('hypotreatments_handler', context, dss)
                     ht_mgkg = ht * mp.to_mgkg
                     meal_delayed[k] = meal_delayed[k] + ht_mgkg
 
@@ -469,15 +478,7 @@ class T1DModelSingleMeal:
                 # Correction bolus delivery module if it is enabled
                 if dss.enable_correction_boluses:
                     # Call the correction boluses handler
-                    cb, dss = dss.correction_boluses_handler(self.G[0:k],
-                                                             meal_announcement[0:k],
-                                                             meal_type[0:k],
-                                                             hypotreatments[0:k],
-                                                             bolus[0:k] * mp.to_g,
-                                                             basal[0:k] * mp.to_g,
-                                                             rbg_data.t_hour[0:k],
-                                                             k - 1,
-                                                             dss)
+                    cb, dss = scheduler.call('correction_boluses_handler', context, dss)
                     cb_mgkg = cb * mp.to_mgkg
                     # Add the cb to the input bolus vector.
                     if (k + mp.tau.__trunc__()) < self.tsteps:
@@ -492,31 +493,13 @@ class T1DModelSingleMeal:
 
                 if dss.enable_forcing_ip:
                     # Call the forcing ra handler
-                    fi, dss = dss.forcing_ip_handler(self.G[0:k],
-                                                         meal_announcement[0:k],
-                                                         meal_type[0:k],
-                                                         hypotreatments[0:k],
-                                                         bolus[0:k] * mp.to_g,
-                                                         basal[0:k] * mp.to_g,
-                                                         rbg_data.t_hour[0:k],
-                                                         forcing_ip[0:k],
-                                                         k - 1,
-                                                         dss)
+                    fi, dss = scheduler.call('forcing_ip_handler', context, dss, 'forcing_ip')
                     fi_mgkg = fi * mp.to_mgkg # to mU/kg
                     forcing_ip[k] = forcing_ip[k] + fi_mgkg
 
                 if dss.enable_forcing_ra:
                     # Call the forcing ra handler
-                    fa, dss = dss.forcing_ra_handler(self.G[0:k],
-                                                         meal_announcement[0:k],
-                                                         meal_type[0:k],
-                                                         hypotreatments[0:k],
-                                                         bolus[0:k] * mp.to_g,
-                                                         basal[0:k] * mp.to_g,
-                                                         rbg_data.t_hour[0:k],
-                                                         forcing_ra[0:k],
-                                                         k - 1,
-                                                         dss)
+                    fa, dss = scheduler.call('forcing_ra_handler', context, dss, 'forcing_ra')
                     forcing_ra[k] = forcing_ra[k] + fa # Unit is already ok
 
 
@@ -526,41 +509,33 @@ class T1DModelSingleMeal:
                     current_forcing_Ra = 0
 
                 # Integration step
-                self.x[:, k] = model_step_equations_single_meal(bolus_delayed[k] + basal_delayed[k],
-                                                                meal_delayed[k],
-                                                                rbg_data.t_hour[k],
-                                                                self.x[:, k - 1],
-                                                                logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
-                                                                mp.r2,
-                                                                mp.kempt,
-                                                                mp.kd,
-                                                                mp.ka2,
-                                                                mp.ke,
-                                                                mp.p2,
-                                                                mp.SI,
-                                                                mp.VI,
-                                                                mp.VG,
-                                                                mp.Ipb,
-                                                                mp.SG,
-                                                                mp.Gb,
-                                                                mp.f,
-                                                                mp.kabs,
-                                                                mp.alpha,
-                                                                self.previous_Ra[k], current_forcing_Ra, forcing_ip[k],
-                                                                forcing_ra[k])
+                model_step_equations_single_meal(bolus_delayed[k] + basal_delayed[k],
+                                                 meal_delayed[k],
+                                                 rbg_data.t_hour[k],
+                                                 self.x[:, k - 1], self.x[:, k],
+                                                 logGb_r2, log60_r2, risk_coeff, k1, k2, kd_fac,
+                                                 mp.r2,
+                                                 mp.kempt,
+                                                 mp.kd,
+                                                 mp.ka2,
+                                                 mp.ke,
+                                                 mp.p2,
+                                                 mp.SI,
+                                                 mp.VI,
+                                                 mp.VG,
+                                                 mp.Ipb,
+                                                 mp.SG,
+                                                 mp.Gb,
+                                                 mp.f,
+                                                 mp.kabs,
+                                                 mp.alpha,
+                                                 self.previous_Ra[k], current_forcing_Ra, forcing_ip[k],
+                                                 forcing_ra[k])
 
                 self.G[k] = self.x[self.nx - 1, k]
 
-                # Get the cgm
-                if np.mod(k, sensors.cgm.ts) == 0:
-                    if np.mod(k + sensors.cgm.t_offset, sensors.cgm.max_lifetime) == 0:
-                        # connect new sensor
-                        sensors.cgm.connect_new_cgm(connected_at=k)
-                        # manage offset
-                    self.CGM[int(k / sensors.cgm.ts)] = sensors.cgm.measure(self.x[self.nx - 1, k],
-                                                                            t=(k - sensors.cgm.connected_at) / (
-                                                                                        24 * 60),
-                                                                            past_ig=self.x[self.nx - 1, :k], )
+            # The handlers get the interstitial glucose, so the whole CGM trace can be measured at once
+            self.CGM[:] = sensors.cgm.measure_trajectory(self.x[self.nx - 1, :])
 
             if custom_forcing_Ra is not None:
                 meal = np.array([m + f for m, f in zip(meal, custom_forcing_Ra.get_events())])
@@ -608,9 +583,357 @@ class T1DModelSingleMeal:
                 self.previous_Ra
             )
 
+            if is_replay:
+                # Open-loop replay: measure the whole CGM trace at once
+                self.G[:] = self.x[self.nx - 1, :]
+                self.CGM[:] = sensors.cgm.measure_trajectory(self.x[self.nx - 1, :])
+
+                return (self.x[0, :].copy(),
+                        self.x[:, -1].copy(),
+                        self.CGM.copy(),
+                        bolus * mp.to_g,
+                        correction_bolus,
+                        basal * mp.to_g,
+                        meal * mp.to_g,
+                        hypotreatments,
+                        meal_announcement,
+                        forcing_ip * mp.to_g,
+                        forcing_ra,
+                        self.x.copy())
+
             # Return just the glucose vector if modality == 'twinning'
             return self.x[self.nx - 1, :]
 
+    def simulate_ensemble(self,
+                          thetas: np.ndarray,
+                          rbg_data: ReplayBGData
+                          ) -> np.ndarray:
+        """
+        Function that simulates the model for many realizations of the unknown parameters at once, in a single
+        compiled call parallelized across the available cores. Optimized for twinning only.
+
+        Parameters
+        ----------
+        thetas : np.ndarray
+            A (n, n_dim) matrix containing, in each row, a realization of the unknown model parameters (ordered as
+            `unknown_parameters`).
+        rbg_data : ReplayBGData
+            The data to be used by ReplayBG during simulation.
+
+        Returns
+        -------
+        G: np.ndarray
+            A (n, tsteps) matrix containing the simulated interstitial glucose concentration (mg/dl) of each
+            realization.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        P = pack_ensemble(self.model_parameters, SINGLE_MEAL_PARAMETERS, self.unknown_parameters, thetas)
+        x0, ins_scale = self.__initial_state_template()
+
+        return simulate_ensemble_single_meal(P, x0, ins_scale,
+                                             rbg_data.bolus, rbg_data.basal, rbg_data.meal, rbg_data.t_hour,
+                                             self.previous_Ra, self.tsteps, self.integration_step)
+
+    def simulate_batch(self,
+                       draws: Dict,
+                       rbg_data: ReplayBGData,
+                       environment: Environment,
+                       dss: DSS,
+                       custom_forcing_Ra: CustomRaBase | None = None,
+                       compiled: bool = False,
+                       random_states: list | None = None
+                       ) -> tuple[
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray
+    ]:
+        """
+        Function that replays the scenario for many realizations of the model parameters at once, advancing all of
+        them in lockstep, i.e., simulating each step of all the realizations in a single compiled call and calling
+        each DSS handler once per step for the whole batch (see `BatchDSS`). Optimized for replay only.
+
+        Parameters
+        ----------
+        draws : dict
+            A dictionary that contains, for each model parameter to set, an array with its value in each realization.
+            The other model parameters are set to their current value.
+        rbg_data : ReplayBGData
+            The data to be used by ReplayBG during simulation.
+        environment: Environment
+            An object that represents the hyperparameters to be used by ReplayBG.
+        dss: DSS
+            An object that represents the hyperparameters of the dss.
+        custom_forcing_Ra: ForcingRaBase
+            An object that represents the forcing Ra input to be used during simulation. It is called once per
+            step for all the realizations. Default is None.
+        compiled: bool, optional, default : False
+            Whether to replay the closed loop in a single compiled call. Requires that all the enabled DSS
+            handlers are compiled (see `py_replay_bg.dss.compiled_handlers.can_compile`).
+        random_states: list, optional, default : None
+            The states of the global numpy random generator (see `np.random.get_state`) the scalar DSS handlers of each
+            realization draw from (see `BatchDSS`). If None, they draw from the global numpy random state.
+
+        Returns
+        -------
+        G: np.ndarray
+            A (n, tsteps) matrix containing the simulated glucose concentration of each realization (mg/dl).
+        IG: np.ndarray
+            A (n, tsteps) matrix containing the simulated interstitial glucose concentration of each realization
+            (mg/dl).
+        x_end: np.ndarray
+            A (n, nx) matrix containing the final state of each realization.
+        bolus: np.ndarray
+            A (n, tsteps) matrix containing the simulated insulin bolus events (U/min). Also includes the correction
+            insulin boluses.
+        correction_bolus: np.ndarray
+            A (n, tsteps) matrix containing the simulated corrective insulin bolus events (U/min).
+        basal: np.ndarray
+            A (n, tsteps) matrix containing the simulated basal insulin events (U/min).
+        cho: np.ndarray
+            A (n, tsteps) matrix containing the simulated CHO events (g/min).
+        hypotreatments: np.ndarray
+            A (n, tsteps) matrix containing the simulated hypotreatments events (g/min).
+        meal_announcement: np.ndarray
+            A (n, tsteps) matrix containing the simulated meal announcements events needed for bolus calculation
+            (g/min).
+        forcing_ip: np.ndarray
+            A (n, tsteps) matrix containing the simulated forcing ip events.
+        forcing_ra: np.ndarray
+            A (n, tsteps) matrix containing the simulated forcing ra events.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        # Rename parameters for brevity
+        mp = self.model_parameters
+        layout = SINGLE_MEAL_PARAMETERS
+
+        # Pack the parameters of each realization and compute the constant model coefficients
+        n = np.asarray(next(iter(draws.values()))).shape[0]
+        P = np.tile(pack_parameters(mp, layout), (n, 1))
+        for p in draws:
+            if p in layout:
+                P[:, layout.index(p)] = draws[p]
+        C = replay_coefficients(P, layout)
+        rows = np.arange(n)
+
+        batch_dss = BatchDSS(dss, n, self.yts, random_states)
+
+        # Make copies of the inputs for each realization
+        bolus = np.tile(rbg_data.bolus, (n, 1))
+        basal = np.tile(rbg_data.basal, (n, 1))
+        meal = np.tile(rbg_data.meal, (n, 1))
+        meal_type = np.tile(rbg_data.meal_type, (n, 1))
+        meal_announcement = np.tile(rbg_data.meal_announcement, (n, 1))
+        correction_bolus = bolus * 0
+        hypotreatments = meal * 0
+
+        forcing_ip = bolus * 0
+        forcing_ra = hypotreatments * 0
+
+        # Shift the insulin and meal vectors according to the delays of each realization
+        tau = P[:, layout.index('tau')].astype(int)
+        bolus_delayed = delay_batch(rbg_data.bolus, tau)
+        basal_delayed = delay_batch(rbg_data.basal, tau, P[:, layout.index('u2ss')])
+        beta = P[:, layout.index('beta')].astype(int)
+        meal_delayed = delay_batch(rbg_data.meal, beta)
+
+        # Set the initial conditions
+        x0, ins_scale = self.__initial_state_template()
+        X = np.tile(x0, (n, 1))
+        ki1 = P[:, layout.index('u2ss')] / P[:, layout.index('kd')]
+        ki2 = P[:, layout.index('kd')] / P[:, layout.index('ka2')] * ki1
+        X[:, self.nx - 4] = ki1 * ins_scale[0]
+        X[:, self.nx - 3] = ki2 * ins_scale[1]
+        X[:, self.nx - 2] = C[:, 6] * ins_scale[2]
+
+        G = np.zeros((n, self.tsteps))
+        IG = np.zeros((n, self.tsteps))
+        G[:, 0] = X[:, 0]
+        IG[:, 0] = X[:, self.nx - 1]
+
+        # The histories seen by the handlers, converted to their units one step at a time
+        context = HandlerContext(glucose=IG, meal=meal, meal_type=meal_type,
+                                 meal_announcement=meal_announcement, hypotreatments=hypotreatments,
+                                 bolus=bolus, basal=basal, time=rbg_data.t_hour,
+                                 forcing_ip=forcing_ip, forcing_ra=forcing_ra,
+                                 to_g=mp.to_g, blueprint=environment.blueprint)
+
+        if compiled:
+            # Replay the whole closed loop in nopython mode (each realization gets its own handler states)
+            bolus_g = np.zeros(bolus.shape)
+            basal_g = np.zeros(basal.shape)
+            replay_closed_loop_single_meal(X, P, C, G, IG,
+                                           bolus, basal, bolus_g, basal_g, correction_bolus, hypotreatments,
+                                           meal_announcement, bolus_delayed, basal_delayed, meal_delayed,
+                                           rbg_data.t_hour, self.previous_Ra,
+                                           forcing_ip, forcing_ra, tau, mp.to_g, mp.to_mgkg, self.nx,
+                                           *compiled_controls(dss, rbg_data, n, self.tsteps, self.yts))
+        else:
+            for k in range(1, self.tsteps):
+                context.advance(k - 1)
+
+                # Meal generation module
+                if rbg_data.cho_source == 'generated':
+                    # Call the meal generator function handler
+                    ch, ma, t = batch_dss.meal_generator_handler(context)
+                    ch_mgkg = ch * mp.to_mgkg
+                    # Add the CHO to the input (remember to add the delay)
+                    to_add = (t == 'M') & (k + beta < self.tsteps)
+                    meal_delayed[rows[to_add], k + beta[to_add]] += ch_mgkg[to_add]
+                    meal_delayed[:, k] = meal_delayed[:, k] + np.where(t == 'O', ch_mgkg, 0)
+
+                    # Update the event vectors
+                    meal_announcement[:, k] = meal_announcement[:, k] + ma
+                    meal_type[:, k] = t
+
+                    # Add the CHO to the non-delayed meal vector.
+                    meal[:, k] = meal[:, k] + ch_mgkg
+
+                # Bolus generation module
+                if rbg_data.bolus_source == 'dss':
+                    # Call the bolus calculator function handler
+                    bo = batch_dss.bolus_calculator_handler(context)
+                    bo_mgkg = bo * mp.to_mgkg
+
+                    # Add the bolus to the input bolus vector.
+                    to_add = k + tau < self.tsteps
+                    bolus_delayed[rows[to_add], k + tau[to_add]] += bo_mgkg[to_add]
+
+                    # Add the bolus to the non-delayed bolus vector.
+                    bolus[:, k] = bolus[:, k] + bo_mgkg
+
+                # Basal rate generation module
+                if rbg_data.basal_source == 'dss':
+                    # Call the basal rate function handler
+                    ba = batch_dss.basal_handler(context)
+                    ba_mgkg = ba * mp.to_mgkg
+
+                    # Add the basal to the input basal vector.
+                    to_add = k + tau < self.tsteps
+                    basal_delayed[rows[to_add], k + tau[to_add]] += ba_mgkg[to_add]
+
+                    # Add the basal to the non-delayed basal vector.
+                    basal[:, k] = basal[:, k] + ba_mgkg
+
+                # Hypotreatment generation module
+                if dss.enable_hypotreatments:
+                    # Call the hypotreatment handler
+                    ht = batch_dss.hypotreatments_handler(context)
+                    meal_delayed[:, k] = meal_delayed[:, k] + ht * mp.to_mgkg
+
+                    # Update the hypotreatments event vectors
+                    hypotreatments[:, k] = hypotreatments[:, k] + ht
+
+                # Correction bolus delivery module if it is enabled
+                if dss.enable_correction_boluses:
+                    # Call the correction boluses handler
+                    cb = batch_dss.correction_boluses_handler(context)
+                    cb_mgkg = cb * mp.to_mgkg
+
+                    # Add the cb to the input bolus vector.
+                    to_add = k + tau < self.tsteps
+                    bolus_delayed[rows[to_add], k + tau[to_add]] += cb_mgkg[to_add]
+
+                    # Add the bolus to the non-delayed bolus vector.
+                    bolus[:, k] = bolus[:, k] + cb_mgkg
+
+                    # Update the correction_bolus event vectors
+                    correction_bolus[:, k] = correction_bolus[:, k] + cb
+
+                if dss.enable_forcing_ip:
+                    # Call the forcing ip handler
+                    fi = batch_dss.forcing_ip_handler(context)
+                    forcing_ip[:, k] = forcing_ip[:, k] + fi * mp.to_mgkg  # to mU/kg
+
+                if dss.enable_forcing_ra:
+                    # Call the forcing ra handler
+                    fa = batch_dss.forcing_ra_handler(context)
+                    forcing_ra[:, k] = forcing_ra[:, k] + fa  # Unit is already ok
+
+                if custom_forcing_Ra is not None:
+                    current_forcing_Ra = custom_forcing_Ra.simulate_forcing_ra(rbg_data.t_hour[0:k], k)
+                else:
+                    current_forcing_Ra = 0
+
+                # Integration step of all the realizations
+                replay_step_single_meal(k, X, P, C,
+                                        bolus_delayed, basal_delayed, meal_delayed, rbg_data.t_hour, self.previous_Ra,
+                                        current_forcing_Ra, forcing_ip, forcing_ra)
+
+                G[:, k] = X[:, 0]
+                IG[:, k] = X[:, self.nx - 1]
+
+        # Add the list of events that generated the forcing Ra to the meal vector for logging purposes
+        if custom_forcing_Ra is not None:
+            meal = np.array([[m + f for m, f in zip(meal_r, custom_forcing_Ra.get_events())] for meal_r in meal])
+
+        return (G,
+                IG,
+                X,
+                bolus * mp.to_g,
+                correction_bolus,
+                basal * mp.to_g,
+                meal * mp.to_g,
+                hypotreatments,
+                meal_announcement,
+                forcing_ip * mp.to_g,
+                forcing_ra)
+
+    def __initial_state_template(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Internal function that returns the initial model state and the scaling factors to apply to the steady state
+        of the insulin compartments (i.e., ki1, ki2, Ipb) of a given parameter realization.
+        """
+        mp = self.model_parameters
+
+        if self.x0 is None:
+            x0 = np.array([mp.G0, mp.Xpb, 0, 0, mp.Qgutb, 0, 0, 0, mp.G0], dtype=float)
+            return x0, np.ones(3)
+
+        # Compute the ki1, ki2, and Ipb, macro parameters, using the model parameters of the previous portion of data
+        # (i.e., the one that "generated" the provided x0)
+        if self.twinning_method == 'mcmc':
+            kd_old = self.previous_day_draws['kd']['samples_1'][0]
+            ka2_old = self.previous_day_draws['ka2']['samples_1'][0]
+        else:
+            kd_old = self.previous_day_draws['kd']
+            ka2_old = self.previous_day_draws['ka2']
+        ki1_old = mp.u2ss / kd_old
+        ki2_old = kd_old / ka2_old * ki1_old
+        Ipb_old = ka2_old / mp.ke * ki2_old
+
+        x0 = np.array(self.x0, dtype=float)
+        return x0, x0[5:8] / np.array([ki1_old, ki2_old, Ipb_old])
+
     def __log_likelihood(
             self,
             theta: np.ndarray,
@@ -737,6 +1060,149 @@ class T1DModelSingleMeal:
         p = log_prior_single_meal(self.model_parameters.VG, theta)
         return -np.inf if p == -np.inf else p + self.__log_likelihood(theta, rbg_data)
 
+    def log_posterior_ensemble(
+            self,
+            thetas: np.ndarray,
+            rbg_data: ReplayBGData,
+            lp_min: np.ndarray | None = None
+    ) -> np.ndarray:
+        """
+        Function that computes the log posterior of many realizations of the unknown parameters at once, in a single
+        compiled call parallelized across the available cores. Suitable for the `vectorize` mode of emcee. If lp_min is
+        given, the simulation of each guess is stopped as soon as its log posterior is known to be lower than the
+        corresponding lp_min (i.e., it will be rejected), and -inf is returned for it.
+
+        Parameters
+        ----------
+        thetas: np.ndarray
+            A (n, n_dim) matrix containing, in each row, a guess of the unknown model parameters.
+        rbg_data : ReplayBGData
+            The data to be used by ReplayBG during simulation.
+        lp_min : np.ndarray, optional, default : None
+            The log posterior values below which each guess is of no interest. If None, the log posterior of all the
+            guesses is computed.
+
+        Returns
+        -------
+        log_posterior_ensemble: np.ndarray
+            An array containing the value of the log posterior of each guess.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        P = pack_ensemble(self.model_parameters, SINGLE_MEAL_PARAMETERS, self.unknown_parameters, thetas)
+        lp_min = np.full(P.shape[0], -np.inf) if lp_min is None else np.asarray(lp_min, dtype=float)
+        return log_posterior_ensemble_single_meal(P, *self.__compiled_inputs(rbg_data), lp_min)
+
+    def log_posterior_gradient(
+            self,
+            theta: np.ndarray,
+            rbg_data: ReplayBGData
+    ) -> tuple[float, np.ndarray]:
+        """
+        Function that computes the log posterior of unknown parameters and its gradient with respect to them, by
+        propagating the forward sensitivities of the model state (see `sensitivity_t1d`). The model is integrated with
+        the 1-minute backward-euler method. The gradient with respect to the meal delays (beta) is zero.
+
+        Parameters
+        ----------
+        theta : np.ndarray
+            The current guess of unknown model parameters.
+        rbg_data : ReplayBGData
+            The data to be used by ReplayBG during simulation.
+
+        Returns
+        -------
+        log_posterior: float
+            The value of the log posterior of current unknown model parameters guess.
+        gradient: np.ndarray
+            The gradient of the log posterior with respect to the unknown model parameters (meaningful only if the log
+            posterior is finite).
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        func, args = self.compiled_log_posterior(rbg_data, gradient=True)
+        return func(np.asarray(theta, dtype=float), *args)
+
+    def compiled_log_posterior(
+            self,
+            rbg_data: ReplayBGData,
+            negative: bool = False,
+            gradient: bool = False
+    ) -> tuple[Callable, tuple]:
+        """
+        Function that returns the nopython log posterior of unknown parameters, together with the preprocessed
+        arguments to pass to it after the current guess, i.e., `func(theta, *args)`. Suitable to be used directly by
+        the twinners (also across processes).
+
+        Parameters
+        ----------
+        rbg_data : ReplayBGData
+            The data to be used by ReplayBG during simulation.
+        negative : bool, optional, default : False
+            Whether to return the negative log posterior (i.e., the function to minimize) instead.
+        gradient : bool, optional, default : False
+            Whether `func` must also return the gradient of the (negative) log posterior with respect to the unknown
+            parameters, computed via forward sensitivities (see `sensitivity_t1d`). In this case, the model is always
+            integrated with the 1-minute backward-euler method.
+
+        Returns
+        -------
+        func: Callable
+            The nopython (negative) log posterior function. If `gradient`, it returns a (value, gradient) tuple.
+        args: tuple
+            The preprocessed arguments of `func`.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        p0 = pack_parameters(self.model_parameters, SINGLE_MEAL_PARAMETERS)
+        theta_pos = np.array([SINGLE_MEAL_PARAMETERS.index(p) for p in self.unknown_parameters], dtype=np.int64)
+        if gradient:
+            func = neg_log_posterior_gradient_single_meal if negative else log_posterior_gradient_single_meal
+        else:
+            func = neg_log_posterior_single_meal if negative else log_posterior_single_meal
+        return func, (p0, theta_pos) + self.__compiled_inputs(rbg_data)
+
+    def __compiled_inputs(self, rbg_data: ReplayBGData) -> tuple:
+        """
+        Internal function that returns the preprocessed inputs shared by the compiled log posterior functions.
+        """
+        x0, ins_scale = self.__initial_state_template()
+        return (x0, ins_scale,
+                rbg_data.bolus, rbg_data.basal, rbg_data.meal, rbg_data.t_hour, self.previous_Ra,
+                int(self.tsteps), int(self.integration_step), int(self.yts),
+                np.asarray(rbg_data.glucose, dtype=float), np.asarray(rbg_data.glucose_idxs, dtype=np.int64),
+                float(self.model_parameters.SDn))
+
     def check_realization(
             self,
             theta: np.ndarray
@@ -1,3 +1,5 @@
+import copy
+import time
 from typing import Callable, Dict
 
 import numpy as np
@@ -17,12 +19,15 @@ from py_replay_bg.sensors.Vettoretti19CGM import Vettoretti19CGM
 
 from py_replay_bg.twinning.mcmc import MCMC
 from py_replay_bg.twinning.map import MAP
+from py_replay_bg.twinning.worker_pool import WorkerPool
 from py_replay_bg.replay import Replayer, CustomRaBase
 from py_replay_bg.visualizer import Visualizer
+from py_replay_bg.analyzer import Analyzer
 
 from py_replay_bg.input_validation.input_validator_init import InputValidatorInit
 from py_replay_bg.input_validation.input_validator_twin import InputValidatorTwin
 from py_replay_bg.input_validation.input_validator_replay import InputValidatorReplay
+from py_replay_bg.input_validation import ScenariosValidator
 
 import os
 
@@ -38,6 +43,9 @@ class ReplayBG:
     ----------
     environment: Environment
         An object that represents the hyperparameters to be used by ReplayBG.
+    worker_pool: WorkerPool
+        The persistent pool of worker processes used by the parallelized twinning procedures and replays (started at
+        the first one, and reused by the following ones). None until started.
 
     Methods
     -------
@@ -50,10 +58,15 @@ class ReplayBG:
         basal_handler_start, enable_hypotreatments, hypotreatments_handler, hypotreatments_handler_params,
         enable_correction_boluses, correction_boluses_handler, correction_boluses_handler_params,
         enable_forcing_ip, forcing_ip_handler, forcing_ip_handler_params,
-        enable_forcing_ra, forcing_ra_handler, forcing_ra_handler_params,
+        enable_forcing_ra, forcing_ra_handler, forcing_ra_handler_params, handler_cadence,
         save_suffix, save_workspace, n_replay, sensors, sensor_cgm, snack_absorption, snack_absorption_delay,
-        hypotreatment_absorption, custom_ra)
+        hypotreatment_absorption, custom_ra, batched, parallelize, n_processes)
         Runs ReplayBG according to the chosen modality.
+    compare_scenarios(data, bw, save_name, scenarios, reference, **kwargs)
+        Replays several scenarios against the same twin with common random numbers, and analyzes their paired
+        differences.
+    close()
+        Terminates the persistent pool of worker processes (if any).
     """
 
     def __init__(self, save_folder: str, blueprint: str = 'single_meal',
@@ -77,7 +90,8 @@ class ReplayBG:
         exercise: boolean, optional, default : False
             A boolean that specifies whether to simulate exercise or not.
         seed: int, optional, default: 1
-            An integer that specifies the random seed. For reproducibility.
+            An integer that specifies the random seed. For reproducibility. It is the root of the tree of independent
+            random streams used by twinning and replay (see `Environment.random_stream`).
 
         plot_mode : boolean, optional, default : True
             A boolean that specifies whether to show the plot of the results or not.
@@ -123,12 +137,18 @@ class ReplayBG:
                                        seed=seed,
                                        plot_mode=plot_mode, verbose=verbose)
 
+        # The persistent pool of worker processes (started by the first parallelized twinning procedure or replay)
+        self.worker_pool = None
+
     def twin(self, data: pd.DataFrame, bw: float, save_name: str,
              twinning_method: str = 'mcmc',
              extended: bool = False, find_start_guess_first: bool = False,
              n_steps: int = 50000, n_walkers: int = 50, save_chains: bool = False,
              u2ss: float | None = None, x0: np.ndarray | None = None, previous_data_name: str | None = None,
-             parallelize: bool = False, n_processes: int | None = None,
+             parallelize: bool = False, n_processes: int | None = None, vectorize: bool = False,
+             early_rejection: bool = False, surrogate: bool = False, integration_step: int = 1,
+             time_budget: float | None = None, early_stopping: bool = False, tau_factor: float = 50,
+             shared_memory: bool = False, parallel_backend: str = 'process',
              ) -> None:
         """
         Runs ReplayBG twinning procedure.
@@ -171,6 +191,48 @@ class ReplayBG:
             A boolean that specifies whether to parallelize the twinning process.
         n_processes : int, optional, default : None
             The number of processes to be spawn if `parallelize` is `True`. If None, the number of CPU cores is used.
+            The processes are kept alive and reused by the following twinning procedures until `close` is called.
+        vectorize : boolean, optional, default : False
+            A boolean that specifies whether to evaluate the log posterior of all the walkers at once in a single
+            compiled call, multi-threaded across walkers. If `True`, `parallelize` and `n_processes` are ignored. This
+            is ignored if `twinning_method` is `'map'`.
+        early_rejection : boolean, optional, default : False
+            A boolean that specifies whether to draw the Metropolis acceptance threshold of each proposal before
+            evaluating it, so that the simulation of the proposals that are going to be rejected is stopped as soon as
+            their residuals exceed it. The resulting chain is statistically the same. If `True`, the walkers are
+            evaluated as with `vectorize`. This is ignored if `twinning_method` is `'map'`.
+        surrogate : boolean, optional, default : False
+            A boolean that specifies whether to screen the proposals with a quadratic emulator of the log posterior
+            trained during burn-in, so that only the promising ones are simulated (two-stage delayed acceptance, i.e.,
+            the posterior is still exact). The fraction of screened proposals, the hit rate, and the estimated speedup
+            are reported. If `True`, the walkers are evaluated as with `vectorize`. This is ignored if
+            `twinning_method` is `'map'`.
+        integration_step : int, optional, default : 1
+            The integration step (min) used to simulate the model during twinning. If greater than 1, the model is
+            integrated with the exponential integrator, which is cheaper but slightly less accurate than the default
+            1-minute backward-euler method. It must divide `yts`.
+        time_budget : float, optional, default : None
+            The wall-clock time budget of the twinning procedure [s]. Once it is over, the twinning stops cleanly
+            keeping the best MAP solution or the MCMC chain accumulated so far, and the usual results are saved
+            together with their convergence metadata. If `find_start_guess_first` is `True`, at most half of it is
+            spent looking for the start guess. If None, the twinning is not time-bounded.
+        early_stopping : boolean, optional, default : False
+            A boolean that specifies whether to check the autocorrelation time of the production chain every 1000
+            steps, and stop it as soon as it is converged (i.e., its retained half is longer than `tau_factor` times
+            its autocorrelation time, and holds enough independent samples for the 1000 posterior draws). In this case,
+            `n_steps` is the maximum number of steps. This is ignored if `twinning_method` is `'map'`.
+        tau_factor : float, optional, default : 50
+            The multiple of the autocorrelation time the retained half of the production chain must be longer than to
+            be converged. This is ignored if `early_stopping` is `False`.
+        shared_memory : boolean, optional, default : False
+            A boolean that specifies whether to place the data arrays sent to the worker processes in shared memory,
+            so that the workers attach to them as read-only views instead of holding their own copies (i.e., memory
+            use does not grow with `n_processes`). This is ignored if `parallelize` is `False`.
+        parallel_backend : str, {'process', 'thread'}, optional, default : 'process'
+            A string that specifies whether to parallelize the twinning process across worker processes or, since the
+            compiled log posterior releases the GIL, across `n_processes` threads of the current process (no process
+            spawn, no data copies). If 'thread', `shared_memory` is ignored. This is ignored if `parallelize` is
+            `False`.
 
         Returns
         -------
@@ -201,8 +263,18 @@ class ReplayBG:
             previous_data_name=previous_data_name,
             parallelize=parallelize,
             n_processes=n_processes,
+            shared_memory=shared_memory,
+            parallel_backend=parallel_backend,
+            vectorize=vectorize,
+            early_rejection=early_rejection,
+            surrogate=surrogate,
+            integration_step=integration_step,
+            time_budget=time_budget,
+            early_stopping=early_stopping,
+            tau_factor=tau_factor,
             blueprint=self.environment.blueprint,
             exercise=self.environment.exercise,
+            yts=self.environment.yts,
             extended=extended,
             find_start_guess_first=find_start_guess_first,
         ).validate()
@@ -224,13 +296,14 @@ class ReplayBG:
                                        previous_data_name=previous_data_name,
                                        twinning_method=twinning_method,
                                        environment=self.environment,
-                                       is_twin=True)
+                                       is_twin=True, integration_step=integration_step)
         else:
             model = T1DModelMultiMeal(data=data, bw=bw, u2ss=u2ss, x0=x0,
                                       previous_data_name=previous_data_name,
                                       twinning_method=twinning_method,
                                       environment=self.environment,
-                                      is_twin=True, extended=extended)
+                                      is_twin=True, extended=extended,
+                                      integration_step=integration_step)
 
         # Unpack data to optimize performance during simulation
         rbg_data = ReplayBGData(data=data, model=model, environment=self.environment)
@@ -238,6 +311,9 @@ class ReplayBG:
         # Initialize start_guess
         start_guess = None
 
+        # Get the persistent pool of worker processes, (re)starting it if its size is not the requested one
+        worker_pool = self.__get_worker_pool(n_processes) if parallelize and parallel_backend == 'process' else None
+
         # Initialize twinner
         if twinning_method == 'mcmc':
             twinner = MCMC(n_steps=n_steps,
@@ -245,11 +321,24 @@ class ReplayBG:
                            callback_ncheck=1000,
                            parallelize=parallelize,
                            n_processes=n_processes,
+                           parallel_backend=parallel_backend,
+                           worker_pool=worker_pool,
+                           shared_memory=shared_memory,
+                           vectorize=vectorize,
+                           early_rejection=early_rejection,
+                           surrogate=surrogate,
+                           time_budget=time_budget,
+                           early_stopping=early_stopping,
+                           tau_factor=tau_factor,
                            )
         else:
             twinner = MAP(max_iter=100000,
                           parallelize=parallelize,
-                          n_processes=n_processes
+                          n_processes=n_processes,
+                          parallel_backend=parallel_backend,
+                          worker_pool=worker_pool,
+                          shared_memory=shared_memory,
+                          time_budget=time_budget,
                           )
 
         # Find the start guess if requested
@@ -260,8 +349,13 @@ class ReplayBG:
 
             start_guesser = MAP(max_iter=100000,
                                 parallelize=parallelize,
-                                n_processes=n_processes
+                                n_processes=n_processes,
+                                parallel_backend=parallel_backend,
+                                worker_pool=worker_pool,
+                                shared_memory=shared_memory,
+                                time_budget=None if time_budget is None else time_budget / 2,
                                 )
+            start_time = time.time()
 
             # Run twinning procedure for finding the start guess.
             start_guess = start_guesser.twin(rbg_data=rbg_data,
@@ -270,6 +364,10 @@ class ReplayBG:
                                              environment=self.environment,
                                              for_start_guess=True)
 
+            # Leave the rest of the time budget to the actual twinning
+            if time_budget is not None:
+                twinner.time_budget = time_budget - (time.time() - start_time)
+
             if self.environment.verbose:
                 print('Running actual twinning')
 
@@ -280,6 +378,47 @@ class ReplayBG:
                      environment=self.environment,
                      start_guess=start_guess)
 
+    def __get_worker_pool(self, n_processes: int | None) -> WorkerPool:
+        """
+        Internal function that returns the persistent pool of worker processes, (re)starting it if it is not running
+        yet or if its size is not the requested one.
+        """
+        n_processes = os.cpu_count() if n_processes is None else n_processes
+        if self.worker_pool is not None and self.worker_pool.n_processes != n_processes:
+            self.close()
+        if self.worker_pool is None:
+            self.worker_pool = WorkerPool(n_processes)
+        return self.worker_pool
+
+    def close(self) -> None:
+        """
+        Terminates the persistent pool of worker processes (if any). A new one is started by the next parallelized
+        twinning procedure or replay.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool = None
+
     def replay(self,
                data: pd.DataFrame,
                bw: float,
@@ -293,31 +432,37 @@ class ReplayBG:
                meal_generator_handler: Callable = default_meal_generator_handler,
                meal_generator_handler_params: Dict | None = None,
                bolus_calculator_handler: Callable = standard_bolus_calculator_handler,
-               bolus_calculator_handler_params: Dict | None = None,
+               bolus_calculator_handler_params: Dict | np.ndarray | None = None,
                basal_handler: Callable = default_basal_handler,
-               basal_handler_params: Dict | None = None,
+               basal_handler_params: Dict | np.ndarray | None = None,
                basal_handler_start: float | None = None,
                enable_hypotreatments: bool = False,
                hypotreatments_handler: Callable = ada_hypotreatments_handler,
-               hypotreatments_handler_params: Dict | None = None,
+               hypotreatments_handler_params: Dict | np.ndarray | None = None,
                enable_correction_boluses: bool = False,
                correction_boluses_handler: Callable = corrects_above_250_handler,
-               correction_boluses_handler_params: Dict | None = None,
+               correction_boluses_handler_params: Dict | np.ndarray | None = None,
                enable_forcing_ip: bool = False,
                forcing_ip_handler: Callable = no_ip_handler,
                forcing_ip_handler_params: Dict | None = None,
                enable_forcing_ra: bool = False,
                forcing_ra_handler: Callable = no_ra_handler,
                forcing_ra_handler_params: Dict | None = None,
+               handler_cadence: Dict | None = None,
                save_suffix: str = '',
                save_workspace: bool = False,
-               n_replay: int = 1000,
+               n_replay: int | str = 1000,
                sensors: list | None = None,
                sensor_cgm: CGM = Vettoretti19CGM,
                snack_absorption: float = None,
                snack_absorption_delay: int = None,
                hypotreatment_absorption: float = None,
                custom_ra: CustomRaBase = None,
+               batched: bool = False,
+               parallelize: bool = False,
+               n_processes: int | None = None,
+               percentile_tolerance: float = 2.0,
+               metric_tolerance: float = 1.0,
                ) -> Dict:
         """
         Runs ReplayBG according to the chosen modality.
@@ -358,30 +503,34 @@ class ReplayBG:
             A dictionary that contains the parameters to pass to the meal_generator_handler function.
         bolus_calculator_handler: Callable, optional, default : standard_bolus_calculator_handler
             A callback function that implements a bolus calculator to be used during the replay of a given scenario.
-        bolus_calculator_handler_params: dict, optional, default : None
+        bolus_calculator_handler_params: dict | np.ndarray, optional, default : None
             A dictionary that contains the parameters to pass to the bolusCalculatorHandler function. It also serves
             as memory area for the bolusCalculatorHandler function.
+            If the handler is compiled, it is a numpy array that holds its state (see `compiled_handlers`).
         basal_handler: Callable, optional, default : default_basal_handler
             A callback function that implements a basal controller to be used during the replay of a given scenario.
-        basal_handler_params: dict, optional, default : None
+        basal_handler_params: dict | np.ndarray, optional, default : None
             A dictionary that contains the parameters to pass to the basal_handler function. It also serves as memory
             area for the basal_handler function.
+            If the handler is compiled, it is a numpy array that holds its state (see `compiled_handlers`).
         basal_handler_start: float, optional, default : None
             The starting value of the basal handler at t=0 (U/min). Used only if basal_source is 'dss', otherwise ignored.
         enable_hypotreatments: boolean, optional, default : False
             A flag that specifies whether to enable hypotreatments during the replay of a given scenario.
         hypotreatments_handler: Callable, optional, default : ada_hypotreatments_handler
             A callback function that implements a hypotreatment strategy during the replay of a given scenario.
-        hypotreatments_handler_params: dict, optional, default : None
+        hypotreatments_handler_params: dict | np.ndarray, optional, default : None
             A dictionary that contains the parameters to pass to the hypotreatments_handler function. It also serves
             as memory area for the hypotreatments_handler function.
+            If the handler is compiled, it is a numpy array that holds its state (see `compiled_handlers`).
         enable_correction_boluses: boolean, optional, default : False
             A flag that specifies whether to enable correction boluses during the replay of a given scenario.
         correction_boluses_handler: Callable, optional, default : corrects_above_250_handler
             A callback function that implements a corrective bolus strategy during the replay of a given scenario.
-        correction_boluses_handler_params: dict, optional, default : None
+        correction_boluses_handler_params: dict | np.ndarray, optional, default : None
             A dictionary that contains the parameters to pass to the correction_boluses_handler function. It also serves
             as memory area for the correction_boluses_handler function.
+            If the handler is compiled, it is a numpy array that holds its state (see `compiled_handlers`).
         enable_forcing_ip: boolean, optional, default : False
             A flag that specifies whether to enable forcing ip during the replay of a given scenario.
         forcing_ip_handler: Callable, optional, default : no_ip_handler
@@ -396,16 +545,24 @@ class ReplayBG:
         forcing_ra_handler_params: dict, optional, default : None
             A dictionary that contains the parameters to pass to the forcing_ra_handler function. It also serves
             as memory area for the forcing_ra_handler function.
+        handler_cadence: dict, optional, default : None
+            A dictionary that specifies, for each handler name (e.g., 'basal_handler'), when to call it: either an
+            integer N (every N minutes, starting from t = 0), 'cgm' (at each new CGM sample), or 'meal_announcement'
+            (only when a meal is announced). Between two calls, the basal and forcing handlers keep their last output,
+            while the others output nothing. Handlers not in the dictionary are called every minute.
 
         save_suffix : string
             A string to be attached as suffix to the resulting output files' name.
         save_workspace: bool
             A flag that specifies whether to save the resulting workspace.
 
-        n_replay: int, {1, 10, 100, 1000}, optional, default: 1000
-            The number of Monte Carlo replays to be performed. Ignored if twinning_method is 'map'.
+        n_replay: int | str, {1, 10, 100, 1000, 'adaptive'}, optional, default: 1000
+            The number of Monte Carlo replays to be performed. Ignored if twinning_method is 'map'. If 'adaptive', the
+            realizations are replayed in batches (the 10, then the 100 realizations representing the percentiles of
+            the twin, then 100 more at a time, up to 1000) until the percentiles of the results change less than
+            `percentile_tolerance` and `metric_tolerance` from a batch to the next.
         sensors: list[Sensors], optional, default: None
-            The sensors to be used in each of the replay simulations.
+            The sensors to be used in each of the replay simulations. Cannot be provided if `n_replay` is 'adaptive'.
         sensor_cgm: CGM, optional, default: Vettoretti19CGM
             The class representing the sensors to be used in each of the replay simulations.
 
@@ -418,6 +575,30 @@ class ReplayBG:
 
         custom_ra: CustomRaBase, optional, default: None
             An object that implements the CustomRaBase interface to provide a custom glucose absorption rate input.
+        batched: bool, optional, default: False
+            Whether to replay closed-loop scenarios advancing all the realizations in lockstep, i.e., simulating each
+            step of all of them at once and calling each DSS handler once per step for the whole batch. Handlers
+            marked with `batched_handler` get the histories of all the realizations at once, and get the random draws of
+            the serial replay if they draw from `batch_random` (from `np.random`, they draw from a stream shared by the
+            batch, and their draws differ from those of the serial replay and depend on the batch size); the others
+            are called once per realization, each with its own copy of the dss and its own global numpy random state,
+            seeded as in the serial replay.
+        parallelize : boolean, optional, default : False
+            A boolean that specifies whether to split the realizations across worker processes. Each realization is
+            replayed with its own random streams (derived from the environment seed and its index, as in the serial
+            replay) and starts from its own copy of the DSS handler parameters, so that the results are the same
+            whatever the number of processes. If `True`, `batched` must be `False`, and the compiled handlers are
+            called from the Python replay loop (see `py_replay_bg.dss.compiled_handlers`).
+        n_processes : int, optional, default : None
+            The number of processes to be spawn if `parallelize` is `True`. If None, the number of CPU cores is used.
+        percentile_tolerance: float, optional, default: 2.0
+            The maximum root mean squared change over time (mg/dl) of the 5th, 25th, 50th, 75th, and 95th percentiles of
+            the glucose traces from a batch to the next for an adaptive replay to stop. Ignored if `n_replay` is not
+            'adaptive'.
+        metric_tolerance: float, optional, default: 1.0
+            The maximum change (%) of the 5th, 25th, 50th, 75th, and 95th percentiles of the time in ranges of the
+            realizations from a batch to the next for an adaptive replay to stop. Ignored if `n_replay` is not
+            'adaptive'.
 
         Returns
         -------
@@ -443,6 +624,10 @@ class ReplayBG:
                 A dictionary which contains the vo2 simulated via ReplayBG.
             sensors: dict
                 A dictionary which contains the sensors used during the replayed scenario.
+            convergence: dict
+                If `n_replay` is 'adaptive', a dictionary which contains the number of realizations replayed (n_replay),
+                whether the replay converged (converged), and the changes of the percentiles from a batch to the next
+                (percentile_change and metric_change).
             rbg_data: ReplayBGData
                 The data to be used by ReplayBG during simulation.
             model: T1DModelSingleMeal | T1DModelMultiMeal
@@ -490,6 +675,7 @@ class ReplayBG:
             enable_forcing_ra=enable_forcing_ra,
             forcing_ra_handler=forcing_ra_handler,
             forcing_ra_handler_params=forcing_ra_handler_params,
+            handler_cadence=handler_cadence,
             save_suffix=save_suffix,
             save_workspace=save_workspace,
             n_replay=n_replay,
@@ -500,6 +686,11 @@ class ReplayBG:
             snack_absorption_delay=snack_absorption_delay,
             hypotreatment_absorption=hypotreatment_absorption,
             custom_ra=custom_ra,
+            batched=batched,
+            parallelize=parallelize,
+            n_processes=n_processes,
+            percentile_tolerance=percentile_tolerance,
+            metric_tolerance=metric_tolerance,
         ).validate()
 
         if self.environment.verbose:
@@ -553,6 +744,7 @@ class ReplayBG:
                   enable_forcing_ra=enable_forcing_ra,
                   forcing_ra_handler=forcing_ra_handler,
                   forcing_ra_handler_params=forcing_ra_handler_params,
+                  handler_cadence=handler_cadence,
                   )
 
         # Unpack data to optimize performance
@@ -573,7 +765,13 @@ class ReplayBG:
             environment=self.environment,
             model=model,
             dss=dss,
-            twinning_method=twinning_method, sensor_cgm=sensor_cgm, forcing_glucose_input=custom_ra)
+            twinning_method=twinning_method, sensor_cgm=sensor_cgm, forcing_glucose_input=custom_ra,
+            batched=batched,
+            parallelize=parallelize,
+            n_processes=n_processes,
+            worker_pool=self.__get_worker_pool(n_processes) if parallelize else None,
+            percentile_tolerance=percentile_tolerance,
+            metric_tolerance=metric_tolerance)
         replay_results = replayer.replay_scenario()
 
         # Plot results if plot_mode is enabled
@@ -594,3 +792,104 @@ class ReplayBG:
                 pickle.dump(replay_results, file)
 
         return replay_results
+
+    def compare_scenarios(self,
+                          data: pd.DataFrame,
+                          bw: float,
+                          save_name: str,
+                          scenarios: Dict[str, Dict],
+                          reference: str | None = None,
+                          **kwargs,
+                          ) -> Dict:
+        """
+        Replays several scenarios (e.g., different DSS configurations) against the same twin with common random
+        numbers, and analyzes the differences of each scenario from the reference one, realization by realization.
+
+        Each scenario is replayed via `replay` with its own copy of the common replay parameters, updated with the
+        parameters of the scenario. The r-th realizations of all the scenarios share the model parameters, the CGM
+        sensor (i.e., its error parameters and noise), and the random stream of the DSS handlers, so that they differ
+        only because of the scenario. The paired differences then have a much smaller variance than the difference of
+        independent replays, and the scenarios can be told apart with fewer realizations. If `n_replay` is 'adaptive',
+        each scenario stops at its own number of realizations, and only the first ones, replayed by all the
+        scenarios, are paired.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            Pandas dataframe which contains the data to be used by the tool.
+        bw : float
+            The patient's body weight.
+        save_name : str
+            A string used to label, thus identify, each output file and result.
+        scenarios: dict
+            A dictionary of at least two scenarios, mapping the name of each scenario to a dictionary of the
+            parameters of `replay` that define it (e.g., {'cr_10': {'bolus_calculator_handler_params': {'cr': 10}}}).
+        reference: str, optional, default : None
+            The name of the scenario the others are compared against. If None, the first scenario is used.
+        kwargs
+            The parameters of `replay` common to all the scenarios (e.g., `twinning_method`, `n_replay`,
+            `bolus_source`). If `save_workspace` is True, the workspace of each scenario is saved with the name of the
+            scenario appended to `save_suffix`.
+
+        Returns
+        -------
+        comparison: dict
+            The comparison results with fields:
+            reference: str
+                The name of the reference scenario.
+            replay_results: dict
+                The results of `replay` for each scenario.
+            paired_differences: dict
+                The results of `Analyzer.analyze_paired_differences` for each scenario but the reference one.
+
+        Raises
+        ------
+        Exception
+            If scenarios or reference are not valid.
+
+        See Also
+        --------
+        Analyzer.analyze_paired_differences
+
+        Examples
+        --------
+        None
+        """
+        # Validate inputs (the replay parameters are validated by replay)
+        ScenariosValidator(scenarios=scenarios, reference=reference).validate()
+        if reference is None:
+            reference = next(iter(scenarios))
+
+        # Replay each scenario, starting from its own copy of the parameters (e.g., the handler parameters, which are
+        # also the memory of the handlers, and the sensors, which are updated by the replay)
+        replay_results = dict()
+        for name in scenarios:
+            if self.environment.verbose:
+                print('Replaying scenario ' + name)
+            replay_kwargs = copy.deepcopy({**kwargs, **scenarios[name]})
+            replay_kwargs['save_suffix'] = replay_kwargs.get('save_suffix', '') + '_' + name
+            replay_results[name] = self.replay(data=data, bw=bw, save_name=save_name, **replay_kwargs)
+
+        # Adaptive replays stop at their own number of realizations, but replay them in the same order: pair the
+        # realizations that all the scenarios replayed
+        paired_results = replay_results
+        if all('convergence' in results for results in replay_results.values()):
+            n = min(results['convergence']['n_replay'] for results in replay_results.values())
+            paired_results = {name: {field: {'realizations': value['realizations'][:n]}
+                                     for field, value in results.items()
+                                     if isinstance(value, dict) and 'realizations' in value}
+                              for name, results in replay_results.items()}
+
+        # Pair the realizations of each scenario with the ones of the reference scenario
+        paired_differences = dict()
+        for name in scenarios:
+            if name != reference:
+                paired_differences[name] = Analyzer.analyze_paired_differences(paired_results[name],
+                                                                               paired_results[reference])
+
+        comparison = dict()
+        comparison['reference'] = reference
+        comparison['replay_results'] = replay_results
+        comparison['paired_differences'] = paired_differences
+
+        return comparison
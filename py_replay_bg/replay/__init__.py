@@ -5,13 +5,16 @@ from typing import Dict
 
 from tqdm import tqdm
 
+from py_replay_bg.analyzer import Analyzer
 from py_replay_bg.data import ReplayBGData
-from py_replay_bg.environment import Environment
+from py_replay_bg.environment import Environment, REPLAY_REALIZATIONS, SENSOR_PARAMETERS, SENSORS, LOCKSTEP
 from py_replay_bg.model.t1d_model_single_meal import T1DModelSingleMeal
 from py_replay_bg.model.t1d_model_multi_meal import T1DModelMultiMeal
 from py_replay_bg.dss import DSS
+from py_replay_bg.dss.compiled_handlers import can_compile, seed_compiled_handlers
 from py_replay_bg.replay.custom_ra import CustomRaBase
 from py_replay_bg.sensors import CGM, Sensors
+from py_replay_bg.twinning.worker_pool import WorkerPool, evaluate
 
 
 class Replayer:
@@ -25,8 +28,12 @@ class Replayer:
         The data to be used by ReplayBG during simulation.
     draws: dict
         An array containing the model parameter realizations to be used for simulating the model.
-    n_replay: int, {1000, 100, 10}
+    n_replay: int | str, {1000, 100, 10, 'adaptive'}
         The number of replay to be performed.
+    percentile_tolerance: float
+        The tolerance on the change of the glucose percentiles used to stop an adaptive replay (mg/dl).
+    metric_tolerance: float
+        The tolerance on the change of the percentiles of the time in ranges used to stop an adaptive replay (%).
     sensors: list[Sensors] | None
         The sensors to be used in each of the replay simulations.
     environment: Environment
@@ -37,6 +44,14 @@ class Replayer:
         An object that represents the hyperparameters of the integrated decision support system.
     twinning_method: str, {'mcmc', 'map'}
         The twinning method used to estimate the parameters.
+    batched: bool
+        Whether to replay closed-loop scenarios advancing all the realizations in lockstep.
+    parallelize: bool
+        Whether to parallelize the replay across worker processes.
+    n_processes: int
+        Number of parallel processes to run.
+    worker_pool: WorkerPool
+        The persistent pool of worker processes to be used if `parallelize`.
 
     Methods
     -------
@@ -48,14 +63,20 @@ class Replayer:
                  rbg_data: ReplayBGData,
                  draws: Dict,
                  u2ss: float,
-                 n_replay: int,
+                 n_replay: int | str,
                  sensors: list[Sensors] | None,
                  sensor_cgm: CGM,
                  environment: Environment,
                  model: T1DModelSingleMeal | T1DModelMultiMeal,
                  dss: DSS,
                  twinning_method: str,
-                 forcing_glucose_input: CustomRaBase = None
+                 forcing_glucose_input: CustomRaBase = None,
+                 batched: bool = False,
+                 parallelize: bool = False,
+                 n_processes: int | None = None,
+                 worker_pool: WorkerPool | None = None,
+                 percentile_tolerance: float = 2.0,
+                 metric_tolerance: float = 1.0
                  ):
         """
         Constructs all the necessary attributes for the Replayer object.
@@ -68,8 +89,10 @@ class Replayer:
             An array containing the model parameter realizations to be used for simulating the model.
         u2ss: float
             The steady state of the basal insulin infusion.
-        n_replay: int, {1000, 100, 10}
-            The number of Monte Carlo replays to be performed. Ignored if twinning_method is 'map'.
+        n_replay: int | str, {1000, 100, 10, 'adaptive'}
+            The number of Monte Carlo replays to be performed. Ignored if twinning_method is 'map'. If 'adaptive', the
+            realizations are replayed in batches (of 10, 90, and then 100 realizations, up to 1000) until the
+            percentiles of the results stop changing (see `percentile_tolerance` and `metric_tolerance`).
         sensors: list[Sensors] | None
             The sensors to be used in each of the replay simulations.
         sensor_cgm: CGM
@@ -84,6 +107,28 @@ class Replayer:
             The twinning method used to estimate the parameters.
         forcing_glucose_input: ForcingRaBase, optional
             An object that represents the forcing glucose input to be used during the replay simulation.
+        batched: bool, optional, default : False
+            Whether to replay closed-loop scenarios advancing all the realizations in lockstep, calling each DSS
+            handler once per step for the whole batch (see `BatchDSS`). Closed-loop scenarios whose enabled handlers
+            are all compiled (see `py_replay_bg.dss.compiled_handlers`) are always replayed in lockstep, in nopython
+            mode (unless `parallelize`). Extended multi-meal twins cannot be replayed in lockstep: if the model is
+            extended, `batched` must be False, and the compiled handlers are called from the Python replay loop.
+        parallelize: bool, optional, default : False
+            Whether to split the realizations across worker processes. As in the serial replay, each realization is
+            replayed with its own copy of the dss, so that the results do not depend on the number of workers. If
+            True, `batched` is ignored, and the compiled handlers are called from the Python replay loop.
+        n_processes: int, optional, default : None
+            Number of parallel processes to run. If None, the number of CPU cores is used.
+        worker_pool: WorkerPool, optional, default : None
+            The persistent pool of worker processes to use if `parallelize` (`n_processes` is then ignored). If None, a
+            pool of `n_processes` workers is started (and terminated) at each replay.
+        percentile_tolerance: float, optional, default : 2.0
+            If `n_replay` is 'adaptive', the maximum root mean squared change over time (mg/dl) of the 5th, 25th, 50th,
+            75th, and 95th percentiles of the glucose traces from a batch to the next for the replay to stop.
+        metric_tolerance: float, optional, default : 1.0
+            If `n_replay` is 'adaptive', the maximum change (%) of the 5th, 25th, 50th, 75th, and 95th percentiles of
+            the time in ranges of the realizations (see `Analyzer.realization_metrics`) from a batch to the next for
+            the replay to stop.
 
         Returns
         -------
@@ -113,6 +158,17 @@ class Replayer:
         # The number of replays (if twinning_method is 'map', it will be ignored)
         self.n_replay = n_replay
 
+        # Adaptive replays go through the 1000 realizations in the order of their MCMC subsampling, i.e., the 10, then
+        # the 100 realizations representing the percentiles of the glucose traces come first
+        if self.n_replay == 'adaptive' and self.twinning_method == 'mcmc':
+            order = self.__adaptive_order(self.draws)
+            self.draws = {p: dict(self.draws[p], samples_adaptive=self.draws[p]['samples_1000'][order])
+                          for p in self.draws}
+
+        # The tolerances used to stop the adaptive replays
+        self.percentile_tolerance = percentile_tolerance
+        self.metric_tolerance = metric_tolerance
+
         # The list of Sensors objects
         self.sensors = sensors
         self.sensor_cgm = sensor_cgm
@@ -124,6 +180,14 @@ class Replayer:
 
         self.forcing_glucose_input = forcing_glucose_input
 
+        # Whether to replay the realizations in lockstep
+        self.batched = batched
+
+        # Whether to split the realizations across worker processes
+        self.parallelize = parallelize
+        self.n_processes = n_processes
+        self.worker_pool = worker_pool
+
     def replay_scenario(self) -> Dict:
         """
         Replays the given scenario.
@@ -156,6 +220,9 @@ class Replayer:
                 A dictionary which contains the vo2 simulated via ReplayBG.
             sensors: dict
                 A dictionary which contains the sensors used during the replayed scenario.
+            convergence: dict
+                If n_replay is 'adaptive', a dictionary which contains the number of realizations replayed, whether
+                the replay converged, and the changes of the percentiles from a batch to the next.
             rbg_data: ReplayBGData
                 The data to be used by ReplayBG during simulation.
             model: T1DModelSingleMeal | T1DModelMultiMeal
@@ -217,54 +284,211 @@ class Replayer:
 
         new_sensors = True if self.sensors is None else False
         if new_sensors:
-            self.sensors = []
+            # Connect a new CGM sensor per realization, sampling their error parameters at once. Each sensor draws from
+            # its own random stream of the tree rooted at environment.seed, so that the realizations measure the same
+            # CGM traces whether they are replayed serially, in lockstep, or in parallel.
+            parameter_bank = self.sensor_cgm.new_parameter_bank(n, self.environment.random_stream(SENSOR_PARAMETERS))
+            self.sensors = [self.__init_sensors(model=self.model, sensor_cgm=self.sensor_cgm,
+                                                parameter_bank=parameter_bank,
+                                                rng=self.environment.random_stream(SENSORS, r)) for r in range(n)]
 
         if not new_sensors:
             if self.twinning_method == 'map':
                 if not len(self.sensors) == 1:
                     raise Exception("The number of provided sensors must be the same as the number of replays.")
             else:
+                if self.n_replay == 'adaptive':
+                    raise Exception("The sensors cannot be provided to adaptive replays.")
                 if not len(self.sensors) == self.n_replay:
                     raise Exception("The number of provided sensors must be the same as the number of replays.")
 
-        if self.environment.verbose:
-            iterations = tqdm(range(n))
-        else:
-            iterations = range(0, n)
+        # Open-loop scenarios (i.e., all the inputs come from data) do not need to call any handler at each step, so that
+        # each realization can be simulated in a single compiled call
+        open_loop = self.__is_open_loop()
+
+        # Closed-loop scenarios can be replayed in lockstep (the extended model is always replayed one realization at
+        # a time)
+        extended = getattr(self.model, 'extended', False)
+        if self.batched and extended:
+            raise Exception("Extended multi-meal twins cannot be replayed in lockstep ('batched' must be False).")
+        batched = self.batched and not self.parallelize and not open_loop
+
+        # Closed-loop scenarios whose enabled handlers are all compiled are replayed in lockstep too, in a single
+        # compiled call (parallelized replays and extended twins call them from the Python loop instead)
+        compilable = not open_loop and can_compile(self.dss, self.rbg_data, self.forcing_glucose_input)
+        compiled = compilable and not self.parallelize and not extended
+        if compilable and not compiled and self.environment.verbose:
+            print('The compiled handlers are called from the Python replay loop (parallelized replays and extended '
+                  'twins are not replayed in nopython mode)')
+
+        # The DSS handlers draw from the global numpy random state: each realization reseeds it from its own random
+        # stream, and it is restored afterwards. In lockstep, the handlers of each realization still draw from its own
+        # stream (the batched handlers through batch_random, see BatchDSS), while the global numpy random state is
+        # seeded from the stream of the batch. Compiled handlers draw from the numba random generator, which is
+        # reseeded in the same way (from the stream of the batch, in nopython mode).
+        random_state = np.random.get_state()
+
+        # Adaptive replays run the realizations in batches, until the results converge (the others run them all at
+        # once)
+        batches = self.__adaptive_batches(n) if self.n_replay == 'adaptive' else [(0, n)]
+        convergence = None
+        if self.n_replay == 'adaptive':
+            convergence = dict()
+            convergence['n_replay'] = n
+            convergence['converged'] = False
+            convergence['percentile_change'] = []
+            convergence['metric_change'] = []
+        statistics = None
+
+        if self.parallelize:
+            # The workers get the scenario once, then just the model parameters and the sensors of each realization
+            pool = WorkerPool(self.n_processes) if self.worker_pool is None else self.worker_pool
+            pool.broadcast(_replay_realization, (self.model, self.rbg_data, self.environment, self.dss,
+                                                 self.u2ss, self.forcing_glucose_input, open_loop))
+
+        for start, stop in batches:
+
+            if self.parallelize:
+
+                tasks = []
+                for r in range(start, stop):
+                    if self.twinning_method == 'mcmc':
+                        parameters = {p: self.draws[p]['samples_' + str(self.n_replay)][r] for p in self.draws}
+                    else:
+                        parameters = dict(self.draws)
+                    tasks.append((r, parameters, self.sensors[r]))
+                realizations = pool.map(evaluate, tasks)
+
+                # Reassemble the realizations
+                for r, realization in zip(range(start, stop), realizations):
+                    (glucose['realizations'][r], x_end['realizations'][r], cgm['realizations'][r],
+                     insulin_bolus['realizations'][r], correction_bolus['realizations'][r],
+                     insulin_basal['realizations'][r], cho['realizations'][r], hypotreatments['realizations'][r],
+                     meal_announcement['realizations'][r], forcing_ip['realizations'][r],
+                     forcing_ra['realizations'][r], self.sensors[r]) = realization
+
+                # Leave the model as the serial replay does, i.e., with the parameters of the last realization
+                for p in tasks[-1][1]:
+                    setattr(self.model.model_parameters, p, tasks[-1][1][p])
+                self.model.model_parameters.kgri = self.model.model_parameters.kempt
+                self.model.model_parameters.u2ss = self.u2ss
 
-        for r in iterations:
+            elif batched or compiled:
 
-            if self.twinning_method == 'mcmc':
-                # set the model parameters
+                # set the model parameters of all the realizations
+                draws = dict()
                 for p in self.draws:
-                    setattr(self.model.model_parameters, p, self.draws[p]['samples_' + str(self.n_replay)][r])
-                self.model.model_parameters.kgri = self.model.model_parameters.kempt
+                    if self.twinning_method == 'mcmc':
+                        draws[p] = self.draws[p]['samples_' + str(self.n_replay)][start:stop]
+                    else:
+                        draws[p] = np.array([self.draws[p]])
+                self.model.model_parameters.u2ss = self.u2ss
+
+                # The random states of the scalar handlers of each realization, as in the serial replay
+                random_states = []
+                for r in range(start, stop):
+                    np.random.seed(self.environment.seed_sequence(REPLAY_REALIZATIONS, r).generate_state(4))
+                    random_states.append(np.random.get_state())
+
+                np.random.seed(self.environment.seed_sequence(LOCKSTEP, start).generate_state(4))
+                seed_compiled_handlers(self.environment.seed_sequence(LOCKSTEP, start))
+                (glucose['realizations'][start:stop], ig, x_end['realizations'][start:stop],
+                 insulin_bolus['realizations'][start:stop], correction_bolus['realizations'][start:stop],
+                 insulin_basal['realizations'][start:stop], cho['realizations'][start:stop],
+                 hypotreatments['realizations'][start:stop], meal_announcement['realizations'][start:stop],
+                 forcing_ip['realizations'][start:stop],
+                 forcing_ra['realizations'][start:stop]) = self.model.simulate_batch(
+                    draws=draws,
+                    rbg_data=self.rbg_data,
+                    environment=self.environment,
+                    dss=copy.deepcopy(self.dss),
+                    custom_forcing_Ra=self.forcing_glucose_input,
+                    compiled=compiled,
+                    random_states=random_states)
+
+                # The DSS handlers get the interstitial glucose, so the CGM traces can be measured afterwards, all at
+                # once
+                cgm['realizations'][start:stop] = self.sensor_cgm.measure_trajectories(
+                    [sensors.cgm for sensors in self.sensors[start:stop]], ig)
+
+                for r in range(start, stop):
+                    # Update the t_offset of the cgm sensors
+                    self.sensors[r].cgm.add_offset((self.model.t - self.sensors[r].cgm.connected_at) / (24 * 60))
+                    self.sensors[r].cgm.connected_at = 0
+
             else:
-                # set the model parameters
-                for p in self.draws:
-                    setattr(self.model.model_parameters, p, self.draws[p])
-                self.model.model_parameters.kgri = self.model.model_parameters.kempt
-            self.model.model_parameters.u2ss = self.u2ss
-
-            if new_sensors:
-                # connect a new set of sensors
-                sensors = self.__init_sensors(model=self.model, sensor_cgm=self.sensor_cgm)
-                sensors.cgm.connect_new_cgm()
-                self.sensors.append(sensors)
-
-            # TODO: add vo2
-            (glucose['realizations'][r], x_end['realizations'][r], cgm['realizations'][r],
-             insulin_bolus['realizations'][r], correction_bolus['realizations'][r],
-             insulin_basal['realizations'][r], cho['realizations'][r], hypotreatments['realizations'][r],
-             meal_announcement['realizations'][r], forcing_ip['realizations'][r], forcing_ra['realizations'][r], x) = self.model.simulate(rbg_data=self.rbg_data,
-                                                                            modality='replay',
-                                                                            environment=self.environment,
-                                                                            dss=self.dss,
-                                                                            sensors=self.sensors[r], custom_forcing_Ra= self.forcing_glucose_input)
-
-            # Update the t_offset of the cgm sensors
-            self.sensors[r].cgm.add_offset((self.model.t - self.sensors[r].cgm.connected_at) / (24 * 60))
-            self.sensors[r].cgm.connected_at = 0
+
+                if self.environment.verbose:
+                    iterations = tqdm(range(start, stop))
+                else:
+                    iterations = range(start, stop)
+
+                for r in iterations:
+
+                    if self.twinning_method == 'mcmc':
+                        # set the model parameters
+                        for p in self.draws:
+                            setattr(self.model.model_parameters, p,
+                                    self.draws[p]['samples_' + str(self.n_replay)][r])
+                        self.model.model_parameters.kgri = self.model.model_parameters.kempt
+                    else:
+                        # set the model parameters
+                        for p in self.draws:
+                            setattr(self.model.model_parameters, p, self.draws[p])
+                        self.model.model_parameters.kgri = self.model.model_parameters.kempt
+                    self.model.model_parameters.u2ss = self.u2ss
+
+                    np.random.seed(self.environment.seed_sequence(REPLAY_REALIZATIONS, r).generate_state(4))
+                    seed_compiled_handlers(self.environment.seed_sequence(REPLAY_REALIZATIONS, r))
+
+                    # Each realization starts from its own copy of the dss, as in the other replay modes, so that the
+                    # memory of the handlers is not carried over from a realization to the next one
+                    # TODO: add vo2
+                    (glucose['realizations'][r], x_end['realizations'][r], cgm['realizations'][r],
+                     insulin_bolus['realizations'][r], correction_bolus['realizations'][r],
+                     insulin_basal['realizations'][r], cho['realizations'][r], hypotreatments['realizations'][r],
+                     meal_announcement['realizations'][r], forcing_ip['realizations'][r],
+                     forcing_ra['realizations'][r], x) = self.model.simulate(rbg_data=self.rbg_data,
+                                                                             modality='replay',
+                                                                             environment=self.environment,
+                                                                             dss=copy.deepcopy(self.dss),
+                                                                             sensors=self.sensors[r],
+                                                                             custom_forcing_Ra=self.forcing_glucose_input,
+                                                                             open_loop=open_loop)
+
+                    # Update the t_offset of the cgm sensors
+                    self.sensors[r].cgm.add_offset((self.model.t - self.sensors[r].cgm.connected_at) / (24 * 60))
+                    self.sensors[r].cgm.connected_at = 0
+
+            # Stop an adaptive replay as soon as the percentiles of the glucose traces (their root mean squared change
+            # over time) and of the time in ranges change less than the tolerances from the previous batch
+            if self.n_replay == 'adaptive':
+                replayed = {'glucose': glucose, 'insulin_bolus': insulin_bolus, 'insulin_basal': insulin_basal,
+                            'correction_bolus': correction_bolus, 'cho': cho, 'hypotreatments': hypotreatments}
+                previous_statistics, statistics = statistics, self.__convergence_statistics(replayed, stop)
+                if previous_statistics is not None:
+                    convergence['percentile_change'].append(
+                        float(np.max(np.sqrt(np.mean((statistics[0] - previous_statistics[0]) ** 2, axis=1)))))
+                    convergence['metric_change'].append(float(np.max(np.abs(statistics[1] - previous_statistics[1]))))
+                    if (convergence['percentile_change'][-1] <= self.percentile_tolerance
+                            and convergence['metric_change'][-1] <= self.metric_tolerance):
+                        convergence['converged'] = True
+                convergence['n_replay'] = stop
+                if convergence['converged']:
+                    break
+
+        if self.parallelize and self.worker_pool is None:
+            pool.close()
+
+        np.random.set_state(random_state)
+
+        # Drop the realizations not replayed by an adaptive replay
+        if convergence is not None and convergence['n_replay'] < n:
+            n = convergence['n_replay']
+            for results in [cgm, glucose, x_end, insulin_bolus, correction_bolus, insulin_basal, cho, hypotreatments,
+                            meal_announcement, forcing_ip, forcing_ra, vo2]:
+                results['realizations'] = results['realizations'][:n]
+            self.sensors = self.sensors[:n]
 
         # Compute median CGM and glucose profiles + CI
         cgm['median'] = np.percentile(cgm['realizations'], 50, axis=0)
@@ -294,15 +518,169 @@ class Replayer:
         results['forcing_ra'] = forcing_ra
         results['vo2'] = vo2
         results['sensors'] = copy.copy(self.sensors)
+        if convergence is not None:
+            results['convergence'] = convergence
         results['rbg_data'] = copy.copy(self.rbg_data)
         results['model'] = copy.copy(self.model)
 
         return results
 
+    def __is_open_loop(self) -> bool:
+        """
+        Utility function that checks whether the scenario to replay is open-loop, i.e., the insulin and CHO inputs come
+        from data and no hypotreatment, correction bolus, forcing input, or custom Ra has to be generated during the
+        simulation.
+
+        Parameters
+        ----------
+        -
+
+        Returns
+        -------
+        open_loop: bool
+            Whether the scenario to replay is open-loop.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        return (self.rbg_data.bolus_source != 'dss' and self.rbg_data.basal_source != 'dss'
+                and self.rbg_data.cho_source != 'generated'
+                and not self.dss.enable_hypotreatments and not self.dss.enable_correction_boluses
+                and not self.dss.enable_forcing_ip and not self.dss.enable_forcing_ra
+                and self.forcing_glucose_input is None)
+
+    @staticmethod
+    def __adaptive_order(draws: Dict) -> np.ndarray:
+        """
+        Utility function that orders the 1000 realizations of the model parameters as subsampled by MCMC, i.e., the
+        10 realizations first, then the rest of the 100 realizations, then the others.
+
+        Parameters
+        ----------
+        draws: dict
+            A dictionary containing the samples obtained from the MCMC procedure.
+
+        Returns
+        -------
+        order: np.ndarray
+            The indices of the 1000 realizations, in order.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        samples = {n: np.column_stack([draws[p]['samples_' + str(n)] for p in draws]) for n in [10, 100, 1000]}
+
+        # The subsampled realizations are copies of some of the 1000 ones (possibly repeated)
+        indices = dict()
+        for r, theta in enumerate(samples[1000]):
+            indices.setdefault(theta.tobytes(), []).append(r)
+
+        order = []
+        taken = np.zeros(1000, dtype=bool)
+        for n in [10, 100]:
+            for theta in samples[n]:
+                for r in indices.get(theta.tobytes(), []):
+                    if not taken[r]:
+                        order.append(r)
+                        taken[r] = True
+                        break
+        order.extend(np.flatnonzero(~taken))
+
+        return np.array(order)
+
+    @staticmethod
+    def __adaptive_batches(n: int) -> list[tuple[int, int]]:
+        """
+        Utility function that splits the n realizations of an adaptive replay in batches of 10, 90, and then 100
+        realizations.
+
+        Parameters
+        ----------
+        n: int
+            The number of realizations.
+
+        Returns
+        -------
+        batches: list[tuple[int, int]]
+            The (start, stop) indices of each batch.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        checkpoints = [c for c in [10] + list(range(100, n, 100)) if c < n] + [n]
+        return list(zip([0] + checkpoints[:-1], checkpoints))
+
     @staticmethod
-    def __init_sensors(model, sensor_cgm) -> Sensors:
+    def __convergence_statistics(replayed: Dict, n: int) -> tuple[np.ndarray, np.ndarray]:
         """
-        Utility function that initializes the sensor core object.
+        Utility function that computes the statistics checked by adaptive replays, i.e., the 5th, 25th, 50th, 75th,
+        and 95th percentiles of the glucose traces and of the time in ranges of the first n realizations.
+
+        Parameters
+        ----------
+        replayed: dict
+            A dictionary containing the realizations replayed so far.
+        n: int
+            The number of realizations replayed so far.
+
+        Returns
+        -------
+        glucose_percentiles: np.ndarray
+            The percentiles of the glucose traces, at each time step.
+        metric_percentiles: np.ndarray
+            The percentiles of each time in range.
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        percentiles = [5, 25, 50, 75, 95]
+        metrics = Analyzer.realization_metrics({k: {'realizations': replayed[k]['realizations'][:n]}
+                                                for k in replayed})
+        glucose_percentiles = np.percentile(replayed['glucose']['realizations'][:n], percentiles, axis=0)
+        metric_percentiles = np.array([np.percentile(metrics[m], percentiles) for m in metrics
+                                       if m.startswith('time_in_')])
+        return glucose_percentiles, metric_percentiles
+
+    @staticmethod
+    def __init_sensors(model, sensor_cgm, parameter_bank=None, rng=None) -> Sensors:
+        """
+        Utility function that initializes the sensor core object, connecting a new CGM sensor.
 
         Parameters
         ----------
@@ -310,6 +688,11 @@ class Replayer:
             An object that represents the physiological model to be used by ReplayBG.
         sensor_cgm: CGM
             The class of the CGM error model to be used during the replay simulation.
+        parameter_bank: object, optional, default : None
+            The object the CGM sensor takes its error parameters from (see `CGM.new_parameter_bank`). If None, the
+            sensor samples them.
+        rng: np.random.Generator, optional, default : None
+            The random number generator the CGM sensor draws from. If None, the global numpy random state is used.
 
         Returns
         -------
@@ -328,8 +711,47 @@ class Replayer:
         --------
         None
         """
-        # Init the CGM sensor
+        # Init and connect the CGM sensor (only its first connection takes the parameters from the bank)
         cgm = sensor_cgm()
+        cgm.rng = rng
+        if parameter_bank is not None:
+            cgm.parameter_bank = parameter_bank
+        cgm.connect_new_cgm()
+        if parameter_bank is not None:
+            cgm.parameter_bank = None
 
         # return the object
         return Sensors(cgm=cgm)
+
+
+def _replay_realization(task: tuple, model, rbg_data, environment, dss, u2ss, custom_forcing_Ra,
+                        open_loop) -> tuple:
+    """
+    Replays a single realization in a worker process (see `Replayer.replay_scenario`). `task` is the tuple
+    (r, parameters, sensors) of the index of the realization, its model parameters, and its sensors. Returns the
+    simulated traces as `T1DModelSingleMeal.simulate` (but the final state), followed by the sensors.
+
+    Each realization draws from its own random stream of the tree rooted at `environment.seed` (as in the serial
+    replay), and starts from its own copy of the dss: its results do not depend on which worker replays it, nor on the
+    realizations replayed before.
+    """
+    r, parameters, sensors = task
+
+    np.random.seed(environment.seed_sequence(REPLAY_REALIZATIONS, r).generate_state(4))
+    seed_compiled_handlers(environment.seed_sequence(REPLAY_REALIZATIONS, r))
+    dss = copy.deepcopy(dss)
+
+    # set the model parameters
+    for p in parameters:
+        setattr(model.model_parameters, p, parameters[p])
+    model.model_parameters.kgri = model.model_parameters.kempt
+    model.model_parameters.u2ss = u2ss
+
+    results = model.simulate(rbg_data=rbg_data, modality='replay', environment=environment, dss=dss, sensors=sensors,
+                             custom_forcing_Ra=custom_forcing_Ra, open_loop=open_loop)
+
+    # Update the t_offset of the cgm sensors
+    sensors.cgm.add_offset((model.t - sensors.cgm.connected_at) / (24 * 60))
+    sensors.cgm.connected_at = 0
+
+    return *results[:-1], sensors
@@ -19,6 +19,8 @@ class CGM(ABC):
     connected_at: int
         The time (minutes) at which the CGM sensor is connected (utility variable to manage sensor lifetime through multiple
         ReplayBG calls).
+    rng: np.random.Generator
+        The random number generator the CGM sensor draws from. If None, the global numpy random state is used.
 
     Methods
     -------
@@ -26,24 +28,40 @@ class CGM(ABC):
         Connects a new CGM sensor by sampling new error parameters.
     measure(ig, t):
         Function that provides a CGM measure using the model of Vettoretti et al., Sensors, 2019.
+    measure_trajectory(ig):
+        Function that provides the CGM trace measured from a whole interstitial glucose trace.
+    measure_trajectories(cgms, ig):
+        Function that provides the CGM traces measured by many CGM sensors from as many interstitial glucose traces.
+    new_parameter_bank(n, rng):
+        Returns an object that hands out the error parameters of the next n connected sensors, if any.
     add_offset(to_add):
         Utility function that adds an offset to the sensor life. Used when the sensor object must be shared through
         multiple ReplayBG runs.
     """
 
     def __init__(self,
+                 connect: bool = True
                  ):
         """
         Constructs all the necessary attributes for the CGM object.
+
+        Parameters
+        ----------
+        connect: bool, optional, default : True
+            Whether to connect a new CGM sensor (see `connect_new_cgm`).
         """
 
         self.ts = 5
         self.t_offset = 0
 
-        self.connect_new_cgm()
+        # Draw from the global numpy random state, unless a random number generator is set
+        self.rng = None
 
         # Set max lifetime (minutes)
         self.max_lifetime = 1400 * 10
+
+        if connect:
+            self.connect_new_cgm()
         self.connected_at = 0
 
     def connect_new_cgm(self, connected_at=0):
@@ -112,6 +130,89 @@ class CGM(ABC):
         """
         pass
 
+    def measure_trajectory(self, ig: np.ndarray) -> np.ndarray:
+        """
+        Function that provides the CGM trace measured from a whole interstitial glucose trace, i.e., one measure every
+        `ts` minutes starting from t = 0, connecting a new CGM sensor whenever the current one reaches its maximum
+        lifetime. Equivalent to calling `measure` at each sample time as done by the replay simulation loop.
+        Subclasses can override it to measure the whole trace at once.
+
+        Parameters
+        ----------
+        ig: np.ndarray
+            The interstitial glucose concentration at each minute (mg/dl).
+
+        Returns
+        -------
+        cgm: np.ndarray
+            The CGM measurements, one every `ts` minutes (mg/dl).
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        ks = np.arange(0, ig.shape[0], self.ts)
+        cgm = np.zeros(shape=(ks.shape[0],))
+        for i, k in enumerate(ks):
+            if k > 0 and np.mod(k + self.t_offset, self.max_lifetime) == 0:
+                # connect new sensor
+                self.connect_new_cgm(connected_at=int(k))
+            cgm[i] = self.measure(ig[k], t=(k - self.connected_at) / (24 * 60), past_ig=ig[:k])
+        return cgm
+
+    @staticmethod
+    def measure_trajectories(cgms: list['CGM'], ig: np.ndarray) -> np.ndarray:
+        """
+        Function that provides the CGM traces measured by many CGM sensors (e.g., one per realization of a replay) from
+        as many interstitial glucose traces, i.e., the r-th row of the result is `cgms[r].measure_trajectory(ig[r])`.
+        Subclasses can override it to measure all the traces at once.
+
+        Parameters
+        ----------
+        cgms: list[CGM]
+            The CGM sensors, one per trace.
+        ig: np.ndarray
+            A (n, tsteps) matrix containing the interstitial glucose concentration of each trace at each minute
+            (mg/dl).
+
+        Returns
+        -------
+        cgm: np.ndarray
+            A (n, ceil(tsteps / ts)) matrix containing the CGM measurements of each trace, one every `ts` minutes
+            (mg/dl).
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        return np.array([cgm.measure_trajectory(ig_r) for cgm, ig_r in zip(cgms, ig)])
+
+    @staticmethod
+    def new_parameter_bank(n: int, rng: np.random.Generator | None = None):
+        """
+        Returns an object that hands out the error parameters of the next n connected sensors, sampled at once from
+        rng (or from the global numpy random state, if None), to be set as the `parameter_bank` of each sensor before
+        connecting it. By default, there is no such object (i.e., None is returned) and each sensor samples its own
+        parameters. Subclasses can override it.
+        """
+        return None
+
     def add_offset(self,
                    to_add: float) -> None:
         """
@@ -1,8 +1,59 @@
 import numpy as np
 
+from scipy.signal import lfilter
+
 from py_replay_bg.sensors.CGM import CGM
 
 
+# Mean vector and covariance matrix of the parameter vector of the error model as defined in Vettoretti et al.,
+# Sensors, 2019
+_MU = np.array([0.94228767821000314341972625697963, 0.0049398821141803427384187052950892,
+                -0.0005848748565491275084801681138913, 6.382602204050874306062723917421,
+                1.2604070417357611244568715846981, -0.4022228938823663169088717950217,
+                3.2516360856114072674927228945307])
+_SIGMA = np.array([[0.013245827952891258902368143424155, -0.0039513025350735725416129184850433,
+                    0.00031276743283791636970891936186945, 0.15717912467153988265167186000326,
+                    0.0026876560011614997885986966252858, -0.0028904633825263671524641306831427,
+                    -0.0031801707001874032418320403792222],
+                   [-0.0039513025350735725416129184850433, 0.0018527975980744701509778105119608,
+                    -0.00015580332205794781403294935184789, -0.10288007693621757654423021222101,
+                    -0.0013902327543057948350258001823931, 0.0011591852212130876378232136048041,
+                    -0.0027284927011686846420879248853453],
+                   [0.00031276743283791636970891936186945, -0.00015580332205794781403294935184789,
+                    0.000013745962164724157000697882247131, 0.0080685863688738888865881193623864,
+                    0.00012074974710011031125631020266553, -0.00010042135441622312822841645019167,
+                    0.00011130290033867137325027107941366],
+                   [0.15717912467153988265167186000326, -0.10288007693621757654423021222101,
+                    0.0080685863688738888865881193623864, 29.005838188852990811028575990349,
+                    0.12408344051778112671069465022811, -0.10193644943826736526393261783596,
+                    0.60075381294204155402383094042307],
+                   [0.0026876560011614997885986966252858, -0.0013902327543057948350258001823931,
+                    0.00012074974710011031125631020266553, 0.12408344051778112671069465022811,
+                    0.02079352674233487727195601735275, -0.018431109170459980539646949182497,
+                    -0.015721846813032722134373386779771],
+                   [-0.0028904633825263671524641306831427, 0.0011591852212130876378232136048041,
+                    -0.00010042135441622312822841645019167, -0.10193644943826736526393261783596,
+                    -0.018431109170459980539646949182497, 0.018700867933453400870913441167431,
+                    0.01552333576829629385729347745837],
+                   [-0.0031801707001874032418320403792222, -0.0027284927011686846420879248853453,
+                    0.00011130290033867137325027107941366, 0.60075381294204155402383094042307,
+                    -0.015721846813032722134373386779771, 0.01552333576829629385729347745837,
+                    0.72356838038463477946748980684788]])
+
+# Modulation factor of the covariance of the parameter vector not to generate too extreme realizations of parameter
+# vector
+_F = 0.90
+
+# Lower triangular Cholesky factor of the modulated covariance matrix (factorized once)
+_SIGMA_CHOLESKY = np.linalg.cholesky(_SIGMA * _F)
+
+# Maximum allowed output noise SD (mg/dl)
+_MAX_OUTPUT_NOISE_SD = 10
+
+# Tolerance for model stability check
+_TOLL = 0.02
+
+
 class Vettoretti19CGM(CGM):
     """
     A class that represents a CGM sensor based on the error model in Vettoretti et al., Sensors, 2019
@@ -18,10 +69,15 @@ class Vettoretti19CGM(CGM):
         An array containing the parameters of the CGM.
     output_noise_sd: float
         The output standard deviation of the CGM error model.
-    ekm1: float
-        Memory term for the CGM noise: e(k-1).
-   ekm2: float
-        Memory term for the CGM noise: e(k-2).
+    noise: np.ndarray
+        The AR(2) noise of the CGM sensor, one sample per measure, generated at once for its whole lifetime.
+    noise_index: int
+        The index of the noise sample of the next measure.
+    parameter_bank: CGMParameterBank
+        The bank the error parameters of the next connected sensor are taken from. If None, they are sampled.
+    rng: np.random.Generator
+        The random number generator the CGM sensor samples its error parameters and noise from. If None, the global
+        numpy random state is used.
     max_lifetime: float
         The maximum lifetime of the CGM sensor (in minutes).
     connected_at: int
@@ -34,6 +90,13 @@ class Vettoretti19CGM(CGM):
         Connects a new CGM sensor by sampling new error parameters.
     measure(ig, t):
         Function that provides a CGM measure using the model of Vettoretti et al., Sensors, 2019.
+    measure_trajectory(ig):
+        Function that provides the CGM trace measured from a whole interstitial glucose trace, at once.
+    measure_trajectories(cgms, ig):
+        Function that provides the CGM traces measured by many CGM sensors from as many interstitial glucose traces,
+        at once.
+    new_parameter_bank(n, rng):
+        Returns a bank of n sets of error parameters, sampled at once.
     """
 
     def __init__(self):
@@ -43,15 +106,17 @@ class Vettoretti19CGM(CGM):
         The constructor takes no parameters. The CGM sample time `ts` (min) is inherited from the base `CGM` class
         and defaults to 5.
         """
-        super().__init__()
+        # The sensor is connected by connect_new_cgm (it has no error parameters until then)
+        self.parameter_bank = None
+        super().__init__(connect=False)
 
         # Set the parameters of the CGM
         self.cgm_error_parameters = []
         self.output_noise_sd = []
 
-        # Set memory terms
-        self.ekm1 = None
-        self.ekm2 = None
+        # Set the noise
+        self.noise = np.empty(0)
+        self.noise_index = 0
 
     def connect_new_cgm(self, connected_at=0):
         """
@@ -82,81 +147,22 @@ class Vettoretti19CGM(CGM):
 
         super().connect_new_cgm(connected_at)
 
-        # Load  Mean vector and covariance matrix of the parameter vector as
-        # defined in Vettoretti et al., Sensors, 2019
-        mu = np.array([0.94228767821000314341972625697963, 0.0049398821141803427384187052950892,
-                       -0.0005848748565491275084801681138913, 6.382602204050874306062723917421,
-                       1.2604070417357611244568715846981, -0.4022228938823663169088717950217,
-                       3.2516360856114072674927228945307])
-        sigma = np.array([[0.013245827952891258902368143424155, -0.0039513025350735725416129184850433,
-                           0.00031276743283791636970891936186945, 0.15717912467153988265167186000326,
-                           0.0026876560011614997885986966252858, -0.0028904633825263671524641306831427,
-                           -0.0031801707001874032418320403792222],
-                          [-0.0039513025350735725416129184850433, 0.0018527975980744701509778105119608,
-                           -0.00015580332205794781403294935184789, -0.10288007693621757654423021222101,
-                           -0.0013902327543057948350258001823931, 0.0011591852212130876378232136048041,
-                           -0.0027284927011686846420879248853453],
-                          [0.00031276743283791636970891936186945, -0.00015580332205794781403294935184789,
-                           0.000013745962164724157000697882247131, 0.0080685863688738888865881193623864,
-                           0.00012074974710011031125631020266553, -0.00010042135441622312822841645019167,
-                           0.00011130290033867137325027107941366],
-                          [0.15717912467153988265167186000326, -0.10288007693621757654423021222101,
-                           0.0080685863688738888865881193623864, 29.005838188852990811028575990349,
-                           0.12408344051778112671069465022811, -0.10193644943826736526393261783596,
-                           0.60075381294204155402383094042307],
-                          [0.0026876560011614997885986966252858, -0.0013902327543057948350258001823931,
-                           0.00012074974710011031125631020266553, 0.12408344051778112671069465022811,
-                           0.02079352674233487727195601735275, -0.018431109170459980539646949182497,
-                           -0.015721846813032722134373386779771],
-                          [-0.0028904633825263671524641306831427, 0.0011591852212130876378232136048041,
-                           -0.00010042135441622312822841645019167, -0.10193644943826736526393261783596,
-                           -0.018431109170459980539646949182497, 0.018700867933453400870913441167431,
-                           0.01552333576829629385729347745837],
-                          [-0.0031801707001874032418320403792222, -0.0027284927011686846420879248853453,
-                           0.00011130290033867137325027107941366, 0.60075381294204155402383094042307,
-                           -0.015721846813032722134373386779771, 0.01552333576829629385729347745837,
-                           0.72356838038463477946748980684788]])
-
-        # Modulation factor of the covariance of the parameter vector not to generate too extreme realizations of
-        # parameter vector
-        f = 0.90
-        # Modulate the covariance matrix
-        sigma = sigma * f
-        # Maximum allowed output noise SD (mg/dl)
-        max_output_noise_sd = 10
-        # Tolerance for model stability check
-        toll = 0.02
-
-        # Flag for stability of the AR(2) model
-        stable = 0
-        output_noise_sd = np.inf
-        cgm_error_parameters = []
-        while (~ stable) or (output_noise_sd > max_output_noise_sd):
-            # Sample CGM error parameters
-            cgm_error_parameters = np.random.multivariate_normal(mu, sigma)
-
-            # Check the stability of the resulting AR(2) model
-            stable = (cgm_error_parameters[5] >= -1) and (
-                    cgm_error_parameters[5] <= (1 - np.abs(cgm_error_parameters[4]) - toll))
-
-            output_noise_var = cgm_error_parameters[6] ** 2 / (
-                    1 - (cgm_error_parameters[4] ** 2) / (1 - cgm_error_parameters[5]) - cgm_error_parameters[5] * (
-                    (cgm_error_parameters[4] ** 2) / (1 - cgm_error_parameters[5]) + cgm_error_parameters[5]))
-
-            if output_noise_var < 0:
-                continue
-
-            # Compute the output noise standard deviation
-            output_noise_sd = np.sqrt(output_noise_var)
+        # Take the parameters of the CGM from the bank, if any, otherwise sample them
+        if self.parameter_bank is not None:
+            cgm_error_parameters, output_noise_sd = self.parameter_bank.draw()
+        else:
+            cgm_error_parameters, output_noise_sd = sample_cgm_error_parameters(1, self.rng)
+            cgm_error_parameters, output_noise_sd = cgm_error_parameters[0], output_noise_sd[0]
 
         # Set the parameters of the CGM
         self.cgm_error_parameters = cgm_error_parameters
         self.output_noise_sd = output_noise_sd
 
-        # Set memory terms
-        self.ekm1 = 0
-        self.ekm2 = 0
-
+        # Generate the noise of the whole sensor lifetime (starting from null memory terms)
+        self.noise = np.empty(0)
+        self.noise_index = 0
+        self.__noise_state = np.zeros(2)
+        self.__generate_noise(int(np.ceil(self.max_lifetime / self.ts)))
 
     def measure(self, ig, past_ig, t):
         """
@@ -189,18 +195,287 @@ class Vettoretti19CGM(CGM):
         None
         """
 
-        # Apply calibration error
-        ig_s = (self.cgm_error_parameters[0] + self.cgm_error_parameters[1] * (t + self.t_offset) +
-                self.cgm_error_parameters[2] * ((t + self.t_offset) ** 2)) * ig + self.cgm_error_parameters[3]
+        # Apply calibration error and add the next noise sample
+        return _measure(self.cgm_error_parameters, t + self.t_offset, ig, self.__next_noise(1)[0])
+
+    def measure_trajectory(self, ig: np.ndarray) -> np.ndarray:
+        """
+        Function that provides the CGM trace measured from a whole interstitial glucose trace, i.e., one measure every
+        `ts` minutes starting from t = 0, connecting a new CGM sensor whenever the current one reaches its maximum
+        lifetime. The noise samples are looked up from the pre-generated noise and the error model is applied to the
+        whole trace at once, giving the same measures as calling `measure` at each sample time.
+
+        Parameters
+        ----------
+        ig: np.ndarray
+            The interstitial glucose concentration at each minute (mg/dl).
+
+        Returns
+        -------
+        cgm: np.ndarray
+            The CGM measurements, one every `ts` minutes (mg/dl).
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        ks = np.arange(0, ig.shape[0], self.ts)
+        cgm = np.zeros(shape=(ks.shape[0],))
+
+        # Split the trace at the samples where a new sensor is connected
+        reconnections = np.flatnonzero(self.__reconnections(ks))
+        bounds = [0] + reconnections.tolist() + [ks.shape[0]]
+
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if start > 0:
+                # connect new sensor
+                self.connect_new_cgm(connected_at=int(ks[start]))
+            cgm[start:stop] = _measure(self.cgm_error_parameters,
+                                       (ks[start:stop] - self.connected_at) / (24 * 60) + self.t_offset,
+                                       ig[ks[start:stop]], self.__next_noise(stop - start))
+        return cgm
+
+    @staticmethod
+    def measure_trajectories(cgms: list[CGM], ig: np.ndarray) -> np.ndarray:
+        """
+        Function that provides the CGM traces measured by many CGM sensors (e.g., one per realization of a replay) from
+        as many interstitial glucose traces, i.e., the r-th row of the result is `cgms[r].measure_trajectory(ig[r])`.
+        The error model is applied to all the traces at once. The sensors that are not Vettoretti19CGM sensors with
+        the same sample time, or that need to be replaced during the traces, measure their trace on their own.
+
+        Parameters
+        ----------
+        cgms: list[CGM]
+            The CGM sensors, one per trace.
+        ig: np.ndarray
+            A (n, tsteps) matrix containing the interstitial glucose concentration of each trace at each minute
+            (mg/dl).
+
+        Returns
+        -------
+        cgm: np.ndarray
+            A (n, ceil(tsteps / ts)) matrix containing the CGM measurements of each trace, one every `ts` minutes
+            (mg/dl).
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        ts = cgms[0].ts
+        ks = np.arange(0, ig.shape[1], ts)
+        cgm = np.zeros(shape=(len(cgms), ks.shape[0]))
+        cgm_error_parameters = np.zeros(shape=(len(cgms), 7))
+        t = np.zeros(shape=cgm.shape)
+        noise = np.zeros(shape=cgm.shape)
+
+        # Look up the noise of each sensor (in order, since sensors that are replaced draw new random numbers)
+        rows = []
+        for r, sensor in enumerate(cgms):
+            if not isinstance(sensor, Vettoretti19CGM) or sensor.ts != ts or np.any(sensor.__reconnections(ks)):
+                cgm[r] = sensor.measure_trajectory(ig[r])
+                continue
+            rows.append(r)
+            cgm_error_parameters[r] = sensor.cgm_error_parameters
+            t[r] = (ks - sensor.connected_at) / (24 * 60) + sensor.t_offset
+            noise[r] = sensor.__next_noise(ks.shape[0])
+
+        cgm[rows] = _measure(cgm_error_parameters[rows], t[rows], ig[rows][:, ks], noise[rows])
+        return cgm
 
-        # Generate noise
-        z = np.random.normal(0, 1)
-        u = self.cgm_error_parameters[6] * z
-        e = u + self.cgm_error_parameters[4] * self.ekm1 + self.cgm_error_parameters[5] * self.ekm2
+    @staticmethod
+    def new_parameter_bank(n: int, rng: np.random.Generator | None = None) -> 'CGMParameterBank':
+        """
+        Returns a bank of n sets of error parameters, sampled at once from rng (or from the global numpy random state,
+        if None), to be handed out to the next n connected sensors (see `CGMParameterBank`).
+        """
+        return CGMParameterBank(n, rng)
+
+    def __reconnections(self, ks: np.ndarray) -> np.ndarray:
+        """
+        Internal function that returns whether a new sensor has to be connected at each of the sample times ks.
+        """
+        return (ks > 0) & (np.mod(ks + self.t_offset, self.max_lifetime) == 0)
+
+    def __generate_noise(self, n: int) -> None:
+        """
+        Internal function that generates the next n samples of the AR(2) noise of the sensor at once, i.e.,
+        e(k) = a1 * e(k-1) + a2 * e(k-2) + u(k), with u(k) white noise of standard deviation sigma.
+        """
+        z = (np.random if self.rng is None else self.rng).normal(0, 1, size=n)
+        e, self.__noise_state = lfilter([self.cgm_error_parameters[6]],
+                                        [1, -self.cgm_error_parameters[4], -self.cgm_error_parameters[5]],
+                                        z, zi=self.__noise_state)
+        self.noise = np.concatenate([self.noise, e])
+
+    def __next_noise(self, n: int) -> np.ndarray:
+        """
+        Internal function that returns the noise samples of the next n measures.
+        """
+        if self.noise_index + n > self.noise.shape[0]:
+            # The sensor is used beyond its maximum lifetime
+            self.__generate_noise(self.noise_index + n - self.noise.shape[0])
+        e = self.noise[self.noise_index:self.noise_index + n]
+        self.noise_index += n
+        return e
+
+
+class CGMParameterBank:
+    """
+    A class that samples the error parameters of many CGM sensors at once and hands them out to the sensors, one set
+    per connected sensor.
+
+    ...
+    Attributes
+    ----------
+    cgm_error_parameters: np.ndarray
+        A (n, 7) matrix containing the error parameters of each sensor.
+    output_noise_sd: np.ndarray
+        A (n, ) array containing the output noise standard deviation of each sensor.
+    next_index: int
+        The index of the set of parameters of the next connected sensor.
+    rng: np.random.Generator
+        The random number generator the sets of error parameters are sampled from. If None, the global numpy random
+        state is used.
+
+    Methods
+    -------
+    draw():
+        Hands out the next set of error parameters.
+    """
+
+    def __init__(self, n: int, rng: np.random.Generator | None = None):
+        """
+        Constructs all the necessary attributes for the CGMParameterBank object.
+
+        Parameters
+        ----------
+        n: int
+            The number of sets of error parameters to sample.
+        rng: np.random.Generator, optional, default : None
+            The random number generator to sample from. If None, the global numpy random state is used.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        self.rng = rng
+        self.cgm_error_parameters, self.output_noise_sd = sample_cgm_error_parameters(n, rng)
+        self.next_index = 0
+
+    def draw(self) -> tuple[np.ndarray, float]:
+        """
+        Hands out the next set of error parameters and its output noise standard deviation. Once all the sets have
+        been handed out, new ones are sampled one at a time.
+        """
+        if self.next_index == self.cgm_error_parameters.shape[0]:
+            cgm_error_parameters, output_noise_sd = sample_cgm_error_parameters(1, self.rng)
+            self.cgm_error_parameters = np.concatenate([self.cgm_error_parameters, cgm_error_parameters])
+            self.output_noise_sd = np.concatenate([self.output_noise_sd, output_noise_sd])
+        self.next_index += 1
+        return self.cgm_error_parameters[self.next_index - 1], self.output_noise_sd[self.next_index - 1]
+
+
+def sample_cgm_error_parameters(n: int, rng: np.random.Generator | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Samples n valid parameter vectors of the error model of Vettoretti et al., Sensors, 2019 at once, i.e., vectors
+    whose AR(2) noise model is stable and whose output noise standard deviation is not above 10 mg/dl. Candidates are
+    drawn in batches from the multivariate normal distribution of the parameters (using a Cholesky factor of its
+    covariance matrix computed once) and filtered at once.
+
+    Parameters
+    ----------
+    n: int
+        The number of parameter vectors to sample.
+    rng: np.random.Generator, optional, default : None
+        The random number generator to sample from. If None, the global numpy random state is used.
+
+    Returns
+    -------
+    cgm_error_parameters: np.ndarray
+        A (n, 7) matrix containing the sampled parameter vectors.
+    output_noise_sd: np.ndarray
+        A (n, ) array containing the output noise standard deviation of each parameter vector.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    None
+
+    Examples
+    --------
+    None
+    """
+    cgm_error_parameters = np.empty((0, _MU.shape[0]))
+    while cgm_error_parameters.shape[0] < n:
+        # About 3 out of 4 candidates are valid, so that a batch is enough most of the times
+        missing = n - cgm_error_parameters.shape[0]
+        z = (np.random if rng is None else rng).normal(0, 1, size=(int(np.ceil(1.5 * missing)) + 4, _MU.shape[0]))
+        candidates = _MU + z @ _SIGMA_CHOLESKY.T
+
+        # Check the stability of the resulting AR(2) models and their output noise standard deviation
+        stable = (candidates[:, 5] >= -1) & (candidates[:, 5] <= (1 - np.abs(candidates[:, 4]) - _TOLL))
+        output_noise_var = _output_noise_var(candidates)
+        with np.errstate(invalid='ignore'):
+            valid = stable & (output_noise_var >= 0) & (np.sqrt(output_noise_var) <= _MAX_OUTPUT_NOISE_SD)
+
+        cgm_error_parameters = np.concatenate([cgm_error_parameters, candidates[valid]])
+
+    cgm_error_parameters = cgm_error_parameters[:n]
+    return cgm_error_parameters, np.sqrt(_output_noise_var(cgm_error_parameters))
+
+
+def _output_noise_var(cgm_error_parameters):
+    """
+    Internal function that computes the output noise variance of the AR(2) noise model of each row of
+    cgm_error_parameters.
+    """
+    a1, a2, sigma = cgm_error_parameters[:, 4], cgm_error_parameters[:, 5], cgm_error_parameters[:, 6]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sigma ** 2 / (1 - (a1 ** 2) / (1 - a2) - a2 * ((a1 ** 2) / (1 - a2) + a2))
+
+
+def _measure(cgm_error_parameters, t, ig, e):
+    """
+    Internal function that applies the error model of Vettoretti et al., Sensors, 2019 to the interstitial glucose ig,
+    measured at times t (days from the start of the CGM sensor, offset included), given the noise e. Works on single
+    samples, on traces, and on (n, m) matrices of traces (one row, and one row of cgm_error_parameters, per sensor).
+    """
+    p = np.asarray(cgm_error_parameters).T[..., np.newaxis] if np.ndim(cgm_error_parameters) > 1 \
+        else cgm_error_parameters
 
-        # Update memory terms
-        self.ekm2 = self.ekm1
-        self.ekm1 = e
+    # Apply calibration error
+    ig_s = (p[0] + p[1] * t + p[2] * (t ** 2)) * ig + p[3]
 
-        # Get final CGM
-        return ig_s + e
+    # Get final CGM
+    return ig_s + e
@@ -0,0 +1,25 @@
+import numpy as np
+
+from py_replay_bg.sensors.Vettoretti19CGM import Vettoretti19CGM, sample_cgm_error_parameters
+
+
+def test_cgm_parameter_bank():
+
+    # Sample many sets of error parameters at once
+    np.random.seed(1)
+    cgm_error_parameters, output_noise_sd = sample_cgm_error_parameters(1000)
+
+    # All the sets are valid, i.e., their AR(2) noise model is stable and their output noise is not too large
+    assert cgm_error_parameters.shape == (1000, 7)
+    assert np.all(cgm_error_parameters[:, 5] >= -1)
+    assert np.all(cgm_error_parameters[:, 5] <= 1 - np.abs(cgm_error_parameters[:, 4]) - 0.02)
+    assert np.all(np.isfinite(output_noise_sd)) and np.all(output_noise_sd <= 10)
+
+    # A bank hands its sets out to the connected sensors, in order, and samples new ones once they are over
+    bank = Vettoretti19CGM.new_parameter_bank(2)
+    cgm = Vettoretti19CGM()
+    cgm.parameter_bank = bank
+    for i in range(3):
+        cgm.connect_new_cgm()
+        assert np.array_equal(cgm.cgm_error_parameters, bank.cgm_error_parameters[i])
+        assert cgm.output_noise_sd == bank.output_noise_sd[i]
@@ -0,0 +1,31 @@
+import copy
+import numpy as np
+
+from py_replay_bg.sensors.Vettoretti19CGM import Vettoretti19CGM
+
+
+def test_cgm_trajectories():
+
+    # Connect a sensor and make identical copies of it
+    np.random.seed(1)
+    cgm = Vettoretti19CGM()
+    cgm.connect_new_cgm()
+    cgms = [copy.deepcopy(cgm) for _ in range(4)]
+
+    # Two days of interstitial glucose
+    ig = 120 + 60 * np.sin(np.arange(2 * 24 * 60) / 180)
+
+    # Measure the trace one sample at a time, at once, and at once for a batch of sensors
+    step = np.array([cgms[0].measure(ig[k], t=k / (24 * 60), past_ig=ig[:k]) for k in range(0, ig.shape[0], cgm.ts)])
+    trajectory = cgms[1].measure_trajectory(ig)
+    trajectories = Vettoretti19CGM.measure_trajectories(cgms[2:], np.tile(ig, (2, 1)))
+
+    # The measures match, and consume the pre-generated noise in the same way
+    assert np.array_equal(step, trajectory)
+    assert np.array_equal(trajectories, np.tile(trajectory, (2, 1)))
+    assert all(c.noise_index == step.shape[0] for c in cgms)
+
+    # A sensor used beyond its maximum lifetime extends its noise
+    cgm.noise_index = cgm.noise.shape[0] - 1
+    assert cgm.measure_trajectory(ig[:60]).shape == (12,)
+    assert cgm.noise.shape[0] == cgm.noise_index
@@ -0,0 +1,53 @@
+import os
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_test_data_extended, load_patient_info
+
+from py_replay_bg.environment import Environment
+from py_replay_bg.model.t1d_model_single_meal import T1DModelSingleMeal
+from py_replay_bg.model.t1d_model_multi_meal import T1DModelMultiMeal
+from py_replay_bg.data import ReplayBGData
+
+
+def test_early_rejection():
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw and u2ss
+    bw = float(patient_info.bw.values[p])
+    u2ss = float(patient_info.u2ss.values[p])
+
+    for blueprint, data, extended, integration_step in [('single-meal', load_test_data(day=1), False, 1),
+                                                        ('multi-meal', load_test_data(day=1), False, 1),
+                                                        ('multi-meal', load_test_data(day=1), False, 5),
+                                                        ('multi-meal', load_test_data_extended(day=1), True, 1)]:
+
+        environment = Environment(blueprint=blueprint, save_folder=os.path.join(os.path.abspath('')),
+                                  yts=5, exercise=False, seed=1, plot_mode=False, verbose=False)
+        if blueprint == 'single-meal':
+            model = T1DModelSingleMeal(data=data, bw=bw, u2ss=u2ss, environment=environment, is_twin=True,
+                                       integration_step=integration_step)
+        else:
+            model = T1DModelMultiMeal(data=data, bw=bw, u2ss=u2ss, environment=environment, is_twin=True,
+                                      extended=extended, integration_step=integration_step)
+        rbg_data = ReplayBGData(data=data, model=model, environment=environment)
+
+        # Nominal parameters plus random perturbations around them
+        rng = np.random.default_rng(1)
+        theta = np.array([getattr(model.model_parameters, p) for p in model.unknown_parameters])
+        thetas = theta * rng.uniform(0.8, 1.2, (50, theta.shape[0]))
+
+        log_posterior = model.log_posterior_ensemble(thetas, rbg_data)
+        finite = np.isfinite(log_posterior)
+        assert finite.any()
+
+        # Thresholds around the actual values: the accepted guesses must be evaluated exactly, the others rejected
+        lp_min = np.where(finite, log_posterior, 0) + rng.normal(0, 50, thetas.shape[0])
+        bounded = model.log_posterior_ensemble(thetas, rbg_data, lp_min)
+
+        accepted = log_posterior > lp_min
+        assert accepted.any() and not accepted.all()
+        assert np.array_equal(bounded > lp_min, accepted)
+        assert np.allclose(bounded[accepted], log_posterior[accepted])
+        assert np.all(bounded[~accepted] == -np.inf)
@@ -0,0 +1,59 @@
+import os
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_test_data_extended, load_patient_info
+
+from py_replay_bg.environment import Environment
+from py_replay_bg.model.t1d_model_single_meal import T1DModelSingleMeal
+from py_replay_bg.model.t1d_model_multi_meal import T1DModelMultiMeal
+from py_replay_bg.data import ReplayBGData
+
+
+def simulate(blueprint, data, bw, u2ss, integration_step, extended=False):
+
+    environment = Environment(blueprint=blueprint, save_folder=os.path.join(os.path.abspath('')),
+                              yts=5, exercise=False, seed=1, plot_mode=False, verbose=False)
+    if blueprint == 'single-meal':
+        model = T1DModelSingleMeal(data=data, bw=bw, u2ss=u2ss, environment=environment, is_twin=True,
+                                   integration_step=integration_step)
+    else:
+        model = T1DModelMultiMeal(data=data, bw=bw, u2ss=u2ss, environment=environment, is_twin=True,
+                                  extended=extended, integration_step=integration_step)
+    rbg_data = ReplayBGData(data=data, model=model, environment=environment)
+
+    # Nominal parameters plus random perturbations around them
+    theta = np.array([getattr(model.model_parameters, p) for p in model.unknown_parameters])
+    thetas = theta * np.random.default_rng(1).uniform(0.8, 1.2, (20, theta.shape[0]))
+    thetas[0] = theta
+
+    G = model.simulate_ensemble(thetas, rbg_data)
+    func, args = model.compiled_log_posterior(rbg_data)
+    return G, func(theta, *args)
+
+
+def test_integration_step():
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw and u2ss
+    bw = float(patient_info.bw.values[p])
+    u2ss = float(patient_info.u2ss.values[p])
+
+    for blueprint, data, extended in [('single-meal', load_test_data(day=1), False),
+                                      ('multi-meal', load_test_data(day=1), False),
+                                      ('multi-meal', load_test_data_extended(day=1), True)]:
+
+        # Compare the 5-minute exponential integrator against the 1-minute backward-euler reference at the
+        # measurement times
+        G_ref, log_posterior_ref = simulate(blueprint, data, bw, u2ss, 1, extended)
+        G, log_posterior = simulate(blueprint, data, bw, u2ss, 5, extended)
+
+        err = np.abs(G[:, ::5] - G_ref[:, ::5])
+        print(blueprint + (' extended' if extended else '') +
+              ': mean error %.3f mg/dl, max error %.3f mg/dl' % (err.mean(), err.max()))
+
+        assert err.mean() < 0.5
+        assert err.max() < 5
+        assert np.isfinite(log_posterior)
+        assert abs(log_posterior - log_posterior_ref) < 1e-2 * abs(log_posterior_ref)
@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pytest
+
+from py_replay_bg.tests import load_test_data, load_test_data_extended, load_patient_info
+
+from py_replay_bg.environment import Environment
+from py_replay_bg.model.t1d_model_single_meal import T1DModelSingleMeal
+from py_replay_bg.model.t1d_model_multi_meal import T1DModelMultiMeal
+from py_replay_bg.data import ReplayBGData
+
+
+@pytest.mark.parametrize('blueprint, extended', [('single-meal', False), ('multi-meal', False), ('multi-meal', True)])
+def test_log_posterior(blueprint, extended):
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw and u2ss
+    bw = float(patient_info.bw.values[p])
+    u2ss = float(patient_info.u2ss.values[p])
+
+    data = load_test_data_extended(day=1) if extended else load_test_data(day=1)
+    environment = Environment(blueprint=blueprint, save_folder=os.path.join(os.path.abspath('')),
+                              yts=5, exercise=False, seed=1, plot_mode=False, verbose=False)
+    if blueprint == 'single-meal':
+        model = T1DModelSingleMeal(data=data, bw=bw, u2ss=u2ss, environment=environment, is_twin=True)
+    else:
+        model = T1DModelMultiMeal(data=data, bw=bw, u2ss=u2ss, environment=environment, is_twin=True,
+                                  extended=extended)
+    rbg_data = ReplayBGData(data=data, model=model, environment=environment)
+
+    # Perturb the nominal parameters a few times
+    theta = np.array([getattr(model.model_parameters, p) for p in model.unknown_parameters])
+    thetas = theta * np.random.default_rng(1).uniform(0.9, 1.1, (4, theta.shape[0]))
+    thetas[:, 0] = [100, 110, 120, 130]
+
+    # The batched, vectorized, and compiled log posteriors are the same of the reference one
+    reference = model.log_posterior_extended if extended else model.log_posterior
+    log_posterior_func, args = model.compiled_log_posterior(rbg_data)
+    log_posteriors = model.log_posterior_ensemble(thetas, rbg_data)
+    for theta, log_posterior in zip(thetas, log_posteriors):
+        expected = reference(theta, rbg_data)
+        assert np.isfinite(expected)
+        assert np.isclose(log_posterior, expected)
+        assert np.isclose(log_posterior_func(theta, *args), expected)
@@ -0,0 +1,54 @@
+import os
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_test_data_extended, load_patient_info
+
+from py_replay_bg.environment import Environment
+from py_replay_bg.model.t1d_model_single_meal import T1DModelSingleMeal
+from py_replay_bg.model.t1d_model_multi_meal import T1DModelMultiMeal
+from py_replay_bg.data import ReplayBGData
+
+
+def test_log_posterior_gradient():
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw and u2ss
+    bw = float(patient_info.bw.values[p])
+    u2ss = float(patient_info.u2ss.values[p])
+
+    for blueprint, data, extended in [('single-meal', load_test_data(day=1), False),
+                                      ('multi-meal', load_test_data(day=1), False),
+                                      ('multi-meal', load_test_data_extended(day=1), True)]:
+
+        environment = Environment(blueprint=blueprint, save_folder=os.path.join(os.path.abspath('')),
+                                  yts=5, exercise=False, seed=1, plot_mode=False, verbose=False)
+        if blueprint == 'single-meal':
+            model = T1DModelSingleMeal(data=data, bw=bw, u2ss=u2ss, environment=environment, is_twin=True)
+        else:
+            model = T1DModelMultiMeal(data=data, bw=bw, u2ss=u2ss, environment=environment, is_twin=True,
+                                      extended=extended)
+        rbg_data = ReplayBGData(data=data, model=model, environment=environment)
+
+        # Perturb the nominal parameters so that the risk is active (Gb) and the gradient is not trivial
+        theta = np.array([getattr(model.model_parameters, p) for p in model.unknown_parameters])
+        theta = theta * np.random.default_rng(1).uniform(0.9, 1.1, theta.shape[0])
+        theta[0] = 110
+
+        log_posterior, gradient = model.log_posterior_gradient(theta, rbg_data)
+        log_posterior_func, args = model.compiled_log_posterior(rbg_data)
+        assert np.isclose(log_posterior, log_posterior_func(theta, *args))
+
+        # Compare against central finite differences
+        for i, name in enumerate(model.unknown_parameters):
+            if name.startswith('beta'):
+                assert gradient[i] == 0
+                continue
+            h = 1e-6 * abs(theta[i])
+            theta_p, theta_m = theta.copy(), theta.copy()
+            theta_p[i] += h
+            theta_m[i] -= h
+            fd = (model.log_posterior_gradient(theta_p, rbg_data)[0] -
+                  model.log_posterior_gradient(theta_m, rbg_data)[0]) / (2 * h)
+            assert np.isclose(gradient[i], fd, rtol=1e-4, atol=1e-3 * np.abs(gradient).max()), name
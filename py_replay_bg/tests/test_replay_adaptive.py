@@ -0,0 +1,59 @@
+import os
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.py_replay_bg import ReplayBG
+
+
+def test_replay_adaptive():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw
+    bw = float(patient_info.bw.values[p])
+
+    # Instantiate ReplayBG
+    rbg = ReplayBG(blueprint=blueprint, save_folder=save_folder,
+                   yts=5, exercise=False,
+                   seed=1,
+                   verbose=False, plot_mode=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1)
+
+    # Replay the twin until the percentiles of the results converge
+    replay_results = rbg.replay(data=data, bw=bw, save_name=save_name,
+                                twinning_method='mcmc', n_replay='adaptive')
+    convergence = replay_results['convergence']
+    n = convergence['n_replay']
+    assert convergence['converged']
+    assert n in range(200, 1001, 100)
+    assert replay_results['glucose']['realizations'].shape[0] == n
+    assert len(replay_results['sensors']) == n
+    assert convergence['percentile_change'][-1] <= 2.0 and convergence['metric_change'][-1] <= 1.0
+
+    # Tolerances that cannot be met replay all the realizations, the converged replay being their first n ones
+    all_results = rbg.replay(data=data, bw=bw, save_name=save_name,
+                             twinning_method='mcmc', n_replay='adaptive',
+                             percentile_tolerance=1e-9, metric_tolerance=1e-9)
+    assert all_results['convergence']['n_replay'] == 1000
+    assert not all_results['convergence']['converged']
+    assert np.array_equal(all_results['cgm']['realizations'][:n], replay_results['cgm']['realizations'])
+
+    # The 10 realizations representing the deciles of the twin come first, so that loose tolerances stop at the
+    # first check
+    loose_results = rbg.replay(data=data, bw=bw, save_name=save_name,
+                               twinning_method='mcmc', n_replay='adaptive',
+                               percentile_tolerance=100.0, metric_tolerance=100.0)
+    assert loose_results['convergence']['n_replay'] == 100
+    ten_results = rbg.replay(data=data, bw=bw, save_name=save_name,
+                             twinning_method='mcmc', n_replay=10)
+    assert np.allclose(np.sort(loose_results['glucose']['realizations'][:10], axis=0),
+                       np.sort(ten_results['glucose']['realizations'], axis=0))
@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import pytest
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.py_replay_bg import ReplayBG
+
+from py_replay_bg.dss import batched_handler, batch_random
+from py_replay_bg.dss.default_dss_handlers import default_basal_handler
+
+
+@batched_handler
+def batched_basal_handler(glucose, meal_announcement, meal_type, hypotreatments, bolus, basal, time, time_index,
+                          dss):
+    # Same logic of default_basal_handler, for all the realizations at once
+    return np.where(glucose[:, time_index] < 70, 0, 0.01), dss
+
+
+def random_basal_handler(glucose, meal_announcement, meal_type, hypotreatments, bolus, basal, time, time_index, dss):
+    # A basal rate drawn at random from the global numpy random state
+    return np.random.uniform(0.005, 0.015), dss
+
+
+@batched_handler
+def batched_random_basal_handler(glucose, meal_announcement, meal_type, hypotreatments, bolus, basal, time, time_index,
+                                 dss):
+    # Same logic of random_basal_handler, for all the realizations at once
+    return batch_random.uniform(0.005, 0.015), dss
+
+
+def test_replay_batched():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw
+    bw = float(patient_info.bw.values[p])
+
+    # Instantiate ReplayBG
+    rbg = ReplayBG(blueprint=blueprint, save_folder=save_folder,
+                   yts=5, exercise=False,
+                   seed=1,
+                   verbose=False, plot_mode=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1)
+
+    # Replay a closed-loop scenario one realization at a time, in lockstep, and in lockstep with a batched handler
+    results = []
+    for batched, basal_handler in [(False, default_basal_handler), (True, default_basal_handler),
+                                   (True, batched_basal_handler)]:
+        np.random.seed(1)
+        results.append(rbg.replay(data=data, bw=bw, save_name=save_name,
+                                  twinning_method='mcmc', n_replay=10,
+                                  bolus_source='dss', basal_source='dss', basal_handler=basal_handler,
+                                  enable_correction_boluses=True,
+                                  batched=batched))
+
+    # The replays match
+    for batch_results in results[1:]:
+        for field in ['glucose', 'cgm', 'x_end', 'insulin_bolus', 'correction_bolus', 'insulin_basal']:
+            assert np.allclose(batch_results[field]['realizations'], results[0][field]['realizations'])
+
+    # Handlers drawing random numbers get the same draws of the serial replay (the batched ones from batch_random)
+    results = []
+    for batched, basal_handler in [(False, random_basal_handler), (True, random_basal_handler),
+                                   (True, batched_random_basal_handler)]:
+        results.append(rbg.replay(data=data, bw=bw, save_name=save_name,
+                                  twinning_method='mcmc', n_replay=10,
+                                  basal_source='dss', basal_handler=basal_handler,
+                                  enable_correction_boluses=True,
+                                  batched=batched))
+    assert np.any(results[0]['insulin_basal']['realizations'][0] != results[0]['insulin_basal']['realizations'][1])
+    for batch_results in results[1:]:
+        for field in ['glucose', 'cgm', 'insulin_basal']:
+            assert np.allclose(batch_results[field]['realizations'], results[0][field]['realizations'])
+
+    # Hence, their draws do not depend on the size of the batches (here, 10 and 90 realizations)
+    results = []
+    for batched, basal_handler in [(False, random_basal_handler), (True, batched_random_basal_handler)]:
+        results.append(rbg.replay(data=data, bw=bw, save_name=save_name,
+                                  twinning_method='mcmc', n_replay='adaptive',
+                                  percentile_tolerance=100.0, metric_tolerance=100.0,
+                                  basal_source='dss', basal_handler=basal_handler,
+                                  batched=batched))
+    assert results[1]['convergence']['n_replay'] == results[0]['convergence']['n_replay'] == 100
+    for field in ['glucose', 'cgm', 'insulin_basal']:
+        assert np.allclose(results[1][field]['realizations'], results[0][field]['realizations'])
+
+    # The realizations cannot be both replayed in lockstep and split across processes
+    with pytest.raises(Exception, match='batched'):
+        rbg.replay(data=data, bw=bw, save_name=save_name,
+                   twinning_method='mcmc', n_replay=10,
+                   basal_source='dss', basal_handler=batched_basal_handler,
+                   batched=True, parallelize=True)
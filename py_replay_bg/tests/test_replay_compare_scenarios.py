@@ -0,0 +1,81 @@
+import os
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.py_replay_bg import ReplayBG
+
+
+def test_replay_compare_scenarios():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw
+    bw = float(patient_info.bw.values[p])
+
+    # Instantiate ReplayBG
+    rbg = ReplayBG(blueprint=blueprint, save_folder=save_folder,
+                   yts=5, exercise=False,
+                   seed=1,
+                   verbose=False, plot_mode=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1)
+
+    # Compare two bolus calculator configurations, plus a copy of the reference one
+    bolus_calculator_handler_params = {'cr': 7, 'cf': 25, 'gt': 110}
+    comparison = rbg.compare_scenarios(data=data, bw=bw, save_name=save_name,
+                                       scenarios={'cr_7': {},
+                                                  'cr_10': {'bolus_calculator_handler_params': {'cr': 10, 'cf': 25,
+                                                                                                'gt': 110}},
+                                                  'cr_7_again': {}},
+                                       twinning_method='mcmc', n_replay=10,
+                                       bolus_source='dss',
+                                       bolus_calculator_handler_params=bolus_calculator_handler_params,
+                                       enable_correction_boluses=True)
+    results = comparison['replay_results']
+    differences = comparison['paired_differences']
+    assert comparison['reference'] == 'cr_7'
+    assert set(differences) == {'cr_10', 'cr_7_again'}
+
+    # The common parameters are not modified by the replays
+    assert bolus_calculator_handler_params == {'cr': 7, 'cf': 25, 'gt': 110}
+
+    # The paired realizations share the CGM sensors
+    for r in range(10):
+        assert np.array_equal(results['cr_10']['sensors'][r].cgm.cgm_error_parameters,
+                              results['cr_7']['sensors'][r].cgm.cgm_error_parameters)
+
+    # The same scenario gives the same realizations, the other one differs from it
+    assert np.array_equal(results['cr_7_again']['cgm']['realizations'], results['cr_7']['cgm']['realizations'])
+    assert all(np.all(d['realizations'] == 0) for d in differences['cr_7_again'].values())
+    assert np.all(differences['cr_10']['total_bolus_insulin']['realizations'] < 0)
+
+    # Pairing the realizations reduces the variance of the difference
+    assert differences['cr_10']['mean_glucose']['variance_reduction'] > 1
+    assert np.allclose(differences['cr_10']['mean_glucose']['realizations'],
+                       np.mean(results['cr_10']['glucose']['realizations'], axis=1)
+                       - np.mean(results['cr_7']['glucose']['realizations'], axis=1))
+
+    # Adaptive replays of different scenarios stop at their own number of realizations, and their first common ones
+    # are paired
+    comparison = rbg.compare_scenarios(data=data, bw=bw, save_name=save_name,
+                                       scenarios={'cr_8': {'bolus_calculator_handler_params': {'cr': 8, 'cf': 25,
+                                                                                               'gt': 110}},
+                                                  'cr_14': {'bolus_calculator_handler_params': {'cr': 14, 'cf': 25,
+                                                                                                'gt': 110}}},
+                                       twinning_method='mcmc', n_replay='adaptive',
+                                       bolus_source='dss', batched=True)
+    results = comparison['replay_results']
+    n = min(results[name]['convergence']['n_replay'] for name in results)
+    assert results['cr_8']['convergence']['n_replay'] != results['cr_14']['convergence']['n_replay']
+    assert comparison['paired_differences']['cr_14']['mean_glucose']['realizations'].shape == (n,)
+    assert np.allclose(comparison['paired_differences']['cr_14']['mean_glucose']['realizations'],
+                       np.mean(results['cr_14']['glucose']['realizations'][:n], axis=1)
+                       - np.mean(results['cr_8']['glucose']['realizations'][:n], axis=1))
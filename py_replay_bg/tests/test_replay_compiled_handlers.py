@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import pytest
+
+from numba import njit
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.py_replay_bg import ReplayBG
+
+
+# A typed record holding the parameters and the memory of the bolus calculator
+BOLUS_CALCULATOR_STATE = np.dtype([('cr', np.float64), ('cf', np.float64), ('gt', np.float64),
+                                   ('n_boluses', np.float64)])
+
+
+@njit
+def compiled_bolus_calculator_handler(glucose, meal_announcement, hypotreatments, bolus, basal, time, time_index,
+                                      state):
+    # A simplified standard formula (no insulin on board), counting the boluses
+    b = 0.0
+    if meal_announcement[time_index] > 0:
+        b = max(0.0, meal_announcement[time_index] / state[0]['cr']
+                + (glucose[time_index] - state[0]['gt']) / state[0]['cf'])
+        state[0]['n_boluses'] += 1
+    return b
+
+
+@njit
+def compiled_basal_handler(glucose, meal_announcement, hypotreatments, bolus, basal, time, time_index, state):
+    # An integral controller around 120 mg/dl, whose integral is kept in the state
+    state[0] += (glucose[time_index] - 120) * 1e-6
+    return min(max(0.01 + state[0], 0.0), 0.03)
+
+
+@njit
+def compiled_hypotreatments_handler(glucose, meal_announcement, hypotreatments, bolus, basal, time, time_index,
+                                    state):
+    # Same logic of ada_hypotreatments_handler
+    if glucose[time_index] < 70 and time_index >= 15 and not np.any(hypotreatments[time_index - 15:time_index]):
+        return 15.0
+    return 0.0
+
+
+@njit
+def compiled_correction_boluses_handler(glucose, meal_announcement, hypotreatments, bolus, basal, time, time_index,
+                                        state):
+    # Same logic of corrects_above_250_handler
+    if glucose[time_index] > 250 and time_index >= 60 and not np.any(bolus[time_index - 60:time_index]):
+        return 1.0
+    return 0.0
+
+
+@njit
+def compiled_random_basal_handler(glucose, meal_announcement, hypotreatments, bolus, basal, time, time_index, state):
+    # A basal rate drawn at random from the numba random generator
+    return np.random.uniform(0.005, 0.015)
+
+
+# The same handlers, run in the Python replay loop
+def bolus_calculator_handler(glucose, meal_announcement, meal_type, hypotreatments, bolus, basal, time, time_index,
+                             dss):
+    return compiled_bolus_calculator_handler.py_func(glucose, meal_announcement, hypotreatments, bolus, basal, time,
+                                                     time_index, dss.bolus_calculator_handler_params), dss
+
+
+def basal_handler(glucose, meal_announcement, meal_type, hypotreatments, bolus, basal, time, time_index, dss):
+    return compiled_basal_handler.py_func(glucose, meal_announcement, hypotreatments, bolus, basal, time,
+                                          time_index, dss.basal_handler_params), dss
+
+
+def hypotreatments_handler(glucose, meal_announcement, meal_type, hypotreatments, bolus, basal, time, time_index,
+                           dss):
+    return compiled_hypotreatments_handler.py_func(glucose, meal_announcement, hypotreatments, bolus, basal, time,
+                                                   time_index, None), dss
+
+
+def correction_boluses_handler(glucose, meal_announcement, meal_type, hypotreatments, bolus, basal, time, time_index,
+                               dss):
+    return compiled_correction_boluses_handler.py_func(glucose, meal_announcement, hypotreatments, bolus, basal, time,
+                                                       time_index, None), dss
+
+
+def test_replay_compiled_handlers():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw
+    bw = float(patient_info.bw.values[p])
+
+    # Instantiate ReplayBG
+    rbg = ReplayBG(blueprint=blueprint, save_folder=save_folder,
+                   yts=5, exercise=False,
+                   seed=1,
+                   verbose=False, plot_mode=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1)
+
+    # Replay a closed-loop scenario with the Python handlers (in lockstep, so that each realization gets its own
+    # memory area), and with the compiled ones (in nopython mode)
+    results = []
+    for handlers in [(bolus_calculator_handler, basal_handler, hypotreatments_handler, correction_boluses_handler),
+                     (compiled_bolus_calculator_handler, compiled_basal_handler, compiled_hypotreatments_handler,
+                      compiled_correction_boluses_handler)]:
+        np.random.seed(1)
+        results.append(rbg.replay(data=data, bw=bw, save_name=save_name,
+                                  twinning_method='mcmc', n_replay=10,
+                                  bolus_source='dss', bolus_calculator_handler=handlers[0],
+                                  bolus_calculator_handler_params=np.array([(10, 40, 120, 0)],
+                                                                           dtype=BOLUS_CALCULATOR_STATE),
+                                  basal_source='dss', basal_handler=handlers[1],
+                                  basal_handler_params=np.zeros(1),
+                                  enable_hypotreatments=True, hypotreatments_handler=handlers[2],
+                                  enable_correction_boluses=True, correction_boluses_handler=handlers[3],
+                                  handler_cadence={'basal_handler': 'cgm'},
+                                  batched=True))
+
+    # The replays match
+    for field in ['glucose', 'cgm', 'x_end', 'insulin_bolus', 'correction_bolus', 'insulin_basal', 'hypotreatments']:
+        assert np.allclose(results[1][field]['realizations'], results[0][field]['realizations'])
+
+    # The state of a compiled handler must be a 1-D array, so that each realization gets a copy of it
+    with pytest.raises(Exception, match='1-D'):
+        rbg.replay(data=data, bw=bw, save_name=save_name,
+                   twinning_method='mcmc', n_replay=10,
+                   basal_source='dss', basal_handler=compiled_basal_handler,
+                   basal_handler_params=np.zeros((1, 1)))
+
+    # Compiled handlers drawing random numbers are reproducible given the seed
+    results = []
+    for _ in range(2):
+        results.append(rbg.replay(data=data, bw=bw, save_name=save_name,
+                                  twinning_method='mcmc', n_replay=10,
+                                  basal_source='dss', basal_handler=compiled_random_basal_handler))
+    assert np.any(results[0]['insulin_basal']['realizations'][0] != results[0]['insulin_basal']['realizations'][1])
+    for field in ['glucose', 'cgm', 'insulin_basal']:
+        assert np.array_equal(results[1][field]['realizations'], results[0][field]['realizations'])
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.py_replay_bg import ReplayBG
+
+
+# The number of calls of counting_basal_handler (the replay does not modify the given handler parameters)
+basal_handler_calls = [0]
+
+
+def counting_basal_handler(glucose, meal_announcement, meal_type, hypotreatments, bolus, basal, time, time_index, dss):
+    # Count the calls and follow the glucose, so that the basal changes at each call
+    basal_handler_calls[0] += 1
+    return glucose[time_index] * 1e-4, dss
+
+
+def test_replay_handler_cadence():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw
+    bw = float(patient_info.bw.values[p])
+
+    # Instantiate ReplayBG
+    rbg = ReplayBG(blueprint=blueprint, save_folder=save_folder,
+                   yts=5, exercise=False,
+                   seed=1,
+                   verbose=False, plot_mode=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1)
+
+    # Call the basal controller every 5 minutes, the bolus calculator on meal announcements only, and the correction
+    # boluses at each CGM sample
+    handler_cadence = {'basal_handler': 5,
+                       'bolus_calculator_handler': 'meal_announcement',
+                       'correction_boluses_handler': 'cgm'}
+
+    basal_handler_calls[0] = 0
+    results = rbg.replay(data=data, bw=bw, save_name=save_name,
+                         twinning_method='map',
+                         bolus_source='dss', basal_source='dss', basal_handler=counting_basal_handler,
+                         enable_correction_boluses=True,
+                         handler_cadence=handler_cadence)
+
+    # The basal controller is called every 5 minutes and its output is held in between
+    basal = results['insulin_basal']['realizations'][0]
+    n_steps = basal.shape[0]
+    assert basal_handler_calls[0] == len(range(0, n_steps - 1, 5))
+    held = basal[1:1 + 5 * ((n_steps - 1) // 5)].reshape(-1, 5)
+    assert np.all(held == held[:, [0]]) and np.any(np.diff(held[:, 0]) != 0)
+
+    # Boluses are delivered only at meal announcements, and correction boluses only at CGM samples
+    meal_announcement = results['meal_announcement']['realizations'][0]
+    assert np.all(np.isin(np.flatnonzero(results['insulin_bolus']['realizations'][0] -
+                                         results['correction_bolus']['realizations'][0]) - 1,
+                          np.flatnonzero(meal_announcement)))
+    assert np.all((np.flatnonzero(results['correction_bolus']['realizations'][0]) - 1) % 5 == 0)
+
+    # The lockstep replay calls the handlers at the same times
+    results = []
+    for batched in [False, True]:
+        np.random.seed(1)
+        results.append(rbg.replay(data=data, bw=bw, save_name=save_name,
+                                  twinning_method='mcmc', n_replay=10,
+                                  bolus_source='dss', basal_source='dss',
+                                  enable_correction_boluses=True,
+                                  handler_cadence=handler_cadence,
+                                  batched=batched))
+    for field in ['glucose', 'insulin_bolus', 'correction_bolus', 'insulin_basal']:
+        assert np.allclose(results[0][field]['realizations'], results[1][field]['realizations'])
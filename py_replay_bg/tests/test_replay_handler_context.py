@@ -0,0 +1,55 @@
+import os
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.py_replay_bg import ReplayBG
+
+from py_replay_bg.dss import context_handler
+from py_replay_bg.dss.default_dss_handlers import default_basal_handler
+
+
+@context_handler
+def context_basal_handler(context, dss):
+    # Same logic of default_basal_handler, reading the histories from the context
+    assert not context.glucose.flags.writeable and not context.bolus.flags.writeable
+    return (0 if context.glucose[context.time_index] < 70 else 0.01), dss
+
+
+def test_replay_handler_context():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw
+    bw = float(patient_info.bw.values[p])
+
+    # Instantiate ReplayBG
+    rbg = ReplayBG(blueprint=blueprint, save_folder=save_folder,
+                   yts=5, exercise=False,
+                   seed=1,
+                   verbose=False, plot_mode=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1)
+
+    # Replay a closed-loop scenario with a positional handler and with the equivalent context handler, one
+    # realization at a time and in lockstep
+    results = []
+    for batched, basal_handler in [(False, default_basal_handler), (False, context_basal_handler),
+                                   (True, context_basal_handler)]:
+        np.random.seed(1)
+        results.append(rbg.replay(data=data, bw=bw, save_name=save_name,
+                                  twinning_method='mcmc', n_replay=10,
+                                  bolus_source='dss', basal_source='dss', basal_handler=basal_handler,
+                                  batched=batched))
+
+    # The replays match
+    for context_results in results[1:]:
+        for field in ['glucose', 'cgm', 'insulin_bolus', 'insulin_basal']:
+            assert np.allclose(context_results[field]['realizations'], results[0][field]['realizations'])
@@ -0,0 +1,46 @@
+import os
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.py_replay_bg import ReplayBG
+
+from py_replay_bg.dss.default_dss_handlers import no_ip_handler
+
+
+def test_replay_open_loop():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw
+    bw = float(patient_info.bw.values[p])
+
+    # Instantiate ReplayBG
+    rbg = ReplayBG(blueprint=blueprint, save_folder=save_folder,
+                   yts=5, exercise=False,
+                   seed=1,
+                   verbose=False, plot_mode=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1)
+
+    # Replay the open-loop scenario (compiled simulation)
+    np.random.seed(1)
+    open_loop_results = rbg.replay(data=data, bw=bw, save_name=save_name,
+                                   twinning_method='map')
+
+    # Replay the same scenario step by step (a null forcing insulin input forces the simulation loop)
+    np.random.seed(1)
+    step_results = rbg.replay(data=data, bw=bw, save_name=save_name,
+                              twinning_method='map',
+                              enable_forcing_ip=True, forcing_ip_handler=no_ip_handler)
+
+    # The two replays match, CGM noise included
+    for field in ['glucose', 'cgm', 'x_end']:
+        assert np.allclose(open_loop_results[field]['realizations'], step_results[field]['realizations'])
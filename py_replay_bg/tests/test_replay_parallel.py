@@ -0,0 +1,45 @@
+import os
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.py_replay_bg import ReplayBG
+
+
+def test_replay_parallel():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw
+    bw = float(patient_info.bw.values[p])
+
+    # Instantiate ReplayBG
+    rbg = ReplayBG(blueprint=blueprint, save_folder=save_folder,
+                   yts=5, exercise=False,
+                   seed=1,
+                   verbose=False, plot_mode=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1)
+
+    # Replay a closed-loop scenario serially, and with a different number of worker processes (no global seed is
+    # needed, since all the random streams are derived from the seed of rbg)
+    results = []
+    for n_processes in [None, 1, 3]:
+        results.append(rbg.replay(data=data, bw=bw, save_name=save_name,
+                                  twinning_method='mcmc', n_replay=10,
+                                  bolus_source='dss', enable_correction_boluses=True,
+                                  parallelize=n_processes is not None, n_processes=n_processes))
+    rbg.close()
+
+    # The replays are identical, realization by realization
+    for field in ['glucose', 'cgm', 'x_end', 'insulin_bolus', 'correction_bolus']:
+        assert np.array_equal(results[0][field]['realizations'], results[1][field]['realizations'])
+        assert np.array_equal(results[1][field]['realizations'], results[2][field]['realizations'])
+    assert len(results[2]['sensors']) == 10
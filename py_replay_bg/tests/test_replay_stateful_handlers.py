@@ -0,0 +1,69 @@
+import os
+import numpy as np
+
+from numba import njit
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.py_replay_bg import ReplayBG
+
+
+@njit
+def compiled_basal_handler(glucose, meal_announcement, hypotreatments, bolus, basal, time, time_index, state):
+    # A basal rate that depends on the number of calls, counted in the state
+    state[0] += 1
+    return 0.02 if state[0] <= 300 else 0.005
+
+
+# The same handler, run in the Python replay loop
+def basal_handler(glucose, meal_announcement, meal_type, hypotreatments, bolus, basal, time, time_index, dss):
+    return compiled_basal_handler.py_func(glucose, meal_announcement, hypotreatments, bolus, basal, time,
+                                          time_index, dss.basal_handler_params), dss
+
+
+def test_replay_stateful_handlers():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw
+    bw = float(patient_info.bw.values[p])
+
+    # Instantiate ReplayBG
+    rbg = ReplayBG(blueprint=blueprint, save_folder=save_folder,
+                   yts=5, exercise=False,
+                   seed=1,
+                   verbose=False, plot_mode=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1)
+
+    # Replay the same scenario serially, in parallel, in lockstep, and in nopython mode
+    basal_handler_params = np.zeros(1)
+    results = []
+    for handler, options in [(basal_handler, dict()),
+                             (basal_handler, dict(parallelize=True, n_processes=2)),
+                             (basal_handler, dict(batched=True)),
+                             (compiled_basal_handler, dict())]:
+        results.append(rbg.replay(data=data, bw=bw, save_name=save_name,
+                                  twinning_method='mcmc', n_replay=10,
+                                  basal_source='dss', basal_handler=handler,
+                                  basal_handler_params=basal_handler_params,
+                                  **options))
+    rbg.close()
+
+    # Each realization starts from its own copy of the handler state, and the given one is not modified
+    assert np.all(basal_handler_params == 0)
+    for replay_results in results:
+        total_basal = np.sum(replay_results['insulin_basal']['realizations'], axis=1)
+        assert np.allclose(total_basal, total_basal[0])
+
+    # The replays match
+    for field in ['glucose', 'cgm', 'insulin_basal']:
+        for replay_results in results[1:]:
+            assert np.allclose(replay_results[field]['realizations'], results[0][field]['realizations'])
@@ -0,0 +1,51 @@
+import numpy as np
+import emcee
+
+from py_replay_bg.twinning.surrogate import QuadraticSurrogate, SurrogateMove
+
+
+def log_prob(coords, lp_min=None):
+    # Non-gaussian target (the quadratic surrogate cannot be exact): x ~ N(0, 1), p(y) ∝ exp(-y^4 / 4)
+    coords = np.atleast_2d(coords)
+    return - 0.5 * coords[:, 0] ** 2 - 0.25 * coords[:, 1] ** 4
+
+
+def test_surrogate():
+
+    # The polynomial is exact on quadratic functions
+    rng = np.random.default_rng(1)
+    thetas = rng.normal(size=(200, 3))
+    surrogate = QuadraticSurrogate(3)
+    surrogate.update(thetas, 1 + thetas[:, 0] - 2 * thetas[:, 1] * thetas[:, 2] - thetas[:, 2] ** 2)
+    surrogate.fit()
+    assert surrogate.is_fitted
+    best = surrogate.log_probs >= np.median(surrogate.log_probs)
+    assert np.allclose(surrogate.predict(thetas[best]), surrogate.log_probs[best])
+
+    # Two-stage delayed acceptance targets the actual posterior
+    n_walkers = 20
+    surrogate = QuadraticSurrogate(2)
+    moves = [SurrogateMove(emcee.moves.DEMove(), log_prob, (), surrogate),
+             SurrogateMove(emcee.moves.DESnookerMove(), log_prob, (), surrogate)]
+    sampler = emcee.EnsembleSampler(n_walkers, 2, log_prob, moves=[(moves[0], 0.5), (moves[1], 0.5)],
+                                    vectorize=True)
+    sampler._random.seed(1)
+    state = sampler.run_mcmc(rng.normal(size=(n_walkers, 2)), 200)
+
+    for move in moves:
+        move.train = False
+        move.reset_stats()
+    surrogate.fit()
+    sampler.reset()
+    sampler.run_mcmc(state, 5000)
+
+    n_proposals = sum(move.n_proposals for move in moves)
+    n_evaluations = sum(move.n_evaluations for move in moves)
+    assert 0 < n_evaluations < n_proposals
+
+    y = np.linspace(-5, 5, 10001)
+    p_y = np.exp(- 0.25 * y ** 4)
+    chain = sampler.get_chain(flat=True)
+    assert abs(chain[:, 0].mean()) < 0.1
+    assert abs(chain[:, 0].var() - 1) < 0.1
+    assert abs((chain[:, 1] ** 2).mean() - np.sum(y ** 2 * p_y) / np.sum(p_y)) < 0.05
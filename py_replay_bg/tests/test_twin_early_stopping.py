@@ -0,0 +1,65 @@
+import os
+import pickle
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.environment import Environment
+from py_replay_bg.model.t1d_model_single_meal import T1DModelSingleMeal
+from py_replay_bg.data import ReplayBGData
+from py_replay_bg.twinning.mcmc import MCMC
+
+
+class GaussianModel(T1DModelSingleMeal):
+    # The model of the test data, with a gaussian posterior around its start guess (which mixes much faster)
+    def log_posterior_ensemble(self, thetas, rbg_data):
+        mu = np.asarray(self.start_guess)
+        sigma = np.where(mu != 0, 0.05 * np.abs(mu), 1.0)
+        return -0.5 * np.sum(((thetas - mu) / sigma) ** 2, axis=1)
+
+
+def test_twin_early_stopping():
+
+    # Set other parameters for twinning
+    blueprint = 'single-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw and u2ss
+    bw = float(patient_info.bw.values[p])
+    u2ss = float(patient_info.u2ss.values[p])
+
+    environment = Environment(blueprint=blueprint, save_folder=save_folder,
+                              yts=5, exercise=False,
+                              seed=1,
+                              plot_mode=False, verbose=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1) + '_early_stopping'
+
+    model = GaussianModel(data=data, bw=bw, u2ss=u2ss, x0=None, previous_data_name=None, twinning_method='mcmc',
+                          environment=environment, is_twin=True)
+    rbg_data = ReplayBGData(data=data, model=model, environment=environment)
+
+    # Run a production chain far longer than needed
+    n_steps = 50000
+    twinner = MCMC(n_steps=n_steps, n_burn_in=500, n_walkers=4, callback_ncheck=500, vectorize=True,
+                   early_stopping=True, tau_factor=50)
+    twinner.twin(rbg_data=rbg_data, model=model, save_name=save_name, environment=environment)
+
+    with open(os.path.join(save_folder, 'results', 'mcmc', 'mcmc_' + save_name + '.pkl'), 'rb') as file:
+        twinning_results = pickle.load(file)
+    convergence = twinning_results['convergence']
+
+    # The chain is stopped as soon as its retained half is long enough with respect to its autocorrelation time, and
+    # holds enough independent samples for the 1000 posterior draws
+    assert convergence['stopped_by'] == 'convergence'
+    assert convergence['stopped_by_convergence']
+    assert convergence['n_steps'] < n_steps
+    assert convergence['n_steps'] % 500 == 0
+    assert np.all(np.isfinite(convergence['tau']))
+    assert convergence['n_steps'] / 2 > convergence['tau_factor'] * np.max(convergence['tau'])
+    assert convergence['ess'] >= 1000
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.environment import Environment
+from py_replay_bg.model.t1d_model_multi_meal import T1DModelMultiMeal
+from py_replay_bg.data import ReplayBGData
+from py_replay_bg.twinning.map import MAP
+
+
+def test_twin_map_thread():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw and u2ss
+    bw = float(patient_info.bw.values[p])
+    u2ss = float(patient_info.u2ss.values[p])
+
+    environment = Environment(blueprint=blueprint, save_folder=save_folder,
+                              yts=5, exercise=False,
+                              seed=1,
+                              plot_mode=False, verbose=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1) + '_thread'
+
+    model = T1DModelMultiMeal(data=data, bw=bw, u2ss=u2ss, x0=None, previous_data_name=None, twinning_method='map',
+                              environment=environment, is_twin=True)
+    rbg_data = ReplayBGData(data=data, model=model, environment=environment)
+
+    # Run the restarts serially and in threads (short ones, the restarts being the same in both cases)
+    draws = []
+    for parallelize in [False, True]:
+        twinner = MAP(max_iter=2, parallelize=parallelize, n_processes=2, parallel_backend='thread')
+        draws.append(twinner.twin(rbg_data=rbg_data, model=model, save_name=save_name, environment=environment))
+
+    # The threads find the same best restart
+    assert draws[1].keys() == draws[0].keys()
+    for parameter in draws[0]:
+        assert draws[1][parameter] == draws[0][parameter]
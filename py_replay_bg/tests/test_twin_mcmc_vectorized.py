@@ -0,0 +1,50 @@
+import os
+import pickle
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.environment import Environment
+from py_replay_bg.model.t1d_model_single_meal import T1DModelSingleMeal
+from py_replay_bg.data import ReplayBGData
+from py_replay_bg.twinning.mcmc import MCMC
+
+
+def test_twin_mcmc_vectorized():
+
+    # Set other parameters for twinning
+    blueprint = 'single-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw and u2ss
+    bw = float(patient_info.bw.values[p])
+    u2ss = float(patient_info.u2ss.values[p])
+
+    environment = Environment(blueprint=blueprint, save_folder=save_folder,
+                              yts=5, exercise=False,
+                              seed=1,
+                              plot_mode=False, verbose=False)
+
+    # Load data
+    data = load_test_data(day=1)
+
+    model = T1DModelSingleMeal(data=data, bw=bw, u2ss=u2ss, x0=None, previous_data_name=None, twinning_method='mcmc',
+                               environment=environment, is_twin=True)
+    rbg_data = ReplayBGData(data=data, model=model, environment=environment)
+
+    # Run the same short chain evaluating the walkers one at a time and all at once
+    samplers = []
+    for vectorize in [False, True]:
+        save_name = 'data_day_' + str(1) + ('_vectorized' if vectorize else '_per_walker')
+        twinner = MCMC(n_steps=200, n_burn_in=100, n_walkers=4, save_chains=True, vectorize=vectorize)
+        twinner.twin(rbg_data=rbg_data, model=model, save_name=save_name, environment=environment)
+        with open(os.path.join(save_folder, 'results', 'mcmc', 'mcmc_' + save_name + '.pkl'), 'rb') as file:
+            samplers.append(pickle.load(file)['sampler'])
+
+    # The walkers get the same log posteriors, hence they make the same moves
+    assert np.all(np.isfinite(samplers[0].get_log_prob()))
+    assert np.allclose(samplers[1].get_log_prob(), samplers[0].get_log_prob())
+    assert np.allclose(samplers[1].get_chain(), samplers[0].get_chain())
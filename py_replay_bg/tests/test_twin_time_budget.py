@@ -0,0 +1,63 @@
+import os
+import time
+import pickle
+import numpy as np
+
+from py_replay_bg.tests import load_test_data, load_patient_info
+
+from py_replay_bg.py_replay_bg import ReplayBG
+from py_replay_bg.twinning.map import run_map
+
+
+def slow_loss(x):
+    time.sleep(0.01)
+    return np.sum((x - 1) ** 2)
+
+
+def test_twin_time_budget():
+
+    # Set other parameters for twinning
+    blueprint = 'multi-meal'
+    save_folder = os.path.join(os.path.abspath(''))
+
+    # load patient_info
+    patient_info = load_patient_info()
+    p = np.where(patient_info['patient'] == 1)[0][0]
+    # Set bw and u2ss
+    bw = float(patient_info.bw.values[p])
+    u2ss = float(patient_info.u2ss.values[p])
+
+    # Instantiate ReplayBG
+    rbg = ReplayBG(blueprint=blueprint, save_folder=save_folder,
+                   yts=5, exercise=False,
+                   seed=1,
+                   verbose=False, plot_mode=False)
+
+    # Load data and set save_name
+    data = load_test_data(day=1)
+    save_name = 'data_day_' + str(1) + '_time_budget'
+
+    for twinning_method in ['map', 'mcmc']:
+
+        # Run a twinning procedure far longer than its time budget
+        rbg.twin(data=data, bw=bw, save_name=save_name,
+                 twinning_method=twinning_method,
+                 vectorize=True,
+                 time_budget=10,
+                 u2ss=u2ss)
+
+        # The best-so-far results are saved anyway, together with their convergence metadata
+        with open(os.path.join(save_folder, 'results', twinning_method,
+                               twinning_method + '_' + save_name + '.pkl'), 'rb') as file:
+            twinning_results = pickle.load(file)
+
+        assert twinning_results['convergence']['stopped_by_time_budget']
+        assert twinning_results['convergence']['time_budget'] == 10
+        for draws in twinning_results['draws'].values():
+            samples = draws['samples_1'] if twinning_method == 'mcmc' else draws
+            assert np.all(np.isfinite(samples))
+
+    # The restarts report whether they were actually cut short by the deadline
+    assert not run_map(np.zeros(2), slow_loss, (), dict(), time.time() + 600)['stopped_by_time_budget']
+    assert run_map(np.zeros(2), slow_loss, (), dict(), time.time() + 0.05)['stopped_by_time_budget']
+    assert run_map(np.zeros(2), slow_loss, (), dict(), time.time() - 1) is None
@@ -0,0 +1,41 @@
+import numpy as np
+
+from py_replay_bg.twinning.worker_pool import WorkerPool, SharedArrays, evaluate
+
+
+def weighted_sum(theta, weights, offset, steps):
+    return float(np.dot(theta, weights) + offset + steps.sum())
+
+
+def is_read_only(theta, weights, offset, steps):
+    return not (weights.flags.writeable or steps.flags.writeable)
+
+
+def test_worker_pool():
+
+    thetas = [np.arange(3) + i for i in range(10)]
+
+    # The arrays are placed in shared memory, the other arguments are pickled as they are
+    args = (np.array([1.0, -1.0, 2.0]), 5.0, np.arange(7, dtype=np.int64))
+    shared_args = SharedArrays(args)
+    try:
+        attached = shared_args.attach()
+        assert attached[1] == 5.0
+        assert all(np.array_equal(a, b) and a.dtype == b.dtype for a, b in zip(attached[::2], args[::2]))
+    finally:
+        del attached
+        shared_args.unlink()
+
+    worker_pool = WorkerPool(n_processes=2)
+    try:
+        # The function and its arguments are sent once, then only the parameter vectors are mapped
+        for weights, offset, shared_memory in [(np.ones(3), 0.0, False), (args[0], args[1], True)]:
+            worker_pool.broadcast(weighted_sum, (weights, offset, args[2]), shared_memory=shared_memory)
+            results = worker_pool.map(evaluate, thetas)
+            assert results == [weighted_sum(theta, weights, offset, args[2]) for theta in thetas]
+
+        # The workers get read-only views of the shared arrays
+        worker_pool.broadcast(is_read_only, args, shared_memory=True)
+        assert all(worker_pool.map(evaluate, thetas))
+    finally:
+        worker_pool.close()
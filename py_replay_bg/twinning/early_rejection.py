@@ -0,0 +1,147 @@
+from typing import Callable
+
+import numpy as np
+
+from emcee.moves import RedBlueMove
+from emcee.state import State
+
+
+class EarlyRejectionMove(RedBlueMove):
+    """
+    An emcee red-blue move that wraps another red-blue move (e.g., `DEMove` or `DESnookerMove`) and evaluates its
+    proposals with early rejection (i.e., delayed acceptance).
+
+    The Metropolis uniform draw u of each walker is made before its proposal is evaluated, so that the acceptance test
+    `f + log_prob(q) - log_prob(x) > log(u)` becomes the threshold `log_prob(q) > log_prob(x) + log(u) - f`. The
+    thresholds are passed to the log probability function, which can then stop the simulation of a proposal as soon as
+    it is known to be rejected. The resulting chain is exactly the one of the wrapped move.
+
+    ...
+    Attributes
+    ----------
+    move: RedBlueMove
+        The wrapped move, used to generate the proposals.
+    log_prob_fn: Callable
+        The function `log_prob_fn(coords, *args, lp_min=lp_min)` that returns the log probability of each row of coords,
+        or any value not greater than the corresponding lp_min if that row is rejected.
+    args: tuple
+        The additional arguments of `log_prob_fn`.
+
+    Methods
+    -------
+    setup(coords)
+        Runs the move-specific setup of the wrapped move.
+    get_proposal(s, c, random)
+        Generates the proposals of the wrapped move.
+    propose(model, state)
+        Generates the proposals and evaluates them with early rejection.
+    """
+
+    def __init__(self,
+                 move: RedBlueMove,
+                 log_prob_fn: Callable,
+                 args: tuple = ()):
+        """
+        Constructs all the necessary attributes for the EarlyRejectionMove object.
+
+        Parameters
+        ----------
+        move: RedBlueMove
+            The wrapped move, used to generate the proposals.
+        log_prob_fn: Callable
+            The function `log_prob_fn(coords, *args, lp_min=lp_min)` that returns the log probability of each row of
+            coords, or any value not greater than the corresponding lp_min if that row is rejected.
+        args: tuple, optional, default : ()
+            The additional arguments of `log_prob_fn`.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        super().__init__(nsplits=move.nsplits, randomize_split=move.randomize_split,
+                         live_dangerously=move.live_dangerously)
+        self.move = move
+        self.log_prob_fn = log_prob_fn
+        self.args = args
+
+    def setup(self, coords):
+        self.move.setup(coords)
+
+    def get_proposal(self, s, c, random):
+        return self.move.get_proposal(s, c, random)
+
+    def propose(self, model, state):
+        """
+        Generates the proposals and evaluates them with early rejection. Mirrors `RedBlueMove.propose`, except that the
+        uniform draws are made before the log probability of the proposals is computed.
+
+        Parameters
+        ----------
+        model: emcee.model.Model
+            The emcee model (used for its random number generator only).
+        state: emcee.State
+            The current state of the walkers.
+
+        Returns
+        -------
+        state: emcee.State
+            The new state of the walkers.
+        accepted: np.ndarray
+            A boolean array flagging the walkers whose proposal has been accepted.
+
+        Raises
+        ------
+        RuntimeError
+            If the number of walkers is smaller than twice the number of dimensions (see `RedBlueMove`).
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        n_walkers, n_dim = state.coords.shape
+        if n_walkers < 2 * n_dim and not self.live_dangerously:
+            raise RuntimeError("It is unadvisable to use a red-blue move with fewer walkers than twice the number of "
+                               "dimensions.")
+
+        self.setup(state.coords)
+
+        # Split the ensemble and update each sub-ensemble using the others as complementary ensemble
+        accepted = np.zeros(n_walkers, dtype=bool)
+        all_inds = np.arange(n_walkers)
+        inds = all_inds % self.nsplits
+        if self.randomize_split:
+            model.random.shuffle(inds)
+        for split in range(self.nsplits):
+            S1 = inds == split
+
+            sets = [state.coords[inds == j] for j in range(self.nsplits)]
+            s = sets[split]
+            c = sets[:split] + sets[split + 1:]
+
+            q, factors = self.get_proposal(s, c, model.random)
+
+            # Draw the acceptance thresholds first, then evaluate the proposals against them
+            lp_min = state.log_prob[all_inds[S1]] + np.log(model.random.rand(q.shape[0])) - factors
+            new_log_probs = np.asarray(self.log_prob_fn(q, *self.args, lp_min=lp_min), dtype=float)
+            accepted[all_inds[S1]] = new_log_probs > lp_min
+
+            new_state = State(q, log_prob=new_log_probs)
+            state = self.update(state, new_state, accepted, S1)
+
+        return state, accepted
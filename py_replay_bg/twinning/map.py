@@ -1,11 +1,12 @@
 import os
+import time
 import warnings
 import pickle
 import numpy as np
 
 from typing import Dict, Callable
+from concurrent.futures import ThreadPoolExecutor
 
-from multiprocessing import Pool
 from tqdm import tqdm
 from scipy.optimize import minimize
 
@@ -13,10 +14,12 @@ from py_replay_bg.data import ReplayBGData
 from py_replay_bg.model.t1d_model_single_meal import T1DModelSingleMeal
 from py_replay_bg.model.t1d_model_multi_meal import T1DModelMultiMeal
 
-from py_replay_bg.environment import Environment
+from py_replay_bg.environment import Environment, WALKER_INIT
 
 from py_replay_bg.model.logpriors_t1d import sample_from_prior, physical_to_theta
 
+from py_replay_bg.twinning.worker_pool import WorkerPool, evaluate
+
 # Suppress all RuntimeWarnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
@@ -33,6 +36,17 @@ class MAP:
         A boolean that specifies whether to parallelize the twinning process.
     n_processes : int
         The number of processes to be spawn if `parallelize` is `True`. If None, the number of CPU cores is used.
+    parallel_backend : str, {'process', 'thread'}
+        Whether to run the restarts in worker processes or in threads of the current process if `parallelize` is
+        `True`.
+    worker_pool : WorkerPool
+        The persistent pool of worker processes to use if `parallelize` is `True`. If None, a pool is started (and
+        terminated) at each twinning procedure.
+    shared_memory : bool
+        A boolean that specifies whether to place the data arrays sent to the worker processes in shared memory,
+        instead of copying them to each worker.
+    time_budget : float
+        The wall-clock time budget of the restarts [s]. If None, the restarts are not time-bounded.
 
     Methods
     -------
@@ -44,6 +58,10 @@ class MAP:
                  max_iter: int = 100000,
                  parallelize: bool = False,
                  n_processes: int | None = None,
+                 parallel_backend: str = 'process',
+                 worker_pool: WorkerPool | None = None,
+                 shared_memory: bool = False,
+                 time_budget: float | None = None,
                  ):
         """
         Constructs all the necessary attributes for the MCMC object.
@@ -56,6 +74,23 @@ class MAP:
             A boolean that specifies whether to parallelize the twinning process.
         n_processes : int, optional, default : None
             The number of processes to be spawn if `parallelize` is `True`. If None, the number of CPU cores is used.
+        parallel_backend : str, {'process', 'thread'}, optional, default : 'process'
+            Whether to run the restarts in worker processes or, since the compiled log posterior releases the GIL, in
+            `n_processes` threads of the current process (which avoids spawning processes and copying the data to them)
+            if `parallelize` is `True`. `worker_pool` and `shared_memory` are used only by the 'process' backend.
+        worker_pool : WorkerPool, optional, default : None
+            The persistent pool of worker processes to use if `parallelize` is `True` (`n_processes` is then ignored).
+            The negative log posterior and the data are sent to its workers once, and then only the start guesses of
+            the restarts. If None, a pool of `n_processes` workers is started (and terminated) at each twinning
+            procedure.
+        shared_memory : bool, optional, default : False
+            A boolean that specifies whether to place the data arrays sent to the worker processes in shared memory,
+            so that the workers attach to them as read-only views instead of holding their own copies (i.e., memory
+            use does not grow with `n_processes`). Used only if `parallelize` is `True`.
+        time_budget : float, optional, default : None
+            The wall-clock time budget of the restarts [s]. Once it is over, the running optimizations stop cleanly
+            at their current best point, the remaining restarts are skipped, and the best solution found so far is
+            kept. If None, the restarts are not time-bounded.
 
         Returns
         -------
@@ -86,6 +121,12 @@ class MAP:
         # Parallelization options
         self.parallelize = parallelize
         self.n_processes = n_processes
+        self.parallel_backend = parallel_backend
+        self.worker_pool = worker_pool
+        self.shared_memory = shared_memory
+
+        # Wall-clock time budget of the restarts
+        self.time_budget = time_budget
 
     def twin(self,
                  rbg_data: ReplayBGData,
@@ -148,17 +189,12 @@ class MAP:
                 model.x0 = model.x0[:17] + [0] * 9 + model.x0[17:]
 
         # Set the initial positions of the walkers by sampling from the prior
-        rng = np.random.default_rng(environment.seed)
+        rng = environment.random_stream(WALKER_INIT)
         start = [sg]
         for i in range(self.n_rerun - 1):
             params = sample_from_prior(model.model_parameters.VG, rng)
             start.append(physical_to_theta(params, model))
 
-        # Set the pooler
-        pool = None
-        if self.parallelize:
-            pool = Pool(processes=self.n_processes)
-
         # Set up the options
         options = dict()
         options['maxiter'] = self.max_iter
@@ -166,12 +202,23 @@ class MAP:
         options['disp'] = False
 
         # Select the function to minimize
-        neg_log_posterior_func = model.neg_log_posterior_extended if model.extended else model.neg_log_posterior
+        neg_log_posterior_func, args = model.compiled_log_posterior(rbg_data, negative=True)
+
+        # Set the pooler, and send the function to minimize and its arguments to the workers once, so that only the
+        # start guesses are sent with each restart
+        pool = None
+        if self.parallelize and self.parallel_backend == 'process':
+            pool = WorkerPool(self.n_processes) if self.worker_pool is None else self.worker_pool
+            pool.broadcast(neg_log_posterior_func, args, shared_memory=self.shared_memory)
+
+        # Set the deadline of the restarts (if time-bounded)
+        start_time = time.time()
+        deadline = None if self.time_budget is None else start_time + self.time_budget
 
         # Initialize results
         results = []
 
-        if pool is None:
+        if not self.parallelize:
 
             if environment.verbose:
                 iterator = tqdm(range(self.n_rerun))
@@ -183,7 +230,9 @@ class MAP:
             best = -1
 
             for r in iterator:
-                result = run_map(start[r], neg_log_posterior_func, rbg_data, options)
+                result = run_map(start[r], neg_log_posterior_func, args, options, deadline)
+                if result is None:
+                    break
                 results.append(result)
                 if best == -1 or result['fun'] < results[best]['fun']:
                     best = r
@@ -191,20 +240,49 @@ class MAP:
                     iterator.set_description("Min loss %f" % results[best]['fun'])
 
         else:
-            # Prepare input arguments as tuples for starmap
-            args = [(start[r], neg_log_posterior_func, rbg_data, options) for r in range(self.n_rerun)]
-
             # Initialize best
             best = -1
 
-            # Get results (verbosity not allowed for the moment)
-            results = pool.starmap(run_map, args)
+            # Get results (verbosity not allowed for the moment), dropping the restarts skipped because of the time
+            # budget
+            if pool is None:
+                # Threads share the function to minimize and its arguments
+                with ThreadPoolExecutor(max_workers=self.n_processes) as executor:
+                    results = list(executor.map(lambda s: run_map(s, neg_log_posterior_func, args, options, deadline),
+                                                start))
+            else:
+                # Prepare input arguments as tuples for starmap
+                starmap_args = [(start[r], evaluate, (), options, deadline) for r in range(self.n_rerun)]
+                results = pool.starmap(run_map, starmap_args)
+
+                # Terminate the workers if the pool is not a persistent one
+                if self.worker_pool is None:
+                    pool.close()
+
+            results = [result for result in results if result is not None]
 
             # Get best
             for r, result in enumerate(results):
                 if best == -1 or result['fun'] < results[best]['fun']:
                     best = r
 
+        # The time budget stopped the twinning if any restart was skipped or cut short because of it
+        stopped_by_time_budget = (len(results) < self.n_rerun
+                                  or any(result['stopped_by_time_budget'] for result in results))
+
+        # If no restart could be run within the time budget, keep the initial guess
+        if not results:
+            results = [dict(fun=neg_log_posterior_func(np.asarray(sg, dtype=float), *args), x=np.asarray(sg))]
+            best = 0
+
+        # Collect the convergence metadata
+        convergence = dict()
+        convergence['n_rerun'] = len(results)
+        convergence['fun'] = results[best]['fun']
+        convergence['elapsed_time'] = time.time() - start_time
+        convergence['time_budget'] = self.time_budget
+        convergence['stopped_by_time_budget'] = stopped_by_time_budget
+
         draws = dict()
         for up in range(n_dim):
             draws[model.unknown_parameters[up]] = results[best]['x'][up]
@@ -236,6 +314,7 @@ class MAP:
         twinning_results = dict()
         twinning_results['draws'] = draws
         twinning_results['u2ss'] = model.model_parameters.u2ss
+        twinning_results['convergence'] = convergence
 
         saved_file = os.path.join(environment.replay_bg_path, 'results', 'map',
                                   'map_' + save_name + '.pkl')
@@ -251,9 +330,10 @@ class MAP:
 
 def run_map(start: np.ndarray,
             neg_log_posterior_func: Callable,
-            rbg_data: ReplayBGData,
-            options: Dict
-            ) -> Dict:
+            args: tuple,
+            options: Dict,
+            deadline: float | None = None
+            ) -> Dict | None:
     """
     Utility function used to run MAP twinning.
 
@@ -263,15 +343,19 @@ def run_map(start: np.ndarray,
         An object containing the data to be used during the twinning procedure.
     neg_log_posterior_func: Callable
         The function to minimize, i.e., the neg-loglikelihood.
-    rbg_data: ReplayBGData
-        An object containing the data to be used during the twinning procedure.
+    args: tuple
+        The extra arguments to pass to the function to minimize after the current guess.
     options : Dict
         A dictionary with the options necessary to the minimization function.
+    deadline : float, optional, default : None
+        The time (as given by time.time()) after which the minimization is stopped at its current best point. If it
+        is already over, the minimization is not run at all.
 
     Returns
     -------
     ret: dict
-        A dictionary containing the results of the MAP twinning and the final value of the objective function.
+        A dictionary containing the results of the MAP twinning, the final value of the objective function, and
+        whether the minimization was stopped by the deadline, or None if the deadline was already over.
 
     Raises
     ------
@@ -285,8 +369,21 @@ def run_map(start: np.ndarray,
     --------
     None
     """
-    result = minimize(neg_log_posterior_func, start, method='Powell', args=(rbg_data,), options=options)
+    stopped_by_time_budget = [False]
+    if deadline is None:
+        callback = None
+    else:
+        if time.time() > deadline:
+            return None
+
+        def callback(intermediate_result):
+            if time.time() > deadline:
+                stopped_by_time_budget[0] = True
+                raise StopIteration
+
+    result = minimize(neg_log_posterior_func, start, method='Powell', args=args, options=options, callback=callback)
     ret = dict()
     ret['fun'] = result.fun
     ret['x'] = result.x
+    ret['stopped_by_time_budget'] = stopped_by_time_budget[0]
     return ret
@@ -1,4 +1,5 @@
 import os
+import time
 
 import matplotlib.pyplot as plt
 from matplotlib import pylab
@@ -8,19 +9,23 @@ from typing import Dict
 import numpy as np
 import emcee
 
-from multiprocessing import Pool
-
 import pickle
 from tqdm import tqdm
 import copy
 
+from concurrent.futures import ThreadPoolExecutor
+
 from py_replay_bg.data import ReplayBGData
 from py_replay_bg.model.t1d_model_single_meal import T1DModelSingleMeal
 from py_replay_bg.model.t1d_model_multi_meal import T1DModelMultiMeal
 
 from py_replay_bg.model.logpriors_t1d import sample_from_prior, physical_to_theta
 
-from py_replay_bg.environment import Environment
+from py_replay_bg.environment import Environment, WALKER_INIT, MCMC_MOVES, POSTERIOR_EXTRACTION
+
+from py_replay_bg.twinning.early_rejection import EarlyRejectionMove
+from py_replay_bg.twinning.surrogate import QuadraticSurrogate, SurrogateMove
+from py_replay_bg.twinning.worker_pool import WorkerPool, evaluate
 
 
 class MCMC:
@@ -42,8 +47,32 @@ class MCMC:
         Whether to parallelize the twinning procedure.
     n_processes: int
         Number of parallel processes to run.
+    parallel_backend: str, {'process', 'thread'}
+        Whether to evaluate the walkers in worker processes or in threads of the current process if `parallelize`.
+    worker_pool: WorkerPool
+        The persistent pool of worker processes to use if `parallelize`. If None, a pool is started (and terminated)
+        at each twinning procedure.
+    shared_memory: bool
+        Whether to place the data arrays sent to the worker processes in shared memory, instead of copying them to
+        each worker.
     n_walkers: int
         Number of walkers to use during the MCMC procedure.
+    vectorize: bool
+        Whether to evaluate the log posterior of all the walkers at once in a single compiled call, multi-threaded
+        across walkers.
+    early_rejection: bool
+        Whether to draw the Metropolis acceptance threshold of each proposal before evaluating it, so that the
+        simulation of the proposals that are going to be rejected is stopped early.
+    surrogate: bool
+        Whether to screen the proposals with a quadratic emulator of the log posterior before evaluating them
+        (two-stage delayed acceptance).
+    time_budget: float
+        The wall-clock time budget of the sampling [s]. If None, the sampling is not time-bounded.
+    early_stopping: bool
+        Whether to stop the production chain as soon as it is converged according to its autocorrelation time.
+    tau_factor: float
+        The multiple of the autocorrelation time the retained half of the production chain must be longer than to be
+        converged.
 
     Methods
     -------
@@ -58,7 +87,16 @@ class MCMC:
                  n_burn_in: int = 10000,
                  parallelize: bool = True,
                  n_processes: None | int = None,
-                 n_walkers: int = 50
+                 parallel_backend: str = 'process',
+                 worker_pool: WorkerPool | None = None,
+                 shared_memory: bool = False,
+                 n_walkers: int = 50,
+                 vectorize: bool = False,
+                 early_rejection: bool = False,
+                 surrogate: bool = False,
+                 time_budget: float | None = None,
+                 early_stopping: bool = False,
+                 tau_factor: float = 50
                  ):
         """
         Constructs all the necessary attributes for the MCMC object.
@@ -77,8 +115,48 @@ class MCMC:
             Whether to parallelize the twinning procedure.
         n_processes: int
             Number of parallel processes to run.
+        parallel_backend: str, {'process', 'thread'}, optional, default : 'process'
+            Whether to evaluate the walkers in worker processes or, since the compiled log posterior releases the GIL,
+            in `n_processes` threads of the current process (which avoids spawning processes and copying the data to
+            them) if `parallelize`. `worker_pool` and `shared_memory` are used only by the 'process' backend.
+        worker_pool: WorkerPool, optional, default : None
+            The persistent pool of worker processes to use if `parallelize` (`n_processes` is then ignored). The log
+            posterior and the data are sent to its workers once, and then only the walker positions. If None, a pool
+            of `n_processes` workers is started (and terminated) at each twinning procedure.
+        shared_memory: bool, optional, default : False
+            Whether to place the data arrays sent to the worker processes in shared memory, so that the workers attach
+            to them as read-only views instead of holding their own copies (i.e., memory use does not grow with
+            `n_processes`). Used only if `parallelize`.
         n_walkers: int
             Number of walkers to use during the MCMC procedure.
+        vectorize: bool, optional, default : False
+            Whether to evaluate the log posterior of all the walkers at once in a single compiled call, multi-threaded
+            across walkers. If True, `parallelize` and `n_processes` are ignored.
+        early_rejection: bool, optional, default : False
+            Whether to draw the Metropolis acceptance threshold of each proposal before evaluating it, so that the
+            simulation of the proposals that are going to be rejected is stopped as soon as their residuals exceed it
+            (see `EarlyRejectionMove`). The resulting chain is statistically the same. If True, the walkers are
+            evaluated as with `vectorize`, and `parallelize` and `n_processes` are ignored.
+        surrogate: bool, optional, default : False
+            Whether to screen the proposals with a quadratic emulator of the log posterior, so that only the promising
+            ones are simulated (two-stage delayed acceptance, see `SurrogateMove`). The emulator is trained on the
+            proposals evaluated during burn-in and kept fixed during the production chain, whose target is thus the
+            actual posterior. The rejection threshold of the simulated proposals is used as in `early_rejection`. If
+            True, the walkers are evaluated as with `vectorize`, and `parallelize` and `n_processes` are ignored.
+        time_budget: float, optional, default : None
+            The wall-clock time budget of the sampling [s]. The burn-in chain is given its share of the budget (i.e.,
+            proportional to `n_burn_in`) and the production chain the remaining time: each chain stops cleanly as
+            soon as its time is over, and the samples are extracted from the production steps run so far. If None,
+            the sampling is not time-bounded.
+        early_stopping: bool, optional, default : False
+            Whether to check the integrated autocorrelation time tau of the production chain every `callback_ncheck`
+            steps, and stop it as soon as its retained half (i.e., the one the posterior draws are extracted from,
+            on which tau is estimated) is longer than `tau_factor` times tau and holds enough independent samples
+            (i.e., an effective sample size of at least 1000) for the posterior draws. Since the walkers of the
+            ensemble are not independent, the effective sample size counts one independent walker per parameter.
+        tau_factor: float, optional, default : 50
+            The multiple of the autocorrelation time the retained half of the production chain must be longer than to
+            be converged (only used if `early_stopping` is True).
 
         Returns
         -------
@@ -115,6 +193,25 @@ class MCMC:
         # Parallelization options
         self.parallelize = parallelize
         self.n_processes = n_processes
+        self.parallel_backend = parallel_backend
+        self.worker_pool = worker_pool
+        self.shared_memory = shared_memory
+
+        # Evaluate the whole ensemble at once?
+        self.vectorize = vectorize
+
+        # Stop the simulation of the proposals that are going to be rejected?
+        self.early_rejection = early_rejection
+
+        # Screen the proposals with a surrogate of the log posterior?
+        self.surrogate = surrogate
+
+        # Wall-clock time budget of the sampling
+        self.time_budget = time_budget
+
+        # Stop the production chain as soon as it is converged?
+        self.early_stopping = early_stopping
+        self.tau_factor = tau_factor
 
     def twin(self,
              rbg_data: ReplayBGData,
@@ -171,54 +268,111 @@ class MCMC:
         if model.extended and model.x0 is not None:
                 model.x0 = model.x0[:17] + [0] * 9 + model.x0[17:]
 
-        # Set the initial positions of the walkers.
         # Set the initial positions of the walkers by sampling from the prior
-        rng = np.random.default_rng(environment.seed)
+        rng = environment.random_stream(WALKER_INIT)
         start = [sg]
         for i in range(n_walkers - 1):
             params = sample_from_prior(model.model_parameters.VG, rng)
             start.append(physical_to_theta(params, model))
 
         # Initialize the sampler
-        pool = None
-        if self.parallelize:
-            pool = Pool(processes=self.n_processes)
+        vectorize = self.vectorize or self.early_rejection or self.surrogate
+        if vectorize:
+            log_posterior_func, args = model.log_posterior_ensemble, (rbg_data,)
+        else:
+            log_posterior_func, args = model.compiled_log_posterior(rbg_data)
 
-        log_posterior_func = model.log_posterior_extended if model.extended else model.log_posterior
+        # Send the log posterior and its arguments to the workers once, so that only the walker positions are sent
+        # at each step
+        pool = None
+        if self.parallelize and not vectorize and self.parallel_backend == 'thread':
+            pool = ThreadPoolExecutor(max_workers=self.n_processes)
+        elif self.parallelize and not vectorize:
+            pool = WorkerPool(self.n_processes) if self.worker_pool is None else self.worker_pool
+            pool.broadcast(log_posterior_func, args, shared_memory=self.shared_memory)
+            log_posterior_func, args = evaluate, ()
+
+        moves = [
+            (emcee.moves.DEMove(sigma=1.0e-3), 0.2),
+            (emcee.moves.DESnookerMove(gammas=0.1), 0.8)
+        ]
+        surrogate_moves = []
+        if self.surrogate:
+            surrogate = QuadraticSurrogate(n_dim)
+            surrogate_moves = [SurrogateMove(move, log_posterior_func, args, surrogate) for move, _ in moves]
+            moves = [(move, weight) for move, (_, weight) in zip(surrogate_moves, moves)]
+        elif self.early_rejection:
+            moves = [(EarlyRejectionMove(move, log_posterior_func, args), weight) for move, weight in moves]
 
         sampler = emcee.EnsembleSampler(n_walkers, n_dim, log_posterior_func,
-                                        moves=[
-                                            (emcee.moves.DEMove(sigma=1.0e-3), 0.2),
-                                            (emcee.moves.DESnookerMove(gammas=0.1), 0.8)
-                                        ],
+                                        moves=moves,
                                         pool=pool,
-                                        args=[rbg_data])
+                                        args=args,
+                                        vectorize=vectorize)
+
+        # Draw the moves from their own random stream (instead of emcee's default, which is seeded from the global
+        # numpy random state)
+        moves_rng = np.random.RandomState(np.random.MT19937(environment.seed_sequence(MCMC_MOVES)))
+        sampler.random_state = moves_rng.get_state()
+
+        # Set the deadlines of the chains (if time-bounded)
+        start_time = time.time()
+        burn_in_deadline, deadline = None, None
+        if self.time_budget is not None:
+            burn_in_deadline = start_time + self.time_budget * self.n_burn_in / (self.n_burn_in + self.n_steps)
+            deadline = start_time + self.time_budget
 
         # Run the burn-in chain
-        sampler, state = self.__run_chain(
+        sampler, state, n_burn_in, burn_in_stopped_by = self.__run_chain(
             sampler=sampler,
             is_burn_in=True,
+            deadline=burn_in_deadline,
             state=start,
             rbg_data=rbg_data,
             environment=environment,
-            model=model
+            model=model,
+            surrogate_moves=surrogate_moves
         )
 
         # Run production chain
-        sampler, state = self.__run_chain(
+        sampler, state, n_steps, stopped_by = self.__run_chain(
             sampler=sampler,
             is_burn_in=False,
+            deadline=deadline,
             state=state,
             rbg_data=rbg_data,
             environment=environment,
-            model=model
+            model=model,
+            surrogate_moves=surrogate_moves
         )
 
-        # Extract the chain
-        tau = sampler.get_autocorr_time(quiet=True)
-        burnin = int(self.n_steps * 0.5)
-        thin = int(0.5 * np.min(tau))
+        # Terminate the workers if the pool is not a persistent one
+        if isinstance(pool, ThreadPoolExecutor):
+            pool.shutdown()
+        elif pool is not None and self.worker_pool is None:
+            pool.close()
+
+        # Collect the convergence metadata
+        convergence = dict()
+        convergence['n_burn_in'] = n_burn_in
+        convergence['n_steps'] = n_steps
+        convergence['acceptance_fraction'] = np.mean(sampler.acceptance_fraction)
+        convergence['elapsed_time'] = time.time() - start_time
+        convergence['time_budget'] = self.time_budget
+        convergence['stopped_by_time_budget'] = 'time_budget' in (burn_in_stopped_by, stopped_by)
+        convergence['early_stopping'] = self.early_stopping
+        convergence['tau_factor'] = self.tau_factor
+        convergence['stopped_by_convergence'] = stopped_by == 'convergence'
+        convergence['stopped_by'] = burn_in_stopped_by if burn_in_stopped_by is not None else stopped_by
+
+        # Extract the chain (the production steps actually run may be less than n_steps if time-bounded or early
+        # stopped, and the autocorrelation time may be not estimable if they are too few)
+        tau = self.__autocorr_time(sampler, quiet=True)
+        burnin = int(n_steps * 0.5)
+        thin = max(int(0.5 * np.nanmin(tau)), 1) if np.isfinite(tau).any() else 1
         chain = sampler.get_chain(discard=burnin, flat=True, thin=thin)
+        convergence['tau'] = tau
+        convergence['ess'] = self.__effective_sample_size(sampler, tau)
 
         # Get the draws to be used during replay
         draws = dict()
@@ -235,6 +389,7 @@ class MCMC:
         if environment.verbose:
             print('Extracting samples from posterior - ' + str(to_sample) + ' realizations')
 
+        rng = environment.random_stream(POSTERIOR_EXTRACTION)
         to_be_sampled = [True] * to_sample
         while any(to_be_sampled):
 
@@ -242,7 +397,7 @@ class MCMC:
             tbs = np.where(to_be_sampled)[0]
 
             # Get the new samples
-            draw = np.floor(np.random.uniform(0, len(chain), size=len(tbs))).astype(int)
+            draw = rng.integers(0, len(chain), size=len(tbs))
             samples = chain[draw]
 
             # For each sample...
@@ -283,6 +438,12 @@ class MCMC:
         twinning_results['draws'] = draws
         twinning_results['u2ss'] = model.model_parameters.u2ss
 
+        twinning_results['convergence'] = convergence
+
+        # Attach the surrogate statistics of the production chain
+        if self.surrogate:
+            twinning_results['surrogate'] = self.__surrogate_stats(surrogate_moves)
+
         # Attach also chain if needed
         if self.save_chains:
             twinning_results['sampler'] = sampler
@@ -296,11 +457,22 @@ class MCMC:
 
         return draws
 
-    def __run_chain(self, sampler, is_burn_in, state, rbg_data, environment, model):
+    def __run_chain(self, sampler, is_burn_in, deadline, state, rbg_data, environment, model, surrogate_moves):
         """
-        Utility function to run MCMC sampling
+        Utility function to run MCMC sampling. If deadline is not None, the chain is stopped (at least one step is
+        run) as soon as the time (as given by time.time()) exceeds it. If early stopping is enabled, the production
+        chain is also stopped as soon as it is converged (checked every `callback_ncheck` steps). Returns the
+        sampler, the last state, the number of steps run, and the reason why the chain was stopped before `n` steps
+        (i.e., 'time_budget', 'convergence', or None).
         """
 
+        # Train the surrogate during burn-in, and fit it once before the production chain so that it is fixed there
+        for move in surrogate_moves:
+            move.train = is_burn_in
+            move.reset_stats()
+        if surrogate_moves and not is_burn_in:
+            surrogate_moves[0].surrogate.fit()
+
         # If is the burn-in run...
         if is_burn_in:
             message = " - Running burn-in chain..."
@@ -314,6 +486,10 @@ class MCMC:
             # Also remember to reset the sampler
             sampler.reset()
 
+        # Check the convergence of the production chain only
+        early_stopping = self.early_stopping and not is_burn_in
+        stopped_by = None
+
         if environment.plot_mode:
             pbar = None
             first = True
@@ -340,6 +516,17 @@ class MCMC:
                 if environment.verbose:
                     pbar.update(self.callback_ncheck)
 
+                if sampler.iteration >= n:
+                    break
+
+                if early_stopping and self.__is_converged(sampler, environment):
+                    stopped_by = 'convergence'
+                    break
+
+                if deadline is not None and time.time() > deadline:
+                    stopped_by = 'time_budget'
+                    break
+
             pylab.close()
 
             if environment.verbose:
@@ -350,7 +537,20 @@ class MCMC:
             if environment.verbose:
                 print(message)
 
-            state = sampler.run_mcmc(state, n, progress=environment.verbose, skip_initial_state_check=True)
+            if deadline is None and not early_stopping:
+                state = sampler.run_mcmc(state, n, progress=environment.verbose, skip_initial_state_check=True)
+            else:
+                for state in sampler.sample(state, iterations=n, progress=environment.verbose,
+                                            skip_initial_state_check=True):
+                    if (early_stopping and sampler.iteration % self.callback_ncheck == 0
+                            and sampler.iteration < n and self.__is_converged(sampler, environment)):
+                        stopped_by = 'convergence'
+                        break
+                    if deadline is not None and time.time() > deadline and sampler.iteration < n:
+                        if environment.verbose:
+                            print("    - Time budget reached after {0} steps".format(sampler.iteration))
+                        stopped_by = 'time_budget'
+                        break
 
         if environment.verbose:
 
@@ -366,8 +566,82 @@ class MCMC:
                 )
             )
 
+            if surrogate_moves:
+                stats = self.__surrogate_stats(surrogate_moves)
+                print(
+                    "    - Surrogate: {0:.3f} of the proposals screened out, hit rate {1:.3f}, "
+                    "estimated speedup {2:.2f}x".format(
+                        stats['screened'], stats['hit_rate'], stats['speedup']
+                    )
+                )
+
         # Return results
-        return sampler, state
+        return sampler, state, min(sampler.iteration, n), stopped_by
+
+    def __is_converged(self, sampler, environment) -> bool:
+        """
+        Utility function that checks whether the production chain is converged, i.e., whether its retained half is
+        longer than `tau_factor` times its (largest) integrated autocorrelation time and has an effective sample size
+        of at least 1000 (i.e., the number of posterior draws).
+        """
+        tau = self.__autocorr_time(sampler, quiet=False)
+        if not np.isfinite(tau).all():
+            return False
+
+        n_retained = sampler.iteration - int(sampler.iteration * 0.5)
+        converged = (n_retained > self.tau_factor * np.max(tau)
+                     and self.__effective_sample_size(sampler, tau) >= 1000)
+
+        if converged and environment.verbose:
+            print("    - Chain converged after {0} steps (tau: {1:.3f} steps)".format(sampler.iteration, np.max(tau)))
+
+        return converged
+
+    @staticmethod
+    def __autocorr_time(sampler, quiet: bool) -> np.ndarray:
+        """
+        Utility function that returns the integrated autocorrelation time of each parameter, estimated on the
+        retained half of the production chain (i.e., the one the posterior draws are extracted from). If not
+        `quiet`, the estimate is returned even if the chain is too short for it to be reliable.
+        """
+        burnin = int(sampler.iteration * 0.5)
+        if quiet:
+            return sampler.get_autocorr_time(discard=burnin, quiet=True)
+        return sampler.get_autocorr_time(discard=burnin, tol=0)
+
+    @staticmethod
+    def __effective_sample_size(sampler, tau: np.ndarray) -> float:
+        """
+        Utility function that returns the effective sample size of the retained half of the production chain, given
+        its integrated autocorrelation time (of the worst mixing parameter). The walkers of the ensemble are not
+        independent chains, since each of them is moved along the differences between the others: the ensemble is
+        thus counted as one independent chain per parameter (i.e., per direction it can explore independently).
+        """
+        if not np.isfinite(tau).any():
+            return np.nan
+        return sampler.ndim * (sampler.iteration - int(sampler.iteration * 0.5)) / np.nanmax(tau)
+
+    @staticmethod
+    def __surrogate_stats(surrogate_moves: list) -> Dict:
+        """
+        Summarizes the statistics of the surrogate moves since their last reset, i.e., the fraction of the proposals
+        screened out by the surrogate (i.e., not simulated), the hit rate (i.e., the fraction of the simulated
+        proposals that are accepted), and the estimated speedup with respect to simulating all the proposals.
+        """
+        n_proposals = sum(move.n_proposals for move in surrogate_moves)
+        n_evaluations = sum(move.n_evaluations for move in surrogate_moves)
+        n_hits = sum(move.n_hits for move in surrogate_moves)
+        evaluation_time = sum(move.evaluation_time for move in surrogate_moves)
+        surrogate_time = sum(move.surrogate_time for move in surrogate_moves)
+
+        stats = dict()
+        stats['n_proposals'] = n_proposals
+        stats['n_evaluations'] = n_evaluations
+        stats['screened'] = 1 - n_evaluations / n_proposals if n_proposals > 0 else np.nan
+        stats['hit_rate'] = n_hits / n_evaluations if n_evaluations > 0 else np.nan
+        stats['speedup'] = (n_proposals * evaluation_time / n_evaluations / (evaluation_time + surrogate_time)
+                            if n_evaluations > 0 else np.nan)
+        return stats
 
     @staticmethod
     def __subsample(draws: Dict,
@@ -415,34 +689,11 @@ class MCMC:
             draws[model.unknown_parameters[up]]['samples_' + str(10)] = np.empty(10)
             draws[model.unknown_parameters[up]]['samples_' + str(1)] = np.empty(1)
 
-        model = copy.copy(model)
-        environment = copy.copy(environment)
-        rbg_data = copy.copy(rbg_data)
-
-        # Set "fake" environment core variable for simulation
-        environment.modality = 'replay'
-
-        # Test 1: "if no insulin is injected, BG must go above 300 mg/dl in 1000 min"
-        iterations = range(0, 1000)
-
-        # Set simulation data
-        # rbg_data = ReplayBGData(data=data, rbg=rbg_fake)
-
         glucose = dict()
-        glucose['realizations'] = np.zeros(shape=(1000, model.tsteps))
-
-        # For each parameter set...
-        for r in iterations:
-
-            # set the model parameters
-            for p in model.unknown_parameters:
-                setattr(model.model_parameters, p, draws[p]['samples_1000'][r])
-            model.model_parameters.kgri = model.model_parameters.kempt
 
-            glucose['realizations'][r] = model.simulate(rbg_data=rbg_data,
-                                                        modality='twinning',
-                                                        environment=environment,
-                                                        dss=None)
+        # Simulate all the parameter sets at once
+        thetas = np.column_stack([draws[p]['samples_1000'] for p in model.unknown_parameters])
+        glucose['realizations'] = model.simulate_ensemble(thetas=thetas, rbg_data=rbg_data)
 
         glucose_prc = dict()
         for p in range(0, 100):
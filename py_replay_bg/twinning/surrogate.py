@@ -0,0 +1,310 @@
+import time
+
+import numpy as np
+
+from emcee.moves import RedBlueMove
+from emcee.state import State
+
+from py_replay_bg.twinning.early_rejection import EarlyRejectionMove
+
+
+class QuadraticSurrogate:
+    """
+    A cheap emulator of the log posterior, i.e., a quadratic polynomial of the (standardized) unknown parameters fitted
+    by least squares on the best half of the last evaluated points.
+
+    ...
+    Attributes
+    ----------
+    n_dim: int
+        The number of unknown parameters.
+    n_features: int
+        The number of coefficients of the quadratic polynomial.
+    n_train: int
+        The maximum number of (most recent) evaluated points used to fit the polynomial.
+    thetas: np.ndarray
+        The evaluated points.
+    log_probs: np.ndarray
+        The log posterior of the evaluated points.
+    is_fitted: bool
+        Whether the polynomial has been fitted at least once.
+
+    Methods
+    -------
+    update(thetas, log_probs)
+        Adds the given evaluated points (only the ones with a finite log posterior are retained).
+    fit()
+        Fits the polynomial on the best half of the retained points, if they are enough.
+    predict(thetas)
+        Returns the emulated log posterior of the given points (clipped to the range of the fitted points).
+    """
+
+    def __init__(self,
+                 n_dim: int,
+                 n_train: int | None = None):
+        """
+        Constructs all the necessary attributes for the QuadraticSurrogate object.
+
+        Parameters
+        ----------
+        n_dim: int
+            The number of unknown parameters.
+        n_train: int, optional, default : None
+            The maximum number of (most recent) evaluated points used to fit the polynomial. If None, it is set to 25
+            times the number of coefficients of the polynomial.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        self.n_dim = n_dim
+        self.n_features = (n_dim + 1) * (n_dim + 2) // 2
+        self.n_train = 25 * self.n_features if n_train is None else n_train
+
+        self.thetas = np.empty((0, n_dim))
+        self.log_probs = np.empty(0)
+        self.is_fitted = False
+
+        self.__mean = np.zeros(n_dim)
+        self.__std = np.ones(n_dim)
+        self.__coef = np.zeros(self.n_features)
+        self.__range = (-np.inf, np.inf)
+        self.__rows, self.__cols = np.triu_indices(n_dim)
+
+    def update(self, thetas: np.ndarray, log_probs: np.ndarray) -> None:
+        """
+        Adds the given evaluated points (only the ones with a finite log posterior are retained).
+        """
+        finite = np.isfinite(log_probs)
+        self.thetas = np.vstack([self.thetas, thetas[finite]])[-self.n_train:]
+        self.log_probs = np.concatenate([self.log_probs, log_probs[finite]])[-self.n_train:]
+
+    def fit(self) -> None:
+        """
+        Fits the polynomial on the best half of the retained points, if they are at least twice the number of its
+        coefficients.
+        """
+        # Fit only the best half of the points, i.e., the region where the proposals compete for acceptance
+        best = self.log_probs >= np.median(self.log_probs)
+        if best.sum() < 2 * self.n_features:
+            return
+        thetas, log_probs = self.thetas[best], self.log_probs[best]
+        self.__mean = thetas.mean(axis=0)
+        std = thetas.std(axis=0)
+        self.__std = np.where(std > 0, std, 1.0)
+        self.__coef = np.linalg.lstsq(self.__features(thetas), log_probs, rcond=None)[0]
+        self.__range = (log_probs.min(), log_probs.max())
+        self.is_fitted = True
+
+    def predict(self, thetas: np.ndarray) -> np.ndarray:
+        """
+        Returns the emulated log posterior of the given points, clipped to the range of the fitted points so that the
+        walkers far from them (where the polynomial extrapolates) are not stuck.
+        """
+        return np.clip(self.__features(thetas) @ self.__coef, *self.__range)
+
+    def __features(self, thetas: np.ndarray) -> np.ndarray:
+        """
+        Internal function that returns the quadratic features (i.e., 1, z_i, z_i * z_j with i <= j) of the given
+        points, z being the standardized parameters.
+        """
+        z = (np.atleast_2d(thetas) - self.__mean) / self.__std
+        return np.hstack([np.ones((z.shape[0], 1)), z, z[:, self.__rows] * z[:, self.__cols]])
+
+
+class SurrogateMove(EarlyRejectionMove):
+    """
+    An emcee red-blue move that wraps another red-blue move (e.g., `DEMove` or `DESnookerMove`) and evaluates its
+    proposals with two-stage delayed acceptance (Christen and Fox, 2005).
+
+    Each proposal is first screened with the Metropolis test on the surrogate log posterior s. Only the proposals that
+    pass it are evaluated with the actual log posterior, and accepted with probability
+    `min(1, exp(log_prob(q) - log_prob(x) - s(q) + s(x)))`, so that the chain targets the actual posterior as long as
+    s is kept fixed. As in `EarlyRejectionMove`, the second-stage threshold is drawn first and passed to the log
+    probability function. While training (or until the surrogate is fitted), the proposals are not screened: they are
+    all evaluated, without bounds, as the standard red-blue move does, and used to train the surrogate.
+
+    ...
+    Attributes
+    ----------
+    surrogate: QuadraticSurrogate
+        The surrogate of the log posterior (it can be shared among moves).
+    train: bool
+        Whether to evaluate all the proposals and add them to the training points of the surrogate (instead of
+        screening them). The surrogate must be fitted (see `QuadraticSurrogate.fit`) after training.
+    n_proposals: int
+        The number of generated proposals.
+    n_evaluations: int
+        The number of proposals evaluated with the actual log posterior.
+    n_hits: int
+        The number of proposals accepted after being evaluated with the actual log posterior.
+    evaluation_time: float
+        The time spent evaluating the actual log posterior [s].
+    surrogate_time: float
+        The time spent evaluating (and fitting) the surrogate [s].
+
+    Methods
+    -------
+    propose(model, state)
+        Generates the proposals and evaluates them with two-stage delayed acceptance.
+    reset_stats()
+        Resets the counters and the timers.
+    """
+
+    def __init__(self,
+                 move: RedBlueMove,
+                 log_prob_fn,
+                 args: tuple,
+                 surrogate: QuadraticSurrogate,
+                 train: bool = True):
+        """
+        Constructs all the necessary attributes for the SurrogateMove object.
+
+        Parameters
+        ----------
+        move: RedBlueMove
+            The wrapped move, used to generate the proposals.
+        log_prob_fn: Callable
+            The function `log_prob_fn(coords, *args, lp_min=lp_min)` that returns the log probability of each row of
+            coords, or any value not greater than the corresponding lp_min if that row is rejected.
+        args: tuple
+            The additional arguments of `log_prob_fn`.
+        surrogate: QuadraticSurrogate
+            The surrogate of the log posterior (it can be shared among moves).
+        train: bool, optional, default : True
+            Whether to evaluate all the proposals and add them to the training points of the surrogate (instead of
+            screening them).
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        super().__init__(move, log_prob_fn, args)
+        self.surrogate = surrogate
+        self.train = train
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        """
+        Resets the counters and the timers.
+        """
+        self.n_proposals = 0
+        self.n_evaluations = 0
+        self.n_hits = 0
+        self.evaluation_time = 0.0
+        self.surrogate_time = 0.0
+
+    def propose(self, model, state):
+        """
+        Generates the proposals and evaluates them with two-stage delayed acceptance. Mirrors
+        `EarlyRejectionMove.propose`.
+
+        Parameters
+        ----------
+        model: emcee.model.Model
+            The emcee model (used for its random number generator only).
+        state: emcee.State
+            The current state of the walkers.
+
+        Returns
+        -------
+        state: emcee.State
+            The new state of the walkers.
+        accepted: np.ndarray
+            A boolean array flagging the walkers whose proposal has been accepted.
+
+        Raises
+        ------
+        RuntimeError
+            If the number of walkers is smaller than twice the number of dimensions (see `RedBlueMove`).
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        n_walkers, n_dim = state.coords.shape
+        if n_walkers < 2 * n_dim and not self.live_dangerously:
+            raise RuntimeError("It is unadvisable to use a red-blue move with fewer walkers than twice the number of "
+                               "dimensions.")
+
+        self.setup(state.coords)
+
+        # Split the ensemble and update each sub-ensemble using the others as complementary ensemble
+        accepted = np.zeros(n_walkers, dtype=bool)
+        all_inds = np.arange(n_walkers)
+        inds = all_inds % self.nsplits
+        if self.randomize_split:
+            model.random.shuffle(inds)
+        for split in range(self.nsplits):
+            S1 = inds == split
+            j = all_inds[S1]
+
+            sets = [state.coords[inds == k] for k in range(self.nsplits)]
+            s = sets[split]
+            c = sets[:split] + sets[split + 1:]
+
+            q, factors = self.get_proposal(s, c, model.random)
+            log_prob = state.log_prob[j]
+
+            # First stage: screen the proposals with the surrogate (walkers not yet in the support of the posterior
+            # always reach the second stage)
+            tic = time.perf_counter()
+            if self.surrogate.is_fitted and not self.train:
+                s_diff = self.surrogate.predict(q) - self.surrogate.predict(s)
+                to_evaluate = (factors + s_diff > np.log(model.random.rand(q.shape[0]))) | ~np.isfinite(log_prob)
+                s_diff = np.where(np.isfinite(log_prob), s_diff, 0.0)
+            else:
+                s_diff = np.zeros(q.shape[0]) - factors
+                to_evaluate = np.ones(q.shape[0], dtype=bool)
+            self.surrogate_time += time.perf_counter() - tic
+
+            # Second stage: evaluate the remaining proposals against their acceptance threshold (without bounds if
+            # training, so that the surrogate learns also from the rejected proposals)
+            lp_min = log_prob + s_diff + np.log(model.random.rand(q.shape[0]))
+            new_log_probs = np.full(q.shape[0], -np.inf)
+            if to_evaluate.any():
+                bound = np.full(to_evaluate.sum(), -np.inf) if self.train else lp_min[to_evaluate]
+                tic = time.perf_counter()
+                new_log_probs[to_evaluate] = self.log_prob_fn(q[to_evaluate], *self.args, lp_min=bound)
+                self.evaluation_time += time.perf_counter() - tic
+            accepted[j] = to_evaluate & (new_log_probs > lp_min)
+
+            self.n_proposals += q.shape[0]
+            self.n_evaluations += int(to_evaluate.sum())
+            self.n_hits += int(accepted[j].sum())
+
+            if self.train:
+                self.surrogate.update(q, new_log_probs)
+
+            new_state = State(q, log_prob=new_log_probs)
+            state = self.update(state, new_state, accepted, S1)
+
+        return state, accepted
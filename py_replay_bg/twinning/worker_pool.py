@@ -0,0 +1,282 @@
+import os
+from multiprocessing import get_all_start_methods, get_context, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Iterable
+
+import numba
+import numpy as np
+
+
+# The function evaluated by the workers and its arguments, set once per twinning procedure by `WorkerPool.broadcast`
+_func = None
+_args = ()
+_shared_args = None
+_barrier = None
+
+
+class SharedArrays:
+    """
+    A tuple of arguments whose numpy arrays are placed in a single block of shared memory, so that the worker
+    processes attach to them as read-only views instead of receiving (and holding) their own copies. Only the name of
+    the block and the layout of the arrays are pickled.
+
+    ...
+    Attributes
+    ----------
+    name: str
+        The name of the shared memory block.
+    layout: list
+        For each argument, either (True, (shape, dtype, offset)) of its array in the block, or (False, argument) if it
+        is not a numpy array.
+
+    Methods
+    -------
+    attach()
+        Returns the arguments, with the arrays as read-only views of the shared memory block.
+    close()
+        Detaches the shared memory block from the current process.
+    unlink()
+        Detaches and frees the shared memory block (to be called by the process that created it).
+    """
+
+    # Alignment (in bytes) of the arrays in the shared memory block
+    ALIGNMENT = 64
+
+    def __init__(self, args: tuple):
+        """
+        Constructs all the necessary attributes for the SharedArrays object, copying the arrays of args to a new shared
+        memory block.
+
+        Parameters
+        ----------
+        args: tuple
+            The arguments to share.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        self.layout = []
+        size = 0
+        for arg in args:
+            if isinstance(arg, np.ndarray):
+                self.layout.append((True, (arg.shape, arg.dtype.str, size)))
+                size += -(-arg.nbytes // self.ALIGNMENT) * self.ALIGNMENT
+            else:
+                self.layout.append((False, arg))
+
+        self.__shm = SharedMemory(create=True, size=max(size, 1))
+        self.name = self.__shm.name
+        for arg, (is_array, spec) in zip(args, self.layout):
+            if is_array:
+                shape, dtype, offset = spec
+                np.ndarray(shape, dtype=dtype, buffer=self.__shm.buf, offset=offset)[...] = arg
+
+    def __getstate__(self):
+        return dict(name=self.name, layout=self.layout)
+
+    def __setstate__(self, state):
+        self.name = state['name']
+        self.layout = state['layout']
+        self.__shm = None
+
+    def attach(self) -> tuple:
+        """
+        Returns the arguments, with the arrays as read-only views of the shared memory block.
+        """
+        if self.__shm is None:
+            self.__shm = SharedMemory(name=self.name)
+        args = []
+        for is_array, spec in self.layout:
+            if is_array:
+                shape, dtype, offset = spec
+                arg = np.ndarray(shape, dtype=dtype, buffer=self.__shm.buf, offset=offset)
+                arg.flags.writeable = False
+                args.append(arg)
+            else:
+                args.append(spec)
+        return tuple(args)
+
+    def close(self) -> None:
+        """
+        Detaches the shared memory block from the current process.
+        """
+        if self.__shm is not None:
+            self.__shm.close()
+            self.__shm = None
+
+    def unlink(self) -> None:
+        """
+        Detaches and frees the shared memory block (to be called by the process that created it).
+        """
+        if self.__shm is not None:
+            self.__shm.unlink()
+        self.close()
+
+
+def _start_method() -> str | None:
+    """
+    Returns the start method of the worker processes: the default one of the platform (i.e., 'fork' on Linux), unless
+    the numba threading layer (used by the parallel kernels) is already running in the current process, which is then
+    not safe to fork. In that case, the workers are forked from a clean server process ('forkserver'), which, as
+    'spawn', requires the main module of the script to be guarded by `if __name__ == '__main__'`.
+    """
+    try:
+        numba.threading_layer()
+    except ValueError:
+        # The threading layer has not been started
+        return None
+    return 'forkserver' if 'forkserver' in get_all_start_methods() else None
+
+
+def _init_worker(barrier) -> None:
+    """
+    Initializer of the worker processes: stores the barrier used to broadcast the function to evaluate.
+    """
+    global _barrier
+    _barrier = barrier
+
+
+def _set_function(func: Callable, args: tuple) -> None:
+    """
+    Stores the function to evaluate and its arguments in the worker process, then waits for all the other workers to
+    do the same (so that each worker receives them exactly once).
+    """
+    global _func, _args, _shared_args
+    _func, _args = func, args
+
+    # Attach to the arrays in shared memory (detaching from the previous ones, if any)
+    if _shared_args is not None:
+        _shared_args.close()
+        _shared_args = None
+    if isinstance(args, SharedArrays):
+        _shared_args = args
+        _args = args.attach()
+
+    _barrier.wait()
+
+
+def evaluate(theta: np.ndarray) -> float:
+    """
+    Evaluates the broadcast function at `theta`, i.e., `func(theta, *args)`. To be mapped over the worker pool in place
+    of `func`, so that only `theta` is sent to the workers.
+    """
+    return _func(theta, *_args)
+
+
+class WorkerPool:
+    """
+    A persistent pool of worker processes to be reused across twinning procedures.
+
+    The function to evaluate (e.g., the compiled log posterior) and its (possibly large) arguments are sent to each
+    worker only once per twinning procedure via `broadcast`. Then, `evaluate` is mapped over the pool instead of the
+    function itself, so that each task carries just the parameter vector. Optionally, the arrays among the arguments
+    are placed in shared memory (see `SharedArrays`), so that all the workers read the same copy of the data.
+
+    ...
+    Attributes
+    ----------
+    n_processes: int
+        The number of worker processes.
+
+    Methods
+    -------
+    broadcast(func, args, shared_memory)
+        Sends the function to evaluate and its arguments to all the workers.
+    map(func, iterable)
+        Applies `func` to each element of `iterable` in parallel (as `multiprocessing.Pool.map`).
+    starmap(func, iterable)
+        Applies `func` to each tuple of arguments of `iterable` in parallel (as `multiprocessing.Pool.starmap`).
+    close()
+        Terminates the worker processes.
+    """
+
+    def __init__(self, n_processes: int | None = None):
+        """
+        Constructs all the necessary attributes for the WorkerPool object and starts the worker processes.
+
+        Parameters
+        ----------
+        n_processes: int, optional, default : None
+            The number of worker processes. If None, the number of CPU cores is used.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        None
+
+        See Also
+        --------
+        None
+
+        Examples
+        --------
+        None
+        """
+        self.n_processes = os.cpu_count() if n_processes is None else n_processes
+
+        # Start the resource tracker before the workers, so that they share it with this process (otherwise, the
+        # tracker of each worker would free the shared memory blocks it attached to as leaked when the worker exits)
+        resource_tracker.ensure_running()
+
+        # Forking the current process is not safe once the numba threading layer is running (see _start_method)
+        context = get_context(_start_method())
+        barrier = context.Barrier(self.n_processes)
+        self.__pool = context.Pool(processes=self.n_processes, initializer=_init_worker, initargs=(barrier,))
+        self.__shared_args = None
+
+    def broadcast(self, func: Callable, args: tuple, shared_memory: bool = False) -> None:
+        """
+        Sends the function to evaluate and its arguments to all the workers (exactly one task per worker, since each
+        worker blocks on a barrier until all the others have received theirs). If `shared_memory`, the arrays among
+        the arguments are placed in shared memory and the workers get read-only views of them instead of copies.
+        """
+        self.__free_shared_args()
+        if shared_memory:
+            self.__shared_args = SharedArrays(args)
+            args = self.__shared_args
+        self.__pool.starmap(_set_function, [(func, args)] * self.n_processes, chunksize=1)
+
+    def map(self, func: Callable, iterable: Iterable) -> list:
+        """
+        Applies `func` to each element of `iterable` in parallel (as `multiprocessing.Pool.map`).
+        """
+        return self.__pool.map(func, iterable)
+
+    def starmap(self, func: Callable, iterable: Iterable) -> list:
+        """
+        Applies `func` to each tuple of arguments of `iterable` in parallel (as `multiprocessing.Pool.starmap`).
+        """
+        return self.__pool.starmap(func, iterable)
+
+    def close(self) -> None:
+        """
+        Terminates the worker processes.
+        """
+        self.__pool.terminate()
+        self.__pool.join()
+        self.__free_shared_args()
+
+    def __free_shared_args(self) -> None:
+        """
+        Internal function that frees the shared memory block of the last broadcast arguments (if any). The workers
+        still attached to it keep their mapping until they detach.
+        """
+        if self.__shared_args is not None:
+            self.__shared_args.unlink()
+            self.__shared_args = None
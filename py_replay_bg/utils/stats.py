@@ -105,6 +105,111 @@ def log_gamma(x, alpha, beta):
     return -np.inf if x < 0 else np.log((beta ** alpha * x ** (alpha - 1) * math.exp(-beta * x)) / math.gamma(alpha))
 
 
+@njit(fastmath=True)
+def d_log_lognorm(x, mu, sigma):
+    """
+    Computes the derivative with respect to x of the logarithm of the log-normal pdf evaluated at given x with given
+    mu and sigma.
+
+    Parameters
+    ----------
+    x: float
+        The value where to evaluate the derivative.
+    mu: float
+        The mean of the log-normal distribution.
+    sigma: float
+        The standard deviation of the log-normal distribution.
+
+    Returns
+    -------
+    d_ll_norm: float
+        The derivative of the logarithm of the log-normal pdf evaluated at given x with given mu and sigma.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    log_lognorm
+
+    Examples
+    --------
+    None
+    """
+    return - (1 + (np.log(x) - mu) / (sigma ** 2)) / x
+
+
+@njit(fastmath=True)
+def d_log_norm(x, mu, sigma):
+    """
+    Computes the derivative with respect to x of the logarithm of the normal pdf evaluated at given x with given mu
+    and sigma.
+
+    Parameters
+    ----------
+    x: float
+        The value where to evaluate the derivative.
+    mu: float
+        The mean of the normal distribution.
+    sigma: float
+        The standard deviation of the normal distribution.
+
+    Returns
+    -------
+    d_l_norm: float
+        The derivative of the logarithm of the normal pdf evaluated at given x with given mu and sigma.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    log_norm
+
+    Examples
+    --------
+    None
+    """
+    return - (x - mu) / (sigma ** 2)
+
+
+@njit(fastmath=True)
+def d_log_gamma(x, alpha, beta):
+    """
+    Computes the derivative with respect to x of the logarithm of the gamma pdf evaluated at given x with given alpha
+    and beta.
+
+    Parameters
+    ----------
+    x: float
+        The value where to evaluate the derivative.
+    alpha: float
+        The alpha value of the gamma distribution at hand.
+    beta: float
+        The beta value of the gamma distribution at hand.
+
+    Returns
+    -------
+    d_l_gam: float
+        The derivative of the logarithm of the gamma pdf evaluated at given x with given alpha and beta.
+
+    Raises
+    ------
+    None
+
+    See Also
+    --------
+    log_gamma
+
+    Examples
+    --------
+    None
+    """
+    return (alpha - 1) / x - beta
+
+
 @njit(fastmath=True)
 def sigmoid(x: float) -> float:
     return 1.0 / (1.0 + safe_exp(-x))